@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# (c) Copyright 2013 to 2017 University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Compare the JSON backends of hydra_base.util.jsonutil on the two paths
+    where most JSON is handled:
+
+    bulk insert:  a network, with a layout on each node and link and a
+                  timeseries on each node, arrives as JSON text, is decoded
+                  into a JSONObject and added with add_network.
+    network load: the network is fetched with all its data by get_network
+                  and returned as JSON text.
+
+    A temporary SQLite database is used. Each backend which is installed is
+    measured, starting with the standard library.
+
+    usage:
+        python benchmarks/json_backends.py [--nodes 1000] [--steps 365] [--repeat 5]
+"""
+import argparse
+import datetime
+import json
+import os
+import tempfile
+import time
+
+import hydra_base as hb
+from hydra_base.lib.objects import JSONObject
+from hydra_base.util import jsonutil
+
+USER_ID = 1
+
+def connect():
+    """
+        Create a temporary database, with the default users and units
+    """
+    db_file = os.path.join(tempfile.mkdtemp(), 'json_benchmark.db')
+    hb.db.connect('sqlite:///%s' % db_file)
+    hb.util.hdb.create_default_users_and_perms()
+    hb.util.hdb.create_default_units_and_dimensions()
+    hb.util.hdb.make_root_user()
+    hb.commit_transaction()
+    return db_file
+
+def make_network_json(project_id, attr_id, num_nodes, num_steps):
+    """
+        Make the JSON text of a network of nodes in a line, each with a layout
+        and a daily timeseries in a single scenario.
+    """
+    dates = [(datetime.datetime(2000, 1, 1) + datetime.timedelta(days=d)).isoformat()
+             for d in range(num_steps)]
+
+    nodes, links, rscens = [], [], []
+    for n in range(1, num_nodes + 1):
+        nodes.append({
+            'id': -n,
+            'name': 'Node %s' % n,
+            'x': n,
+            'y': n % 100,
+            'layout': {'color': 'blue', 'size': n % 10, 'label': {'text': 'Node %s' % n}},
+            'attributes': [{'id': -n, 'attr_id': attr_id, 'attr_is_var': 'N'}],
+        })
+        if n > 1:
+            links.append({
+                'id': -n,
+                'name': 'Link %s' % n,
+                'node_1_id': -(n - 1),
+                'node_2_id': -n,
+                'layout': {'color': 'black', 'width': 2},
+            })
+        rscens.append({
+            'resource_attr_id': -n,
+            'dataset': {
+                'name': 'Flow %s' % n,
+                'type': 'timeseries',
+                'unit_id': None,
+                'metadata': {'source': 'benchmark'},
+                'value': json.dumps({'0': {d: float(n * i) for i, d in enumerate(dates)}}),
+            },
+        })
+
+    network = {
+        'name': 'JSON benchmark %s' % datetime.datetime.now(),
+        'project_id': project_id,
+        'nodes': nodes,
+        'links': links,
+        'scenarios': [{'name': 'Baseline', 'resourcescenarios': rscens}],
+    }
+
+    return json.dumps(network)
+
+def bulk_insert(network_json):
+    network = JSONObject(jsonutil.loads(network_json))
+    network_id = hb.add_network(network, user_id=USER_ID).id
+    hb.commit_transaction()
+    return network_id
+
+def load_network(network_id):
+    network = hb.get_network(network_id, include_data=True, user_id=USER_ID)
+    text = JSONObject(network).as_json()
+    hb.db.close_session()
+    return text
+
+def measure(func, args_list):
+    timings = []
+    for args in args_list:
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=1000,
+                        help="The number of nodes in the network")
+    parser.add_argument('--steps', type=int, default=365,
+                        help="The number of steps in the timeseries on each node")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="The number of times to run each step. The fastest is reported.")
+    args = parser.parse_args()
+
+    db_file = connect()
+
+    project_id = hb.add_project(JSONObject({'name': 'JSON benchmark'}), user_id=USER_ID).id
+    attr_id = hb.add_attribute(JSONObject({'name': 'flow', 'dimension_id': None}), user_id=USER_ID).id
+    hb.commit_transaction()
+
+    print("Network of %s nodes with %s step timeseries, best of %s, using %s" %
+          (args.nodes, args.steps, args.repeat, db_file))
+    print("%-10s %22s %22s" % ("backend", "bulk insert (nodes/s)", "network load (nodes/s)"))
+
+    results = {}
+    for backend in jsonutil.BACKENDS[::-1]:
+        if jsonutil.configure_backend(backend) != backend:
+            continue
+
+        inputs = [(make_network_json(project_id, attr_id, args.nodes, args.steps),)
+                  for _ in range(args.repeat)]
+        insert_time, network_id = measure(bulk_insert, inputs)
+        load_time, _ = measure(load_network, [(network_id,)] * args.repeat)
+
+        results[backend] = (insert_time, load_time)
+        print("%-10s %22.0f %22.0f" % (backend, args.nodes / insert_time, args.nodes / load_time))
+
+    base_insert, base_load = results['json']
+    for backend, (insert_time, load_time) in results.items():
+        if backend != 'json':
+            print("%s speedup: bulk insert %.2fx, network load %.2fx" %
+                  (backend, base_insert / insert_time, base_load / load_time))
+
+if __name__ == '__main__':
+    main()
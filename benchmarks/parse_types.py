@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# (c) Copyright 2013 to 2017 University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Measure how quickly values of each hydra type are parsed and validated,
+    as they are when datasets are added.
+
+    Timeseries are also parsed with the previous method, which validated
+    each date in the JSON with pd.Timestamp, for comparison.
+
+    usage:
+        python benchmarks/parse_types.py [--steps 87600] [--repeat 5]
+"""
+import argparse
+import collections
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from hydra_base.lib.HydraTypes.Registry import HydraObjectFactory
+
+def make_values(steps):
+    """
+        A value of each type, the timeseries and dataframe with 'steps' rows
+    """
+    dates = pd.date_range('2000-01-01', periods=steps, freq='H')
+    flows = np.random.rand(steps)
+
+    timeseries = json.dumps({"0": dict(zip(dates.strftime('%Y-%m-%dT%H:%M:%S.000000000Z'),
+                                           flows.tolist()))})
+    dataframe = json.dumps({"flow": dict(zip(map(str, range(steps)), flows.tolist())),
+                            "demand": dict(zip(map(str, range(steps)), flows.tolist()))})
+
+    return collections.OrderedDict([
+        ('scalar', '1.5'),
+        ('descriptor', 'a descriptor'),
+        ('array', json.dumps(flows.tolist())),
+        ('timeseries', timeseries),
+        ('dataframe', dataframe),
+    ])
+
+def parse_timeseries_per_date(value):
+    """
+        Parse and validate a timeseries as it was done before validation
+        was vectorised, for comparison.
+    """
+    ordered_jo = json.loads(value, object_pairs_hook=collections.OrderedDict)
+    ts = pd.DataFrame.from_dict(ordered_jo)
+    text = ts.to_json(date_format='iso', date_unit='ns')
+    for k, v in json.loads(text, object_pairs_hook=collections.OrderedDict).items():
+        for date in v.keys():
+            pd.Timestamp(date.replace('9999', '1678'))
+    return ts.to_json(date_format='iso', date_unit='ns')
+
+def run(label, parse, value, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(value)
+        timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    print("%-26s %10.4fs %14.0f values/s" % (label, best, 1/best))
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--steps', type=int, default=87600,
+                        help="The number of rows in the timeseries and dataframe")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="The number of times to parse each value. The fastest is reported.")
+    args = parser.parse_args()
+
+    print("Parsing values of %s steps, best of %s" % (args.steps, args.repeat))
+
+    values = make_values(args.steps)
+    for data_type, value in values.items():
+        run(data_type, lambda v: HydraObjectFactory.valueFromDataset(data_type, v),
+            value, args.repeat)
+
+    previous = run('timeseries (per date)', parse_timeseries_per_date,
+                   values['timeseries'], args.repeat)
+    current = run('timeseries', lambda v: HydraObjectFactory.valueFromDataset('timeseries', v),
+                  values['timeseries'], args.repeat)
+    print("Timeseries speedup: %.1fx" % (previous / current))
+
+if __name__ == '__main__':
+    main()
@@ -34,6 +34,13 @@ import transaction
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+import threading
+from six.moves.queue import Queue, Empty
+try:
+    from zope.sqlalchemy.datamanager import _SESSION_STATE, STATUS_CHANGED
+except ImportError:
+    _SESSION_STATE, STATUS_CHANGED = {}, None
+
 import logging
 log = logging.getLogger(__name__)
 
@@ -156,3 +163,91 @@ def close_session():
 
 def rollback_transaction():
     transaction.abort()
+
+def can_read_concurrently():
+    """
+        Check whether reads can be spread over several connections and still
+        see the same data as the current session. This is not the case on an
+        in-memory sqlite database, where each connection has a database of its
+        own, or if the current transaction has changes which have not been
+        committed, as other connections can't see them.
+    """
+    if engine is None:
+        return False
+
+    if engine.dialect.name == 'sqlite' and engine.url.database in (None, '', ':memory:'):
+        return False
+
+    session = DBSession()
+    if len(session.new) > 0 or len(session.dirty) > 0 or len(session.deleted) > 0:
+        return False
+
+    #zope.sqlalchemy records whether the session has written
+    #anything in the current transaction.
+    if _SESSION_STATE.get(session) is STATUS_CHANGED:
+        return False
+
+    return True
+
+def run_concurrent_reads(tasks, workers):
+    """
+        Run a set of independent read functions on up to 'workers' threads.
+        Each thread has its own session, and so its own connection from the
+        pool, which is rolled back and returned to the pool when it finishes.
+
+        On MySQL, each thread reads from a consistent snapshot. All the threads
+        start their snapshots before any of them runs a read, so the reads
+        all see the database as it was at the same moment, unless a write
+        is committed in the short time it takes to start the snapshots.
+
+        args:
+            tasks (dict): The functions to run, as name: (function, args)
+            workers (int): The maximum number of threads to use
+        returns:
+            A dict of the result of each function, keyed on its name.
+            If any function raises an exception, it is raised here.
+    """
+    workers = max(1, min(workers, len(tasks)))
+
+    task_queue = Queue()
+    for name in tasks:
+        task_queue.put(name)
+
+    results = {}
+    errors = []
+    snapshots_started = threading.Barrier(workers)
+
+    def run_tasks():
+        try:
+            if engine.dialect.name == 'mysql':
+                DBSession.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+
+            snapshots_started.wait()
+
+            while len(errors) == 0:
+                try:
+                    name = task_queue.get_nowait()
+                except Empty:
+                    break
+                func, args = tasks[name]
+                results[name] = func(*args)
+        except threading.BrokenBarrierError:
+            pass
+        except Exception as e:
+            log.exception(e)
+            errors.append(e)
+            snapshots_started.abort()
+        finally:
+            transaction.abort()
+            DBSession.remove()
+
+    threads = [threading.Thread(target=run_tasks) for i in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if len(errors) > 0:
+        raise errors[0]
+
+    return results
@@ -0,0 +1,44 @@
+"""scenario_copy_on_write
+
+Revision ID: c4f2a9e1b7d3
+Revises: 35088e32c557
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import logging
+log = logging.getLogger(__name__)
+
+# revision identifiers, used by Alembic.
+revision = 'c4f2a9e1b7d3'
+down_revision = '35088e32c557'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # ### tScenario
+    # A constant default means sqlite can add the column without copying the table
+    try:
+        op.add_column('tScenario', sa.Column('copy_on_write', sa.String(1), nullable=False, server_default=sa.text(u"'N'")))
+    except Exception as e:
+        log.exception(e)
+
+def downgrade():
+    if op.get_bind().dialect.name == 'mysql':
+
+        # ### tScenario
+        try:
+            op.drop_column('tScenario', 'copy_on_write')
+        except Exception as e:
+            log.exception(e)
+
+    else: ## sqlite
+
+        try:
+            with op.batch_alter_table('tScenario') as batch_op:
+                batch_op.drop_column('copy_on_write')
+        except Exception as e:
+            log.exception(e)
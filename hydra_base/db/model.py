@@ -46,16 +46,21 @@ from sqlalchemy.orm import relationship, backref
 from . import DeclarativeBase as Base, get_session
 
 from ..util import generate_data_hash, get_val
+from ..util import jsonutil
 
 from sqlalchemy.sql.expression import case
-from sqlalchemy import UniqueConstraint, and_
+from sqlalchemy import UniqueConstraint, and_, type_coerce, select, literal
 from sqlalchemy.dialects import mysql
 
 import pandas as pd
 
 from sqlalchemy.orm import validates
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import event
+from sqlalchemy.types import TypeDecorator
+
+from ..lib.HydraTypes.Codecs import encode_value, decode_value
 
-import json
 from .. import config
 import logging
 import bcrypt
@@ -227,6 +232,24 @@ class PermissionControlled(object):
                              (user_id, self.id))
 
 
+class DatasetValue(TypeDecorator):
+    """
+        The value of a dataset. Values which were stored compressed, by one
+        of the codecs in HydraTypes.Codecs, are decoded to their JSON text
+        when they are read. Values are encoded, using the codecs of the
+        dataset's type, before a Dataset is inserted or updated (see
+        _encode_dataset_value).
+    """
+    impl = Text
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'mysql':
+            return dialect.type_descriptor(mysql.LONGTEXT())
+        return dialect.type_descriptor(Text())
+
+    def process_result_value(self, value, dialect):
+        return decode_value(value)
+
 #***************************************************
 # Classes definition
 #***************************************************
@@ -266,7 +289,7 @@ class Dataset(Base, Inspect, PermissionControlled, AuditMixin):
     hash       = Column(BIGINT(),  nullable=False, unique=True)
     cr_date    = Column(TIMESTAMP(),  nullable=False, server_default=text(u'CURRENT_TIMESTAMP'))
     hidden     = Column(String(1),  nullable=False, server_default=text(u"'N'"))
-    value      = Column('value', Text().with_variant(mysql.LONGTEXT, 'mysql'),  nullable=True)
+    value      = Column('value', DatasetValue(),  nullable=True)
 
     unit = relationship('Unit', backref=backref("dataset_unit", order_by=unit_id))
 
@@ -284,7 +307,7 @@ class Dataset(Base, Inspect, PermissionControlled, AuditMixin):
         if metadata_dict is None:
             return
         if isinstance(metadata_dict, str):
-            metadata_dict = json.loads(metadata_dict)
+            metadata_dict = jsonutil.loads(metadata_dict)
 
         existing_metadata = []
         for m in self.metadata:
@@ -358,6 +381,29 @@ class Dataset(Base, Inspect, PermissionControlled, AuditMixin):
 
         return False
 
+@event.listens_for(Dataset, 'before_insert')
+@event.listens_for(Dataset, 'before_update')
+def _encode_dataset_value(mapper, connection, target):
+    """
+        Encode the value of a dataset for storage. The JSON value is kept
+        so it can be put back on the object once it has been written.
+    """
+    if not inspect(target).attrs.value.history.has_changes():
+        return
+
+    value = target.value
+    encoded = encode_value(value, target.type)
+    if encoded is not value:
+        target._json_value = value
+        target.value = encoded
+
+@event.listens_for(Dataset, 'after_insert')
+@event.listens_for(Dataset, 'after_update')
+def _restore_dataset_value(mapper, connection, target):
+    json_value = target.__dict__.pop('_json_value', None)
+    if json_value is not None:
+        set_committed_value(target, 'value', json_value)
+
 class DatasetCollection(Base, Inspect):
     """
     """
@@ -929,7 +975,7 @@ class Network(Base, Inspect):
         l = Link()
         l.name        = name
         l.description = desc
-        l.layout           = json.dumps(layout) if layout is not None else None
+        l.layout           = jsonutil.dumps(layout) if layout is not None else None
         l.node_a           = node_1
         l.node_b           = node_2
 
@@ -1388,8 +1434,8 @@ class ResourceScenario(Base, Inspect):
                 Dataset.unit_id,
                 Dataset.name,
                 Dataset.hidden,
-                case([(and_(Dataset.hidden=='Y', DatasetOwner.user_id is not None), None)],
-                        else_=Dataset.value).label('value')).filter(
+                type_coerce(case([(and_(Dataset.hidden=='Y', DatasetOwner.user_id is not None), None)],
+                        else_=Dataset.value), DatasetValue).label('value')).filter(
                 Dataset.id==self.id).outerjoin(DatasetOwner,
                                     and_(Dataset.id==DatasetOwner.dataset_id,
                                     DatasetOwner.user_id==user_id)).one()
@@ -1422,6 +1468,7 @@ class Scenario(Base, Inspect):
     cr_date = Column(TIMESTAMP(),  nullable=False, server_default=text(u'CURRENT_TIMESTAMP'))
     created_by = Column(Integer(), ForeignKey('tUser.id'), nullable=False)
     parent_id = Column(Integer(), ForeignKey('tScenario.id'), nullable=True)
+    copy_on_write = Column(String(1),  nullable=False, server_default=text(u"'N'"))
 
     network = relationship('Network', backref=backref("scenarios", order_by=id))
     parent = relationship('Scenario', remote_side=[id], backref=backref("children", order_by=id))
@@ -1455,6 +1502,126 @@ class Scenario(Base, Inspect):
             group_item_i.link     = resource
         self.resourcegroupitems.append(group_item_i)
 
+    def get_ancestor_ids(self):
+        """
+            Get the IDs of this scenario and the scenarios it inherits from,
+            closest first: [my ID, my parent's ID, my grandparent's ID...]
+
+            The chain is read with a single recursive query where the database
+            supports it, and by following each parent otherwise.
+        """
+        session = get_session()
+
+        if _supports_recursive_queries(session.bind):
+            scenarios = Scenario.__table__
+            chain = select([scenarios.c.id,
+                            scenarios.c.parent_id,
+                            literal(0).label('depth')]).where(
+                                scenarios.c.id == self.id).cte('ancestors', recursive=True)
+            parents = scenarios.alias()
+            chain = chain.union_all(select([parents.c.id,
+                                            parents.c.parent_id,
+                                            chain.c.depth + 1]).where(and_(
+                                                parents.c.id == chain.c.parent_id,
+                                                chain.c.depth < MAX_SCENARIO_DEPTH)))
+
+            rows = session.execute(select([chain.c.id]).order_by(chain.c.depth)).fetchall()
+            ancestor_ids = [r.id for r in rows]
+        else:
+            ancestor_ids = [self.id]
+            parent = self.parent
+            while parent is not None and len(ancestor_ids) <= MAX_SCENARIO_DEPTH:
+                ancestor_ids.append(parent.id)
+                parent = parent.parent
+
+        if len(set(ancestor_ids)) < len(ancestor_ids):
+            raise HydraError("Scenario %s inherits from itself"%(self.id,))
+
+        return ancestor_ids
+
+    def get_copy_source_ids(self):
+        """
+            Get the IDs of this scenario and the scenarios it shares data with,
+            closest first. A copy-on-write clone (copy_on_write == 'Y') has no
+            data of its own until it is written to, and shares the data of its
+            parent, so the chain ends at the first scenario which is not a
+            copy-on-write clone.
+        """
+        scenario_ids = [self.id]
+        scenario = self
+        while scenario.copy_on_write == 'Y' and scenario.parent is not None:
+            scenario = scenario.parent
+            if scenario.id in scenario_ids:
+                raise HydraError("Scenario %s inherits from itself"%(self.id,))
+            scenario_ids.append(scenario.id)
+
+        return scenario_ids
+
+    def _closest(self, column, key_column, ancestor_ids):
+        """
+            Build a subquery of the depth, in the list of ancestors, of the closest
+            scenario with a row in the table of 'column' for each value of key_column.
+            Returns the subquery and an expression of the depth of each row.
+        """
+        depth = case([(column == scenario_id, i) for i, scenario_id in enumerate(ancestor_ids)])
+
+        closest = get_session().query(key_column.label('key'),
+                                      func.min(depth).label('depth')).filter(
+                                          column.in_(ancestor_ids)).group_by(key_column)
+
+        return closest, depth
+
+    def _filter_closest(self, query, column, key_column, scenario_ids, key_filter=None):
+        """
+            Restrict a query to the rows of the closest scenario in scenario_ids
+            for each value of key_column. Returns the query and an expression
+            of the depth of each row.
+        """
+        closest, depth = self._closest(column, key_column, scenario_ids)
+
+        query = query.filter(column.in_(scenario_ids))
+
+        if key_filter is not None:
+            query = query.filter(key_filter)
+            closest = closest.filter(key_filter)
+
+        if len(scenario_ids) > 1:
+            closest = closest.subquery()
+            query = query.join(closest, and_(key_column == closest.c.key,
+                                             depth == closest.c.depth))
+
+        return query, depth
+
+    def filter_data(self, query, scenario_ids=None):
+        """
+            Restrict a query of ResourceScenario to the data of this scenario,
+            including what it shares as a copy-on-write clone. scenario_ids
+            is the chain of scenarios to use instead, closest first.
+        """
+        if scenario_ids is None:
+            scenario_ids = self.get_copy_source_ids()
+
+        query, _ = self._filter_closest(query,
+                                        ResourceScenario.scenario_id,
+                                        ResourceScenario.resource_attr_id,
+                                        scenario_ids)
+        return query
+
+    def filter_group_items(self, query, scenario_ids=None):
+        """
+            Restrict a query of ResourceGroupItem to the group items of this
+            scenario, including what it shares as a copy-on-write clone.
+            scenario_ids is the chain of scenarios to use instead, closest first.
+        """
+        if scenario_ids is None:
+            scenario_ids = self.get_copy_source_ids()
+
+        query, _ = self._filter_closest(query,
+                                        ResourceGroupItem.scenario_id,
+                                        ResourceGroupItem.group_id,
+                                        scenario_ids)
+        return query
+
     def get_data(self, child_data=None, get_parent_data=False, ra_ids=None):
         """
             Return all the resourcescenarios relevant to this scenario.
@@ -1463,39 +1630,40 @@ class Scenario(Base, Inspect):
             the ones closest to this scenario (my immediate parent's values are used instead
             of its parents)
 
+            The whole tree is resolved in one query, which picks the closest
+            scenario for each resource attribute. The data of the closest
+            scenarios come first. The data a copy-on-write clone shares with
+            its parent is always included.
+
             If an explicit list of RAs is provided, only return data for these. This is used
             when requesting data for a specific resource, for example.
         """
 
-        #This avoids python's mutable keyword argumets causing child_data to keep its values beween
-        #function calls
-        if child_data is None:
-            child_data = []
-
-        #Idenify all existing resource attr ids, which take priority over anything in here
-        childrens_ras = []
-        for child_rs in child_data:
-            childrens_ras.append(child_rs.resource_attr_id)
-
-        #Add resource attributes which are not defined already
-        rs_query = get_session().query(ResourceScenario).filter(ResourceScenario.scenario_id==self.id)
+        if get_parent_data is True and self.parent_id is not None:
+            scenario_ids = self.get_ancestor_ids()
+        else:
+            scenario_ids = self.get_copy_source_ids()
 
+        key_filter = None
         if ra_ids is not None:
-            rs_query = rs_query.filter(ResourceScenario.resource_attr_id.in_(ra_ids))
+            key_filter = ResourceScenario.resource_attr_id.in_(ra_ids)
 
-        resourcescenarios = rs_query.all()
+        rs_query, depth = self._filter_closest(get_session().query(ResourceScenario),
+                                               ResourceScenario.scenario_id,
+                                               ResourceScenario.resource_attr_id,
+                                               scenario_ids,
+                                               key_filter=key_filter)
 
-        for this_rs in resourcescenarios:
-            if this_rs.resource_attr_id not in childrens_ras:
-                child_data.append(this_rs)
+        resourcescenarios = rs_query.order_by(depth, ResourceScenario.resource_attr_id).all()
 
-        if self.parent is not None and get_parent_data is True:
-            return self.parent.get_data(child_data=child_data,
-                                        get_parent_data=get_parent_data,
-                                       ra_ids=ra_ids)
+        #Any data passed in takes priority over anything in here
+        if child_data is None:
+            return resourcescenarios
 
-        return child_data
+        childrens_ras = set(child_rs.resource_attr_id for child_rs in child_data)
 
+        return child_data + [rs for rs in resourcescenarios
+                             if rs.resource_attr_id not in childrens_ras]
 
     def get_group_items(self, child_items=None, get_parent_items=False):
         """
@@ -1504,28 +1672,49 @@ class Scenario(Base, Inspect):
             an exhaustive list of resource group items, removing any duplicates, prioritising
             the ones closest to this scenario (my immediate parent's values are used instead
             of its parents)
+
+            The items of each group all come from the closest scenario which
+            has items in that group.
         """
 
-        #This avoids python's mutable keyword argumets causing child_items to keep its values beween
-        #function calls
-        if child_items == None:
-            child_items = []
+        if get_parent_items is True and self.parent_id is not None:
+            scenario_ids = self.get_ancestor_ids()
+        else:
+            scenario_ids = self.get_copy_source_ids()
+
+        rgi_query, depth = self._filter_closest(get_session().query(ResourceGroupItem),
+                                                ResourceGroupItem.scenario_id,
+                                                ResourceGroupItem.group_id,
+                                                scenario_ids)
+
+        group_items = rgi_query.order_by(depth, ResourceGroupItem.id).all()
 
-        #Idenify all existing resource attr ids, which take priority over anything in here
-        childrens_groups = []
-        for child_rgi in child_items:
-            childrens_groups.append(child_rgi.group_id)
+        #Any items passed in take priority over anything in here
+        if child_items is None:
+            return group_items
 
-        #Add resource attributes which are not defined already
-        for this_rgi in self.resourcegroupitems:
-            if this_rgi.group_id not in childrens_groups:
-                child_items.append(this_rgi)
+        childrens_groups = set(child_rgi.group_id for child_rgi in child_items)
 
-        if self.parent is not None and get_parent_items is True:
-            return self.parent.get_group_items(child_items=child_items,
-                                               get_parent_items=get_parent_items)
+        return child_items + [rgi for rgi in group_items
+                              if rgi.group_id not in childrens_groups]
 
-        return child_items
+#The deepest chain of scenario inheritance which is followed
+MAX_SCENARIO_DEPTH = 100
+
+def _supports_recursive_queries(bind):
+    """
+        Recursive common table expressions ('WITH RECURSIVE') are supported
+        from SQLite 3.8.3, MySQL 8.0 and MariaDB 10.2
+    """
+    dialect = bind.dialect
+    if dialect.name == 'sqlite':
+        return dialect.dbapi.sqlite_version_info >= (3, 8, 3)
+    elif dialect.name == 'mysql':
+        version = dialect.server_version_info or ()
+        if getattr(dialect, '_is_mariadb', False):
+            return version >= (10, 2)
+        return version >= (8, 0)
+    return True
 
 class RuleTypeDefinition(AuditMixin, Base, Inspect):
     """
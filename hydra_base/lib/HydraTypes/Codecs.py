@@ -0,0 +1,382 @@
+"""
+  Hydra Value Codecs
+
+  A codec turns the JSON text value of a dataset into a compact binary
+  payload for storage, and back again. Each Hydra type lists, in its
+  `codecs` attribute, the tags of the codecs which may be used for its
+  values, in order of preference.
+
+  Encoded values are stored in the existing text value column as
+  'HYDRA:<TAG>:<base64 payload>'. Decoding always reproduces the exact
+  JSON text which was encoded, so clients which expect the JSON
+  representation are unaffected. Values which were stored before
+  compression was enabled are returned unchanged.
+
+  A plain value which itself starts with 'HYDRA:', such as a descriptor,
+  is stored as 'HYDRA:RAW:<value>', whether or not compression is enabled,
+  so it can't be mistaken for an encoded value.
+
+  Each codec class must subclass ValueCodec and implement encode
+  and decode. Codecs register themselves in `codecmap` by tag.
+"""
+import base64
+import collections
+import json
+import struct
+import zlib
+import numpy as np
+import pandas as pd
+from abc import abstractmethod, abstractproperty
+
+from hydra_base import config
+from hydra_base.util import jsonutil
+
+import logging
+log = logging.getLogger(__name__)
+
+codecmap = {}
+
+PREFIX = 'HYDRA:'
+
+#The tag of plain values which start with PREFIX
+RAW_TAG = 'RAW'
+
+class ValueCodec(object):
+    """ The ValueCodec class serves as an abstract base class for value codecs"""
+    def __init_subclass__(cls):
+        tag = cls.tag
+
+        if tag in codecmap:
+            raise ValueError('Codec with tag "{}" already registered.'.format(tag))
+        else:
+            codecmap[tag] = cls
+            log.info('Registering value codec "{}".'.format(tag))
+
+    @abstractproperty
+    def tag(self):
+        """ A str which uniquely identifies this codec and is stored as
+            part of each value it encodes
+        """
+        pass
+
+    @abstractmethod
+    def encode(cls, value):
+        """ Return the value, a JSON str, as a bytes payload, or None if
+            this codec cannot represent the value exactly
+        """
+        pass
+
+    @abstractmethod
+    def decode(cls, payload):
+        """ Return the JSON str which was encoded as the payload """
+        pass
+
+    @classmethod
+    def decode_frame(cls, payload):
+        """ Return the payload as a pandas dataframe, without going through
+            JSON, or None if this codec does not support it.
+        """
+        return None
+
+
+class ZlibCodec(ValueCodec):
+    """
+        Compresses the JSON text as it is. This works for any value.
+    """
+    tag = "ZLIB"
+
+    @classmethod
+    def encode(cls, value):
+        return zlib.compress(value.encode('utf-8'))
+
+    @classmethod
+    def decode(cls, payload):
+        return zlib.decompress(payload).decode('utf-8')
+
+
+def _iso(unit, suffix='', sep='T'):
+    """
+        Build a vectorised formatter for a datetime64 array, producing
+        ISO 8601 strings at the given resolution.
+    """
+    def fmt(values):
+        strings = np.datetime_as_string(values, unit=unit)
+        if sep != 'T':
+            strings = np.char.replace(strings, 'T', sep)
+        if suffix:
+            strings = np.char.add(strings, suffix)
+        return strings
+    return fmt
+
+#The date formats which FrameCodec can store as an array of
+#timestamps. Any other index is stored as a list of strings.
+DATE_FORMATS = collections.OrderedDict([
+    ('iso_ns_z', _iso('ns', 'Z')),
+    ('iso_ms_z', _iso('ms', 'Z')),
+    ('iso_s_z',  _iso('s', 'Z')),
+    ('iso_ns',   _iso('ns')),
+    ('iso_ms',   _iso('ms')),
+    ('iso_s',    _iso('s')),
+    ('space_s',  _iso('s', sep=' ')),
+    ('date',     _iso('D')),
+])
+
+FRAME_DTYPES = ('float64', 'int64')
+
+class FrameCodec(ValueCodec):
+    """
+        Stores a JSON dict of dicts, as used by timeseries and dataframes,
+        as one numeric buffer per column. Where the index is a set of dates
+        in one of the DATE_FORMATS, it is stored as an int64 buffer of
+        nanosecond timestamps, so the value can be loaded as a
+        pandas dataframe without parsing any text.
+
+        The payload is a zlib-compressed header, containing the length of
+        a JSON block describing the columns and index, followed by the
+        buffers themselves.
+    """
+    tag = "FRAME"
+
+    @classmethod
+    def encode(cls, value):
+        #A value produced by its type holds the dataframe it was made from,
+        #so the JSON does not need to be parsed again.
+        df = getattr(value, 'parsed_frame', None)
+        if df is None or not all(isinstance(i, str) for i in df.index.values):
+            df = cls._parse(value)
+            if df is None:
+                return None
+
+        if len(df.columns) == 0:
+            return None
+
+        columns = [str(c) for c in df.columns]
+
+        dtypes = [str(df[c].dtype) for c in df.columns]
+        if any(d not in FRAME_DTYPES for d in dtypes):
+            return None
+
+        index = df.index.values
+        if not all(isinstance(i, str) for i in index):
+            return None
+
+        meta = {'columns': columns, 'dtypes': dtypes, 'length': len(df)}
+        buffers = []
+
+        date_format, timestamps = cls._get_date_format(index)
+        if date_format is not None:
+            meta['date_format'] = date_format
+            buffers.append(timestamps.astype('<i8').tobytes())
+        else:
+            meta['index'] = list(index)
+
+        for col, dtype in zip(df.columns, dtypes):
+            buffers.append(df[col].values.astype('<' + dtype[0] + '8').tobytes())
+
+        meta_bytes = json.dumps(meta).encode('utf-8')
+        payload = zlib.compress(struct.pack('<I', len(meta_bytes)) + meta_bytes + b''.join(buffers))
+
+        #The value can only be stored this way if it can be reproduced exactly.
+        if cls.decode(payload) != value:
+            return None
+
+        return payload
+
+    @classmethod
+    def _parse(cls, value):
+        """
+            Parse a JSON dict of dicts into a dataframe, or return None if the
+            value is not one, or its columns are not in the order of the JSON.
+        """
+        try:
+            jo = jsonutil.loads(value)
+        except ValueError:
+            return None
+
+        if not isinstance(jo, dict) or len(jo) == 0:
+            return None
+        if not all(isinstance(v, dict) for v in jo.values()):
+            return None
+
+        try:
+            df = pd.DataFrame.from_dict(jo)
+        except (ValueError, TypeError):
+            return None
+
+        if list(jo.keys()) != [str(c) for c in df.columns]:
+            return None
+
+        return df
+
+    @classmethod
+    def _get_date_format(cls, index):
+        """
+            Identify which of the DATE_FORMATS the index strings are in.
+            Return the name of the format and the timestamps as a datetime64
+            array, or (None, None) if the index is not dates in a known format.
+        """
+        strings = np.array(index, dtype=str)
+        if len(strings) == 0:
+            return None, None
+        stripped = np.char.rstrip(strings, 'Z')
+        try:
+            timestamps = stripped.astype('datetime64[ns]')
+        except (ValueError, OverflowError):
+            return None, None
+
+        for name, fmt in DATE_FORMATS.items():
+            if np.array_equal(fmt(timestamps), strings):
+                return name, timestamps
+
+        return None, None
+
+    @classmethod
+    def _read(cls, payload):
+        """
+            Unpack a payload into its metadata, its index (either a datetime64
+            array or a list of strings) and a list of column arrays.
+        """
+        raw = zlib.decompress(payload)
+        meta_length = struct.unpack('<I', raw[:4])[0]
+        meta = json.loads(raw[4:4+meta_length].decode('utf-8'))
+        length = meta['length']
+
+        offset = 4 + meta_length
+        if 'date_format' in meta:
+            index = np.frombuffer(raw, dtype='<i8', count=length, offset=offset).view('datetime64[ns]')
+            offset += 8 * length
+        else:
+            index = meta['index']
+
+        columns = []
+        for dtype in meta['dtypes']:
+            columns.append(np.frombuffer(raw, dtype='<' + dtype[0] + '8', count=length, offset=offset))
+            offset += 8 * length
+
+        return meta, index, columns
+
+    @classmethod
+    def decode(cls, payload):
+        meta, index, columns = cls._read(payload)
+
+        if 'date_format' in meta:
+            index = DATE_FORMATS[meta['date_format']](index)
+
+        df = pd.DataFrame(collections.OrderedDict(zip(meta['columns'], columns)),
+                          index=pd.Index(index, dtype=object))
+
+        return df.to_json()
+
+    @classmethod
+    def decode_frame(cls, payload):
+        meta, index, columns = cls._read(payload)
+        if 'date_format' in meta:
+            index = pd.DatetimeIndex(index)
+        return pd.DataFrame(collections.OrderedDict(zip(meta['columns'], columns)),
+                            index=index)
+
+
+class DecodedValue(str):
+    """
+        The JSON value of a dataset which was stored encoded. This behaves as
+        the JSON str, but also holds on to the stored payload, so that
+        types which support it can be loaded from the binary data directly.
+    """
+    __slots__ = ('codec', 'payload')
+
+    def __new__(cls, text, codec, payload):
+        obj = super(DecodedValue, cls).__new__(cls, text)
+        obj.codec = codec
+        obj.payload = payload
+        return obj
+
+    @property
+    def frame(self):
+        """
+            The value as a pandas dataframe, or None if the codec
+            does not support loading it directly.
+        """
+        return self.codec.decode_frame(self.payload)
+
+
+class ParsedValue(str):
+    """
+        The JSON value of a dataset as produced by its type. This behaves as
+        the JSON str, but also holds on to the dataframe it was made from, so
+        that it can be encoded without parsing the JSON again. The dataframe
+        is dropped when the value is pickled, such as when it is returned from
+        a worker process.
+    """
+    __slots__ = ('parsed_frame',)
+
+    def __new__(cls, text, parsed_frame):
+        obj = super(ParsedValue, cls).__new__(cls, text)
+        obj.parsed_frame = parsed_frame
+        return obj
+
+    def __reduce__(self):
+        return (str, (str(self),))
+
+
+def is_encoded(value):
+    return isinstance(value, str) and value.startswith(PREFIX)
+
+def compression_enabled():
+    return config.get('db', 'compress_values', 'N').upper() in ('Y', 'TRUE', '1')
+
+def encode_value(value, data_type):
+    """
+        Encode the JSON value of a dataset for storage, using the first of the
+        codecs for its data type which produces a smaller value. If compression
+        is disabled, the value is below the compression_threshold, or no codec
+        can represent it, the value is returned as it is.
+    """
+    if not isinstance(value, str):
+        return value
+
+    if is_encoded(value):
+        return PREFIX + RAW_TAG + ':' + value
+
+    if not compression_enabled():
+        return value
+
+    if len(value) < config.getint('db', 'compression_threshold', 50000):
+        return value
+
+    from .Registry import typemap
+    hydra_type = typemap.get(str(data_type).upper())
+    if hydra_type is None:
+        return value
+
+    for tag in hydra_type.codecs:
+        codec = codecmap[tag]
+        payload = codec.encode(value)
+        if payload is None:
+            continue
+        encoded = PREFIX + tag + ':' + base64.b64encode(payload).decode('ascii')
+        if len(encoded) < len(value):
+            return encoded
+
+    return value
+
+def decode_value(value):
+    """
+        Decode a value which was stored by encode_value, returning its
+        JSON text. Values which are not encoded are returned as they are,
+        including those stored before plain values were escaped which
+        start with PREFIX but not with the tag of a codec.
+    """
+    if not is_encoded(value):
+        return value
+
+    tag, _, data = value[len(PREFIX):].partition(':')
+    if tag == RAW_TAG:
+        return data
+
+    codec = codecmap.get(tag)
+    if codec is None:
+        return value
+
+    payload = base64.b64decode(data)
+
+    return DecodedValue(codec.decode(payload), codec, payload)
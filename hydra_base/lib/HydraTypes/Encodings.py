@@ -48,3 +48,21 @@ class TimeseriesJSON(object):
 
     def __set__(self, instance, encstr):
         pass
+
+
+""" Descriptor for Regular Timeseries JSON encoding/decoding"""
+class RegularTimeseriesJSON(object):
+    def __get__(self, instance, owner):
+        return "{}"
+
+    def __set__(self, instance, encstr):
+        pass
+
+
+""" Descriptor for Tensor JSON encoding/decoding"""
+class TensorJSON(object):
+    def __get__(self, instance, owner):
+        return "{}"
+
+    def __set__(self, instance, encstr):
+        pass
@@ -10,7 +10,7 @@ import inspect
 import sys
 
 typemap = {}
-from .Types import Array, Scalar, Timeseries, Descriptor, Dataframe
+from .Types import Array, Scalar, Timeseries, Descriptor, Dataframe, RegularTimeseries, Tensor
 from .Types import DataType as Datatype_Base
 
 
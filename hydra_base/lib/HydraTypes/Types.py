@@ -6,22 +6,62 @@
   class' constructor is not part of the interface and is left
   to the implementer.
 """
+import base64
+import collections
 import json
 import math
+import zlib
 import six
 import numpy as np
 import pandas as pd
 from abc import abstractmethod, abstractproperty
 from datetime import datetime
-import collections
 from hydra_base import config
+from hydra_base.util import jsonutil
 
-from .Encodings import ScalarJSON, ArrayJSON, DescriptorJSON, DataframeJSON, TimeseriesJSON
+from .Encodings import ScalarJSON, ArrayJSON, DescriptorJSON, DataframeJSON, TimeseriesJSON,\
+                       RegularTimeseriesJSON, TensorJSON
+from .Codecs import ParsedValue
 from hydra_base.exceptions import HydraError
 
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:
+    from pandas._libs.tslibs.parsing import guess_datetime_format
+
 import logging
 log = logging.getLogger(__name__)
 
+#The format of the last set of timeseries dates to be parsed. Timeseries
+#are usually loaded in batches which share a format, so it is tried first.
+_last_date_format = [None]
+
+def _parse_dates(labels):
+    """
+        Parse a list of date strings in one go, using the format of the
+        previous list, or that of the first date, so pandas does not need
+        to infer the format of each one. Where the dates are not all in one
+        format, each is parsed on its own, as pd.Timestamp would.
+    """
+    for date_format in (_last_date_format[0], guess_datetime_format(labels[0])):
+        if date_format is None:
+            continue
+        try:
+            timestamps = pd.to_datetime(labels, format=date_format)
+        except (ValueError, TypeError):
+            continue
+        _last_date_format[0] = date_format
+        return timestamps
+
+    #Formats which can't be guessed, such as ISO 8601 with nanoseconds,
+    #may still be parsed together.
+    try:
+        return pd.to_datetime(labels)
+    except (ValueError, TypeError):
+        pass
+
+    return pd.Index([pd.Timestamp(label) for label in labels], dtype=object)
+
 
 class DataType(object):
     """ The DataType class serves as an abstract base class for data types"""
@@ -37,7 +77,9 @@ class DataType(object):
             typemap[tag] = cls
             log.info('Registering data type "{}".'.format(tag))
 
-
+    # The tags of the value codecs (see Codecs.py) which may be used to
+    # store values of this type, in order of preference.
+    codecs = ()
 
     @abstractproperty
     def skeleton(self):
@@ -112,6 +154,7 @@ class Array(DataType):
     name     = "Array"
     skeleton = "[%f, ...]"
     json     = ArrayJSON()
+    codecs   = ("ZLIB",)
 
     def __init__(self, encstr):
         super(Array, self).__init__()
@@ -123,7 +166,7 @@ class Array(DataType):
         return cls(value)
 
     def validate(self):
-        j = json.loads(self.value)
+        j = jsonutil.loads(self.value)
         assert len(j) > 0           # Sized
         assert iter(j) is not None  # Iterable
         assert j.__getitem__        # Container
@@ -143,6 +186,7 @@ class Descriptor(DataType):
     name     = "Descriptor"
     skeleton = "%s"
     json     = DescriptorJSON()
+    codecs   = ("ZLIB",)
 
     def __init__(self, data):
         super(Descriptor, self).__init__()
@@ -156,7 +200,7 @@ class Descriptor(DataType):
                 df = pd.read_json(six.text_type(value))
                 data = df.transpose().to_json()
             except Exception:
-                noindexdata = json.loads(six.text_type(value))
+                noindexdata = jsonutil.loads(six.text_type(value))
                 indexeddata = {0:noindexdata}
                 data = json.dumps(indexeddata)
             return cls(data)
@@ -181,6 +225,7 @@ class Dataframe(DataType):
     name     = "Data Frame"
     skeleton = "%s"
     json     = DataframeJSON()
+    codecs   = ("FRAME", "ZLIB")
 
     def __init__(self, data):
         super(Dataframe, self).__init__()
@@ -201,7 +246,7 @@ class Dataframe(DataType):
         """
         try:
 
-            ordered_jo = json.loads(six.text_type(value), object_pairs_hook=collections.OrderedDict)
+            ordered_jo = jsonutil.loads(six.text_type(value))
 
             #Pandas does not maintain the order of dicts, so we must break the dict
             #up and put it into the dataframe manually to maintain the order.
@@ -282,6 +327,7 @@ class Timeseries(DataType):
     name     = "Time Series"
     skeleton = "[%s, ...]"
     json     = TimeseriesJSON()
+    codecs   = ("FRAME", "ZLIB")
 
     def __init__(self, ts):
         super(Timeseries, self).__init__()
@@ -290,31 +336,311 @@ class Timeseries(DataType):
 
     @classmethod
     def fromDataset(cls, value, metadata=None):
-        ordered_jo = json.loads(six.text_type(value), object_pairs_hook=collections.OrderedDict)
-        ts = pd.DataFrame.from_dict(ordered_jo)
+        ts = pd.DataFrame.from_dict(jsonutil.loads(six.text_type(value)))
         return cls(ts)
 
 
     def validate(self):
-        base_ts = pd.Timestamp("01-01-1970")
         #TODO: We need a more permanent solution to seasonal/repeating timeseries
         seasonal_year = config.get('DEFAULT','seasonal_year', '1678')
         seasonal_key = config.get('DEFAULT', 'seasonal_key', '9999')
-        jd = json.loads(self.value, object_pairs_hook=collections.OrderedDict)
-        for k,v in jd.items():
-            for date in (six.text_type(d) for d in v.keys()):
-                #A date with '9999' in it is a special case, but is an invalid year
-                #for pandas, so replace it with the first year allowed by pandas -- 1678
-                if date.find(seasonal_key) >= 0:
-                    date = date.replace(seasonal_key, seasonal_year)
 
-                ts = pd.Timestamp(date)
+        #A date with '9999' in it is a special case, but is an invalid year
+        #for pandas, so replace it with the first year allowed by pandas -- 1678
+        labels = [six.text_type(d).replace(seasonal_key, seasonal_year)
+                  for d in self._value.index]
+        if len(labels) == 0:
+            return
+
+        timestamps = _parse_dates(labels)
+
+        assert not timestamps.isna().any()
+
+
+    def get_value(self):
+        return ParsedValue(self._value.to_json(date_format='iso', date_unit='ns'), self._value)
+
+    def set_value(self, val):
+        self._value = val
+
+    value = property(get_value, set_value)
+
+class RegularTimeseries(DataType):
+    """
+        A timeseries whose dates are at a fixed frequency from a start date.
+        Only the start, the frequency (a pandas offset alias, such as 'H' or
+        'D') and the values of each column are stored:
+
+            {"start": "2000-01-01T00:00:00", "frequency": "H", "length": 8760,
+             "columns": {"0": {"dtype": "float64", "compression": "zlib",
+                               "data": <base64>}}}
+
+        Each column is packed as a little-endian buffer, compressed with zlib
+        where that makes it smaller. A seasonal timeseries keeps the seasonal
+        key as the year of its start.
+
+        A value in the form of a TIMESERIES, whose dates are regular, is also
+        accepted, and converted.
+    """
+    tag      = "REGULAR_TIMESERIES"
+    name     = "Regular Time Series"
+    skeleton = "%s"
+    json     = RegularTimeseriesJSON()
+    codecs   = ()
+
+    dtypes   = ('float64', 'int64')
+
+    def __init__(self, ts, seasonal=False):
+        super(RegularTimeseries, self).__init__()
+        self.value = ts
+        self.seasonal = seasonal
+        self.validate()
+
+    @classmethod
+    def fromDataset(cls, value, metadata=None):
+        jo = jsonutil.loads(six.text_type(value))
+        if isinstance(jo, dict) and 'frequency' in jo:
+            return cls._unpack(jo)
+        return cls.fromTimeseries(value)
+
+    @classmethod
+    def fromTimeseries(cls, value, frequency=None):
+        """
+            Convert the JSON value of a TIMESERIES. Its dates must be in order,
+            at a regular interval, which is inferred if no frequency is given.
+        """
+        seasonal_year = config.get('DEFAULT','seasonal_year', '1678')
+        seasonal_key = config.get('DEFAULT', 'seasonal_key', '9999')
+
+        ts = pd.DataFrame.from_dict(jsonutil.loads(six.text_type(value)))
+        if len(ts) == 0:
+            raise ValueError("Timeseries has no dates")
+
+        labels = [six.text_type(d) for d in ts.index]
+        seasonal = any(seasonal_key in label for label in labels)
+        dates = pd.DatetimeIndex(_parse_dates([label.replace(seasonal_key, seasonal_year)
+                                               for label in labels]))
+
+        if frequency is None:
+            if len(dates) >= 3:
+                frequency = pd.infer_freq(dates)
+            elif len(dates) == 2:
+                frequency = pd.tseries.frequencies.to_offset(dates[1] - dates[0]).freqstr
+            if frequency is None:
+                raise ValueError("Unable to find a regular frequency for the timeseries")
+
+        #This fails if the dates do not follow the frequency
+        ts.index = pd.DatetimeIndex(dates, freq=frequency)
+
+        for name in ts.columns:
+            if ts[name].dtype.kind in 'iuf':
+                ts[name] = ts[name].astype(ts[name].dtype.kind.replace('u', 'i') + '8')
+
+        return cls(ts, seasonal=seasonal)
+
+    @classmethod
+    def _unpack(cls, jo):
+        seasonal_year = config.get('DEFAULT','seasonal_year', '1678')
+        seasonal_key = config.get('DEFAULT', 'seasonal_key', '9999')
+
+        start = six.text_type(jo['start'])
+        seasonal = start.startswith(seasonal_key)
+        if seasonal:
+            start = seasonal_year + start[len(seasonal_key):]
+
+        length = int(jo['length'])
+        index = pd.date_range(start, periods=length, freq=jo['frequency'])
+
+        columns = collections.OrderedDict()
+        for name, column in jo['columns'].items():
+            if column['dtype'] not in cls.dtypes:
+                raise ValueError("Unsupported column type %s"%(column['dtype'],))
+            data = base64.b64decode(column['data'])
+            if column.get('compression') == 'zlib':
+                data = zlib.decompress(data)
+            values = np.frombuffer(data, dtype='<' + column['dtype'][0] + '8')
+            if len(values) != length:
+                raise ValueError("Column %s has %s values, not %s"%(name, len(values), length))
+            columns[name] = values
+
+        return cls(pd.DataFrame(columns, index=index), seasonal=seasonal)
+
+    def validate(self):
+        ts = self._value
+        assert isinstance(ts.index, pd.DatetimeIndex)
+        assert ts.index.freq is not None
+        assert len(ts.index) > 0
+        assert len(ts.columns) > 0
+        for dtype in ts.dtypes:
+            assert str(dtype) in self.dtypes, "Timeseries values must be numeric"
+
+    def get_frame(self):
+        """
+            The timeseries as a dataframe, with its dates as a DatetimeIndex.
+        """
+        return self._value
+
+    def toTimeseries(self):
+        """
+            The value in the JSON form of a TIMESERIES
+        """
+        seasonal_year = config.get('DEFAULT','seasonal_year', '1678')
+        seasonal_key = config.get('DEFAULT', 'seasonal_key', '9999')
+
+        value = self._value.to_json(date_format='iso', date_unit='ns')
+        if self.seasonal:
+            value = value.replace('"%s-'%(seasonal_year,), '"%s-'%(seasonal_key,))
+        return value
+
+    def get_value(self):
+        seasonal_year = config.get('DEFAULT','seasonal_year', '1678')
+        seasonal_key = config.get('DEFAULT', 'seasonal_key', '9999')
+
+        index = self._value.index
+
+        start = index[0].isoformat()
+        if self.seasonal and start.startswith(seasonal_year):
+            start = seasonal_key + start[len(seasonal_year):]
+
+        columns = collections.OrderedDict()
+        for name in self._value.columns:
+            values = self._value[name].values
+            dtype = str(values.dtype)
+            data = values.astype('<' + dtype[0] + '8').tobytes()
+            compressed = zlib.compress(data)
+            column = collections.OrderedDict([('dtype', dtype)])
+            if len(compressed) < len(data):
+                column['compression'] = 'zlib'
+                data = compressed
+            column['data'] = base64.b64encode(data).decode('ascii')
+            columns[six.text_type(name)] = column
+
+        return json.dumps(collections.OrderedDict([
+            ('start', start),
+            ('frequency', index.freqstr),
+            ('length', len(index)),
+            ('columns', columns),
+        ]))
+
+    def set_value(self, val):
+        self._value = val
+
+    value = property(get_value, set_value)
+
+
+class Tensor(DataType):
+    """
+        An N-dimensional array of numbers of a single type, such as a rule
+        curve or a table of parameters. The type and shape are stored with
+        the values, which are packed as one little-endian buffer in C order:
+
+            {"dtype": "float64", "shape": [12, 24], "compression": "zlib",
+             "data": <base64>}
+
+        The buffer is compressed with zlib where that makes it smaller. The
+        array returned by get_array is a read-only view of the decoded buffer.
+
+        A value in the form of an ARRAY (nested lists of numbers, all of
+        the same length at each level) is also accepted, and converted.
+    """
+    tag      = "TENSOR"
+    name     = "Tensor"
+    skeleton = "%s"
+    json     = TensorJSON()
+    codecs   = ()
+
+    dtypes   = ('bool', 'int8', 'int16', 'int32', 'int64', 'uint8', 'uint16', 'uint32',
+                'uint64', 'float32', 'float64')
 
-                assert isinstance(ts, base_ts.__class__) # Same type as known valid ts
+    def __init__(self, arr):
+        super(Tensor, self).__init__()
+        self.value = arr
+        self.validate()
+
+    @classmethod
+    def fromDataset(cls, value, metadata=None):
+        jo = jsonutil.loads(six.text_type(value))
+        if isinstance(jo, dict) and 'shape' in jo:
+            return cls._unpack(jo)
+        return cls.fromArray(jo)
+
+    @classmethod
+    def fromArray(cls, value, dtype=None):
+        """
+            Convert the value of an ARRAY, as JSON or as nested lists. The
+            type of the values is that numpy gives them, unless a dtype is
+            given.
+        """
+        if isinstance(value, six.string_types):
+            value = jsonutil.loads(value)
+        if not isinstance(value, list):
+            raise ValueError("An array must be a list")
+
+        #Lists of different lengths can't be packed
+        arr = np.array(value, dtype=dtype)
+        if arr.dtype.kind == 'O':
+            raise ValueError("Array is not rectangular")
+
+        return cls(arr)
+
+    @classmethod
+    def _unpack(cls, jo):
+        dtype = jo['dtype']
+        if dtype not in cls.dtypes:
+            raise ValueError("Unsupported tensor type %s"%(dtype,))
+        shape = tuple(int(d) for d in jo['shape'])
+
+        data = base64.b64decode(jo['data'])
+        if jo.get('compression') == 'zlib':
+            data = zlib.decompress(data)
 
+        arr = np.frombuffer(data, dtype=np.dtype(dtype).newbyteorder('<'))
+        if arr.size != int(np.prod(shape)):
+            raise ValueError("Tensor has %s values, but its shape is %s"%(arr.size, shape))
+
+        return cls(arr.reshape(shape))
+
+    def validate(self):
+        arr = self._value
+        assert isinstance(arr, np.ndarray)
+        assert arr.size > 0
+        assert arr.dtype.name in self.dtypes, "Tensor values must be numeric"
+
+    def get_array(self):
+        """
+            The values as an np.ndarray
+        """
+        return self._value
+
+    @property
+    def shape(self):
+        return self._value.shape
+
+    @property
+    def dtype(self):
+        return self._value.dtype.name
+
+    def toArray(self):
+        """
+            The value in the JSON form of an ARRAY
+        """
+        return json.dumps(self._value.tolist())
 
     def get_value(self):
-        return self._value.to_json(date_format='iso', date_unit='ns')
+        arr = self._value
+        data = np.ascontiguousarray(arr, dtype=arr.dtype.newbyteorder('<')).tobytes()
+
+        value = collections.OrderedDict([
+            ('dtype', arr.dtype.name),
+            ('shape', list(arr.shape)),
+        ])
+        compressed = zlib.compress(data)
+        if len(compressed) < len(data):
+            value['compression'] = 'zlib'
+            data = compressed
+        value['data'] = base64.b64encode(data).decode('ascii')
+
+        return json.dumps(value)
 
     def set_value(self, val):
         self._value = val
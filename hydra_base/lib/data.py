@@ -22,37 +22,43 @@ import sys
 from ..util.hydra_dateutil import get_datetime
 import logging
 from ..db.model import Dataset, Metadata, DatasetOwner, DatasetCollection,\
-        DatasetCollectionItem, ResourceScenario, ResourceAttr, TypeAttr
-from ..util import generate_data_hash
+        DatasetCollectionItem, ResourceScenario, ResourceAttr, TypeAttr, DatasetValue
+from ..util import generate_data_hash, get_val, format_columns
+from ..util.lookup import in_keys
+from ..util import jsonutil
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm import aliased, make_transient, joinedload_all
+from sqlalchemy.orm import aliased, make_transient, joinedload_all, load_only
 from sqlalchemy.sql.expression import case
+from sqlalchemy import type_coerce
 from sqlalchemy import func
 from sqlalchemy import null
 from .. import db
 from ..import config
 
-from .objects import JSONObject, Dataset as JSONDataset
+from .objects import JSONObject, Dataset as JSONDataset, parse_dataset_value
+from .HydraTypes.Codecs import encode_value
+from .HydraTypes.Types import RegularTimeseries, Tensor
 
 import pandas as pd
+import numpy as np
 from ..exceptions import HydraError, PermissionError, ResourceNotFoundError
 from sqlalchemy import and_, or_
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.sql.expression import literal_column
 from sqlalchemy import distinct
+from zope.sqlalchemy import mark_changed
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
 from decimal import Decimal
 import copy
+from concurrent.futures import ProcessPoolExecutor
 
-import json
+import hashlib
 
 
 global FORMAT
 FORMAT = "%Y-%m-%d %H:%M:%S.%f"
-global qry_in_threshold
-qry_in_threshold = 999
 #"2013-08-13T15:55:43.468886Z"
 
 current_module = sys.modules[__name__]
@@ -79,8 +85,8 @@ def get_dataset(dataset_id,**kwargs):
                 Dataset.created_by,
                 DatasetOwner.user_id,
                 null().label('metadata'),
-                case([(and_(Dataset.hidden=='Y', DatasetOwner.user_id is not None), None)],
-                        else_=Dataset.value).label('value')).filter(
+                type_coerce(case([(and_(Dataset.hidden=='Y', DatasetOwner.user_id is not None), None)],
+                        else_=Dataset.value), DatasetValue).label('value')).filter(
                 Dataset.id==dataset_id).outerjoin(DatasetOwner,
                                     and_(DatasetOwner.dataset_id==Dataset.id,
                                     DatasetOwner.user_id==user_id)).one()
@@ -178,8 +184,8 @@ def get_datasets(dataset_ids,**kwargs):
                 Dataset.created_by,
                 DatasetOwner.user_id,
                 null().label('metadata'),
-                case([(and_(Dataset.hidden=='Y', DatasetOwner.user_id is not None), None)],
-                        else_=Dataset.value).label('value')).filter(
+                type_coerce(case([(and_(Dataset.hidden=='Y', DatasetOwner.user_id is not None), None)],
+                        else_=Dataset.value), DatasetValue).label('value')).filter(
                 Dataset.id.in_(dataset_ids)).outerjoin(DatasetOwner,
                                     and_(DatasetOwner.dataset_id==Dataset.id,
                                     DatasetOwner.user_id==user_id)).all()
@@ -207,6 +213,40 @@ def get_datasets(dataset_ids,**kwargs):
 
 
 
+def get_dataset_values(dataset_ids, **kwargs):
+    """
+        Get the values of a list of datasets, without the rest of each dataset.
+        This is intended for use with get_network(include_data='L'), which returns
+        the datasets in a network without their values, so that a client can
+        fetch the values as they are needed, in batches.
+
+        Returns a dictionary of values keyed on dataset ID (as a string, so
+        it can be read into a JSONObject). The value of any dataset the user
+        is not allowed to see is None. IDs which do not exist are omitted.
+    """
+    user_id = kwargs.get('user_id')
+
+    dataset_ids = list(set(int(d_id) for d_id in dataset_ids))
+
+    values = {}
+    with in_keys(Dataset.id, dataset_ids) as dataset_filter:
+        value_qry = db.DBSession.query(Dataset.id,
+                case([(or_(Dataset.hidden=='N',
+                           Dataset.created_by==user_id,
+                           DatasetOwner.user_id != None), Dataset.value)],
+                     else_=None).label('value')).outerjoin(DatasetOwner,
+                                    and_(DatasetOwner.dataset_id==Dataset.id,
+                                    DatasetOwner.user_id==user_id)).filter(dataset_filter)
+
+        for dataset_row in value_qry:
+            #convert the value row into a string as it is returned as a binary
+            if dataset_row.value is not None:
+                values[str(dataset_row.id)] = str(dataset_row.value)
+            else:
+                values[str(dataset_row.id)] = None
+
+    return values
+
 def search_datasets(dataset_id=None,
                 dataset_name=None,
                 collection_name=None,
@@ -523,61 +563,79 @@ def _bulk_insert_data(bulk_data, user_id=None, source=None):
         user_id indicates the user adding the data
         source indicates the name of the app adding the data
         both user_id and source are added as metadata
+
+        This happens in stages:
+            1: Parse, validate and hash the incoming data (in parallel if
+               configured. See _process_incoming_data)
+            2: Look up which of the unique hashes are already in the DB
+            3: Insert the remainder, in batches of 'bulk_insert_batch_size'
+
+        Returns a list of datasets, one for each of the incoming datasets.
     """
     get_timing = lambda x: datetime.datetime.now() - x
     start_time=datetime.datetime.now()
     new_data = _process_incoming_data(bulk_data, user_id, source)
     log.info("Incoming data processed in %s", (get_timing(start_time)))
 
-    existing_data = _get_existing_data(new_data.keys())
+    hash_id_map = _insert_datasets(new_data, user_id=user_id)
+
+    returned_ids = []
+    for d in bulk_data:
+        returned_ids.append(hash_id_map[d.hash])
+
+    log.info("Done bulk inserting data. %s datasets", len(returned_ids))
+
+    return returned_ids
+
+def _insert_datasets(new_data, user_id=None, existing_data=None):
+    """
+        Insert the datasets in new_data, a dict of dataset dicts keyed on hash,
+        which are not already in the DB.
+
+        args:
+            new_data (dict): The dataset dicts to insert, keyed on hash
+            user_id (int): The user inserting the data
+            existing_data (dict): The result of _get_existing_data for the
+                                  hashes in new_data, if it has already been
+                                  retrieved.
+        returns:
+            A dict of datasets keyed on the hashes in new_data.
+    """
+    get_timing = lambda x: datetime.datetime.now() - x
+    start_time=datetime.datetime.now()
+
+    if existing_data is None:
+        existing_data = _get_existing_data(new_data.keys())
 
     log.info("Existing data retrieved.")
 
-    #The list of dataset IDS to be returned.
+    #The datasets to be returned, keyed on the hash of the incoming data.
     hash_id_map = {}
-    new_datasets = []
-    metadata         = {}
-    #This is what gets returned.
-    for d in bulk_data:
-        dataset_dict = new_data[d.hash]
-        current_hash = d.hash
+    #The datasets to insert, keyed on the hash they will be inserted with.
+    new_datasets = {}
+    #Incoming data which must be inserted with a different hash, because
+    #this user can not see the existing dataset.
+    renamed_hashes = {}
+    for current_hash, dataset_dict in new_data.items():
 
         #if this piece of data is already in the DB, then
         #there is no need to insert it!
-        if  existing_data.get(current_hash) is not None:
-
-            dataset = existing_data.get(current_hash)
-
-            #Is this user allowed to use this dataset?
-            if dataset.check_read_permission(user_id, do_raise=False) == False:
-                new_dataset = _make_new_dataset(dataset_dict)
-                new_datasets.append(new_dataset)
-                metadata[new_dataset['hash']] = dataset_dict['metadata']
-            else:
-                hash_id_map[current_hash] = dataset
-
-        elif current_hash in hash_id_map:
-            new_datasets.append(dataset_dict)
+        dataset = existing_data.get(current_hash)
+        if dataset is None:
+            new_datasets[current_hash] = dataset_dict
+        #Is this user allowed to use this dataset? Open datasets can be used
+        #by anyone, so only check the hidden ones.
+        elif dataset.hidden == 'Y' and \
+                dataset.check_read_permission(user_id, do_raise=False) == False:
+            new_dataset = _make_new_dataset(dataset_dict)
+            new_datasets[new_dataset['hash']] = new_dataset
+            renamed_hashes[current_hash] = new_dataset['hash']
         else:
-            #set a placeholder for a dataset_id we don't know yet.
-            #The placeholder is the hash, which is unique to this object and
-            #therefore easily identifiable.
-            new_datasets.append(dataset_dict)
-            hash_id_map[current_hash] = dataset_dict
-            metadata[current_hash] = dataset_dict['metadata']
+            hash_id_map[current_hash] = dataset
 
     log.debug("Isolating new data %s", get_timing(start_time))
-    #Isolate only the new datasets and insert them
-    new_data_for_insert = []
-    #keep track of the datasets that are to be inserted to avoid duplicate
-    #inserts
-    new_data_hashes = []
-    for d in new_datasets:
-        if d['hash'] not in new_data_hashes:
-            new_data_for_insert.append(d)
-            new_data_hashes.append(d['hash'])
-
-    if len(new_data_for_insert) > 0:
+
+    if len(new_datasets) > 0:
     	#If we're working with mysql, we have to lock the table..
     	#For sqlite, this is not possible. Hence the try: except
         #try:
@@ -585,32 +643,43 @@ def _bulk_insert_data(bulk_data, user_id=None, source=None):
         #except OperationalError:
         #    pass
 
-        log.debug("Inserting new data %s", get_timing(start_time))
-        db.DBSession.bulk_insert_mappings(Dataset, new_data_for_insert)
-        log.debug("New data Inserted %s", get_timing(start_time))
+        batch_size = config.getint('db', 'bulk_insert_batch_size', 1000)
 
-        #try:
-        #    db.DBSession.execute("UNLOCK TABLES")
-        #except OperationalError:
-        #    pass
+        new_hashes = list(new_datasets.keys())
+        for idx in range(0, len(new_hashes), batch_size):
+            batch_hashes = new_hashes[idx:idx+batch_size]
+            #The incoming dicts keep their JSON value, as they are hashed
+            #and returned. Only the stored copy is encoded.
+            batch = [dict(new_datasets[h], value=encode_value(new_datasets[h]['value'],
+                                                              new_datasets[h]['type']))
+                     for h in batch_hashes]
 
+            log.debug("Inserting %s new datasets %s", len(batch), get_timing(start_time))
+            db.DBSession.bulk_insert_mappings(Dataset, batch)
 
-        new_data = _get_existing_data(new_data_hashes)
-        log.debug("New data retrieved %s", get_timing(start_time))
+            inserted_data = _get_existing_data(batch_hashes)
 
-        for k, v in new_data.items():
-            hash_id_map[k] = v
+            _insert_metadata(dict((h, new_datasets[h]['metadata']) for h in batch_hashes),
+                             inserted_data)
 
-        _insert_metadata(metadata, hash_id_map)
-        log.debug("Metadata inserted %s", get_timing(start_time))
+            for k, v in inserted_data.items():
+                hash_id_map[k] = v
 
-    returned_ids = []
-    for d in bulk_data:
-        returned_ids.append(hash_id_map[d.hash])
+        #Bulk inserts bypass the unit of work, so the transaction
+        #must be told about them explicitly for them to be committed.
+        mark_changed(db.DBSession())
 
-    log.info("Done bulk inserting data. %s datasets", len(returned_ids))
+        log.debug("New data and metadata inserted %s", get_timing(start_time))
 
-    return returned_ids
+        #try:
+        #    db.DBSession.execute("UNLOCK TABLES")
+        #except OperationalError:
+        #    pass
+
+    for current_hash, new_hash in renamed_hashes.items():
+        hash_id_map[current_hash] = hash_id_map[new_hash]
+
+    return hash_id_map
 
 def _insert_metadata(metadata_hash_dict, dataset_id_hash_dict):
     if metadata_hash_dict is None or len(metadata_hash_dict) == 0:
@@ -625,47 +694,98 @@ def _insert_metadata(metadata_hash_dict, dataset_id_hash_dict):
             metadata['dataset_id']      = dataset_id_hash_dict[_hash].id
             metadata_list.append(metadata)
 
-    db.DBSession.execute(Metadata.__table__.insert(), metadata_list)
+    if len(metadata_list) > 0:
+        db.DBSession.execute(Metadata.__table__.insert(), metadata_list)
 
-def _process_incoming_data(data, user_id=None, source=None):
+def _process_dataset(dataset_args):
+    """
+        Parse, validate and hash a single incoming dataset. This
+        takes and returns plain python objects so that it can be
+        run in a worker process.
 
-    datasets = {}
-    for d in data:
-        val = d.parse_value()
+        args:
+            dataset_args (tuple): The type, name, unit ID, value, metadata
+                                  (as used to parse the value), metadata (as stored)
+                                  and the user ID of the dataset's creator.
 
-        if val is None:
-            log.info("Cannot parse data (dataset_id=%s). "
-                         "Value not available.",d.id)
-            continue
+        returns:
+            A dataset dict, ready for insertion, or None if there is no value.
+    """
+    data_type, name, unit_id, value, parse_metadata, metadata_dict, user_id = dataset_args
 
-        data_dict = {
-            'type': d.type,
-            'name': d.name,
-            'unit_id': d.unit_id,
-            'created_by': user_id,
-        }
+    val = parse_dataset_value(data_type, value, parse_metadata)
 
-        data_dict['value'] = val
+    if val is None:
+        return None
+
+    data_dict = {
+        'type': data_type,
+        'name': name,
+        'unit_id': unit_id,
+        'created_by': user_id,
+        'value': val,
+        'metadata': metadata_dict,
+    }
+
+    data_dict['hash'] = generate_data_hash(data_dict)
+
+    return data_dict
+
+def _process_incoming_data(data, user_id=None, source=None):
+    """
+        Parse, validate and hash all the incoming datasets.
+        Validating some data types (timeseries, dataframes) is expensive, so if
+        'bulk_insert_workers' is set to more than 1 in the config, and there are
+        more than 'bulk_insert_parallel_threshold' datasets, this is done
+        in a pool of worker processes.
+
+        Returns a dict of the dataset dicts, keyed on their hash. The hash is also
+        set on each of the incoming datasets.
+    """
 
+    all_dataset_args = []
+    for d in data:
         if d.metadata is not None:
             if isinstance(d.metadata, dict):
-                metadata_dict= d.metadata
+                metadata_dict= dict(d.metadata)
             else:
-                metadata_dict = json.loads(d.metadata)
+                metadata_dict = jsonutil.loads(d.metadata)
         else:
             metadata_dict={}
 
+        parse_metadata = d.get_metadata_as_dict()
+
         metadata_keys = [k.lower() for k in metadata_dict]
         if user_id is not None and 'user_id' not in metadata_keys:
             metadata_dict[u'user_id'] = str(user_id)
         if source is not None and 'source' not in metadata_keys:
             metadata_dict[u'source'] = str(source)
 
-        data_dict['metadata'] = metadata_dict
+        all_dataset_args.append((d.type, d.name, d.unit_id, d.value,
+                                 parse_metadata, metadata_dict, user_id))
+
+    num_workers = config.getint('db', 'bulk_insert_workers', 1)
+    parallel_threshold = config.getint('db', 'bulk_insert_parallel_threshold', 10000)
+
+    if num_workers > 1 and len(all_dataset_args) >= parallel_threshold:
+        log.info("Processing %s datasets using %s processes",
+                 len(all_dataset_args), num_workers)
+        chunksize = max(1, len(all_dataset_args) // (num_workers * 4))
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            data_dicts = list(executor.map(_process_dataset,
+                                           all_dataset_args,
+                                           chunksize=chunksize))
+    else:
+        data_dicts = [_process_dataset(a) for a in all_dataset_args]
 
-        d.hash = generate_data_hash(data_dict)
+    datasets = {}
+    for d, data_dict in zip(data, data_dicts):
+        if data_dict is None:
+            log.info("Cannot parse data (dataset_id=%s). "
+                         "Value not available.",d.id)
+            continue
 
-        data_dict['hash'] = d.hash
+        d.hash = data_dict['hash']
         datasets[d.hash] = data_dict
 
     return datasets
@@ -679,55 +799,34 @@ def _get_metadata(dataset_ids):
     """
         Get all the metadata for a given list of datasets
     """
-    metadata = []
     if len(dataset_ids) == 0:
         return []
-    if len(dataset_ids) > qry_in_threshold:
-        idx = 0
-        extent = qry_in_threshold
-        while idx < len(dataset_ids):
-            log.info("Querying %s metadatas", len(dataset_ids[idx:extent]))
-            rs = db.DBSession.query(Metadata).filter(Metadata.dataset_id.in_(dataset_ids[idx:extent])).all()
-            metadata.extend(rs)
-            idx = idx + qry_in_threshold
-
-            if idx + qry_in_threshold > len(dataset_ids):
-                extent = len(dataset_ids)
-            else:
-                extent = extent +qry_in_threshold
-    else:
-        metadata_qry = db.DBSession.query(Metadata).filter(Metadata.dataset_id.in_(dataset_ids))
-        for m in metadata_qry:
-            metadata.append(m)
+
+    log.info("Querying metadata of %s datasets", len(dataset_ids))
+    with in_keys(Metadata.dataset_id, dataset_ids) as dataset_filter:
+        metadata = db.DBSession.query(Metadata).filter(dataset_filter).all()
 
     return metadata
 
 def _get_existing_data(hashes):
+    """
+        Get the datasets with the given hashes, keyed on hash.
+        Only the columns needed to identify and check permissions
+        on each dataset are loaded, as values can be very large.
+    """
 
     str_hashes = [str(h) for h in hashes]
 
     hash_dict = {}
 
-    datasets = []
-    if len(str_hashes) > qry_in_threshold:
-        idx = 0
-        extent =qry_in_threshold
-        while idx < len(str_hashes):
-            log.info("Querying %s datasets", len(str_hashes[idx:extent]))
-            rs = db.DBSession.query(Dataset).filter(Dataset.hash.in_(str_hashes[idx:extent])).all()
-            datasets.extend(rs)
-            idx = idx + qry_in_threshold
-
-            if idx + qry_in_threshold > len(str_hashes):
-                extent = len(str_hashes)
-            else:
-                extent = extent + qry_in_threshold
-    else:
-        datasets = db.DBSession.query(Dataset).filter(Dataset.hash.in_(str_hashes))
+    log.info("Querying %s datasets", len(str_hashes))
+    with in_keys(Dataset.hash, str_hashes) as hash_filter:
+        datasets = db.DBSession.query(Dataset).options(
+            load_only(Dataset.id, Dataset.hash, Dataset.hidden, Dataset.created_by)
+        ).filter(hash_filter)
 
-
-    for r in datasets:
-        hash_dict[r.hash] = r
+        for r in datasets:
+            hash_dict[r.hash] = r
 
     log.info("Retrieved %s datasets", len(hash_dict))
 
@@ -735,32 +834,17 @@ def _get_existing_data(hashes):
 
 def _get_datasets(dataset_ids):
     """
-        Get all the datasets in a list of dataset IDS. This must be done in chunks of 999,
-        as sqlite can only handle 'in' with < 1000 elements.
+        Get all the datasets in a list of dataset IDS, keyed on ID.
     """
 
     dataset_dict = {}
 
-    datasets = []
-    if len(dataset_ids) > qry_in_threshold:
-        idx = 0
-        extent =qry_in_threshold
-        while idx < len(dataset_ids):
-            log.info("Querying %s datasets", len(dataset_ids[idx:extent]))
-            rs = db.DBSession.query(Dataset).filter(Dataset.id.in_(dataset_ids[idx:extent])).all()
-            datasets.extend(rs)
-            idx = idx + qry_in_threshold
-
-            if idx + qry_in_threshold > len(dataset_ids):
-                extent = len(dataset_ids)
-            else:
-                extent = extent + qry_in_threshold
-    else:
-        datasets = db.DBSession.query(Dataset).filter(Dataset.id.in_(dataset_ids))
-
+    log.info("Querying %s datasets", len(dataset_ids))
+    with in_keys(Dataset.id, dataset_ids) as dataset_filter:
+        datasets = db.DBSession.query(Dataset).filter(dataset_filter)
 
-    for r in datasets:
-        dataset_dict[r.id] = r
+        for r in datasets:
+            dataset_dict[r.id] = r
 
     log.info("Retrieved %s datasets", len(dataset_dict))
 
@@ -947,36 +1031,166 @@ def get_val_at_time(dataset_id, timestamps,**kwargs):
 
     data = dataset_i.get_val(timestamp=t)
     if data is not None:
-        dataset = JSONObject({'data': json.dumps(data)})
+        dataset = JSONObject({'data': jsonutil.dumps(data)})
     else:
         dataset = JSONObject({'data': None})
 
     return dataset
 
-def get_multiple_vals_at_time(dataset_ids, timestamps,**kwargs):
+def get_multiple_vals_at_time(dataset_ids, timestamps, result_format='json', **kwargs):
     """
     Given a timestamp (or list of timestamps) and a list of timeseries datasets,
     return the values appropriate to the requested times.
 
     If the timestamp is before the start of the timeseries data, return
     None If the timestamp is after the end of the timeseries data, return
-    the last value.  """
-    datasets = _get_datasets(dataset_ids)
+    the last value.
+
+    result_format: 'json' (default) returns a dict of {timestamp: value}
+                   for each dataset, keyed on 'dataset_<id>'. 'columnar',
+                   'dataframe' and 'arrow' return a dense table (see
+                   util.format_columns) with a 'dataset_id' column and a column
+                   for each timestamp.
+    """
     datetimes = []
     for time in timestamps:
         datetimes.append(get_datetime(time))
 
+    dataset_ids = list(OrderedDict.fromkeys(int(d_id) for d_id in dataset_ids))
+
+    vals = _get_timeseries_vals_at_times(dataset_ids, datetimes)
+
+    #Only datasets which exist are returned
+    dataset_ids = [d_id for d_id in dataset_ids if d_id in vals]
+
+    if result_format != 'json':
+        columns = {'dataset_id': np.array(dataset_ids)}
+        for i, t in enumerate(timestamps):
+            column = np.empty(len(dataset_ids), dtype=object)
+            column[:] = [vals[d_id][i] if vals[d_id] is not None else None
+                         for d_id in dataset_ids]
+            columns[t] = column
+        return format_columns(columns, result_format)
+
     return_vals = {}
-    for dataset_i in datasets.values():
-        data = dataset_i.get_val(timestamp=datetimes)
+    for dataset_id in dataset_ids:
+        dataset_vals = vals[dataset_id]
         ret_data = {}
-        if type(data) is list:
+        if dataset_vals is not None:
             for i, t in enumerate(timestamps):
-                ret_data[t] = data[i]
-        return_vals['dataset_%s'%dataset_i.id] = ret_data
+                ret_data[t] = dataset_vals[i]
+        return_vals['dataset_%s'%dataset_id] = ret_data
 
     return return_vals
 
+def _get_timeseries_vals_at_times(dataset_ids, datetimes):
+    """
+        Look up the values of many timeseries at a list of UTC datetimes.
+
+        Each timeseries is decoded once. The as-of lookup (the position of the
+        last date at or before each time) is a single searchsorted, done once
+        for each distinct set of dates, which is shared by all the timeseries
+        with those dates. Only the values at those positions are kept, and
+        they are stacked into one matrix.
+
+        returns:
+            A dict, keyed on dataset ID, of a list with a value for each datetime.
+            The value for a multi-column timeseries is a list of the column values.
+            Datasets which are not timeseries, or which have no values at
+            the requested times, are None.
+    """
+    seasonal_year = int(config.get('DEFAULT', 'seasonal_year', '1678'))
+
+    times = pd.DatetimeIndex(datetimes)
+    if times.tz is None:
+        times = times.tz_localize('UTC')
+    utc_times = times.tz_convert('UTC')
+    seasonal_times = None
+
+    #The lookup positions for each distinct set of dates, keyed on a digest of the dates
+    lookups = {}
+    #The values of single column timeseries, grouped by lookup and column type
+    groups = {}
+    vals = {}
+    with in_keys(Dataset.id, dataset_ids) as dataset_filter:
+        dataset_qry = db.DBSession.query(Dataset.id, Dataset.type, Dataset.value).filter(
+            dataset_filter)
+
+        for dataset in dataset_qry:
+            vals[dataset.id] = None
+            if dataset.type not in ('timeseries', 'regular_timeseries'):
+                continue
+
+            try:
+                timeseries = get_val(dataset)
+            except Exception as e:
+                log.critical("Unable to retrieve data for dataset %s: %s", dataset.id, e)
+                continue
+
+            index = timeseries.index
+            if not isinstance(index, pd.DatetimeIndex) or len(index) == 0:
+                continue
+
+            if not index.is_monotonic_increasing:
+                timeseries = timeseries.sort_index(kind='mergesort')
+                index = timeseries.index
+
+            #Seasonal timeseries are stored in the seasonal year, so
+            #the requested times must be moved into that year.
+            seasonal = index[0].year == seasonal_year and index[-1].year == seasonal_year
+            if seasonal and seasonal_times is None:
+                try:
+                    seasonal_times = pd.DatetimeIndex(
+                        [t.replace(year=seasonal_year) for t in utc_times])
+                except ValueError as e:
+                    log.critical("Unable to retrieve seasonal data. Check timestamps.")
+                    log.critical(e)
+                    continue
+
+            dates = index.asi8
+            lookup_key = (seasonal, hashlib.blake2b(dates.tobytes(), digest_size=16).digest())
+            lookup = lookups.get(lookup_key)
+            if lookup is None:
+                lookup_times = seasonal_times if seasonal else utc_times
+                positions = np.searchsorted(dates, lookup_times.asi8, side='right') - 1
+                before_start = positions < 0
+                positions[before_start] = 0
+                lookup = lookups[lookup_key] = (positions, before_start)
+
+            positions, before_start = lookup
+            values = timeseries.values[positions]
+
+            if values.shape[1] == 1:
+                group_key = (lookup_key, values.dtype.str)
+            else:
+                #Multi-column timeseries are returned on their own
+                group_key = (lookup_key, dataset.id)
+            groups.setdefault(group_key, (before_start, [], []))
+            groups[group_key][1].append(dataset.id)
+            groups[group_key][2].append(values)
+
+    for before_start, group_ids, group_values in groups.values():
+        #rows are times, columns are datasets (or the columns of one dataset)
+        matrix = np.hstack(group_values)
+        missing = pd.isnull(matrix)
+        missing[before_start, :] = True
+
+        if missing.all():
+            continue
+
+        matrix = matrix.astype(object)
+        matrix[missing] = None
+
+        if group_values[0].shape[1] > 1:
+            vals[group_ids[0]] = matrix.tolist()
+        else:
+            for i, dataset_vals in enumerate(matrix.T.tolist()):
+                #A dataset with no values at any of the times gives None
+                if not missing[:, i].all():
+                    vals[group_ids[i]] = dataset_vals
+
+    return vals
+
 def get_vals_between_times(dataset_id, start_time, end_time, timestep, increment, **kwargs):
     """
         Retrive data between two specified times within a timeseries. The times
@@ -1034,10 +1248,112 @@ def get_vals_between_times(dataset_id, start_time, end_time, timestep, increment
     else:
         data_to_return.append(data)
 
-    dataset = JSONObject({'data' : json.dumps(data_to_return)})
+    dataset = JSONObject({'data' : jsonutil.dumps(data_to_return)})
 
     return dataset
 
+def convert_timeseries(dataset_id, data_type, frequency=None, **kwargs):
+    """
+        Convert a timeseries to a regular timeseries, which stores only its
+        start date and frequency rather than every date, or back again.
+        Conversion ALWAYS creates a NEW dataset (or re-uses an identical one),
+        the original dataset is not changed.
+
+        args:
+            dataset_id (int): The ID of the timeseries or regular timeseries
+            data_type (string): 'regular_timeseries' or 'timeseries'
+            frequency (string): The frequency of the regular timeseries, as a pandas
+                                offset alias such as 'H' or 'D'. If not given,
+                                it is inferred from the dates.
+        returns:
+            The new dataset
+        raises:
+            ResourceNotFoundError if the dataset does not exist
+            HydraError if the dataset can't be converted, such as a timeseries
+                       whose dates are not regular
+    """
+    user_id = kwargs.get('user_id')
+
+    try:
+        dataset_i = db.DBSession.query(Dataset).filter(Dataset.id==dataset_id).one()
+    except NoResultFound:
+        raise ResourceNotFoundError("Dataset %s not found"%(dataset_id,))
+
+    dataset_i.check_read_permission(user_id)
+
+    data_type = data_type.lower()
+    conversion = (dataset_i.type.lower(), data_type)
+    try:
+        if conversion == ('timeseries', 'regular_timeseries'):
+            value = RegularTimeseries.fromTimeseries(dataset_i.value, frequency=frequency).value
+        elif conversion == ('regular_timeseries', 'timeseries'):
+            value = RegularTimeseries.fromDataset(dataset_i.value).toTimeseries()
+        else:
+            raise HydraError("Unable to convert a dataset of type %s to %s"%conversion)
+    except (ValueError, TypeError, AssertionError) as e:
+        raise HydraError("Unable to convert dataset %s to %s: %s"%(dataset_id, data_type, e))
+
+    new_dataset = add_dataset(data_type,
+                              value,
+                              unit_id=dataset_i.unit_id,
+                              metadata=dataset_i.get_metadata_as_dict(),
+                              name=dataset_i.name,
+                              user_id=user_id,
+                              flush=True)
+
+    return new_dataset
+
+def convert_array(dataset_id, data_type, dtype=None, **kwargs):
+    """
+        Convert an array, stored as nested lists, to a tensor, stored as a
+        packed buffer of a single numeric type, or back again.
+        Conversion ALWAYS creates a NEW dataset (or re-uses an identical one),
+        the original dataset is not changed.
+
+        args:
+            dataset_id (int): The ID of the array or tensor
+            data_type (string): 'tensor' or 'array'
+            dtype (string): The numpy type of the tensor's values, such as 'float32'.
+                            If not given, it is inferred from the values.
+        returns:
+            The new dataset
+        raises:
+            ResourceNotFoundError if the dataset does not exist
+            HydraError if the dataset can't be converted, such as an array
+                       whose values are not numbers, or whose lists are
+                       not all the same length
+    """
+    user_id = kwargs.get('user_id')
+
+    try:
+        dataset_i = db.DBSession.query(Dataset).filter(Dataset.id==dataset_id).one()
+    except NoResultFound:
+        raise ResourceNotFoundError("Dataset %s not found"%(dataset_id,))
+
+    dataset_i.check_read_permission(user_id)
+
+    data_type = data_type.lower()
+    conversion = (dataset_i.type.lower(), data_type)
+    try:
+        if conversion == ('array', 'tensor'):
+            value = Tensor.fromArray(dataset_i.value, dtype=dtype).value
+        elif conversion == ('tensor', 'array'):
+            value = Tensor.fromDataset(dataset_i.value).toArray()
+        else:
+            raise HydraError("Unable to convert a dataset of type %s to %s"%conversion)
+    except (ValueError, TypeError, AssertionError) as e:
+        raise HydraError("Unable to convert dataset %s to %s: %s"%(dataset_id, data_type, e))
+
+    new_dataset = add_dataset(data_type,
+                              value,
+                              unit_id=dataset_i.unit_id,
+                              metadata=dataset_i.get_metadata_as_dict(),
+                              name=dataset_i.name,
+                              user_id=user_id,
+                              flush=True)
+
+    return new_dataset
+
 def delete_dataset(dataset_id,**kwargs):
     """
         Removes a piece of data from the DB.
@@ -85,6 +85,7 @@ def update_resourcegroup(group,**kwargs):
 def add_resourcegroupitem(group_item, scenario_id,**kwargs):
 
     scenario._check_can_edit_scenario(scenario_id, kwargs['user_id'])
+    scenario._materialize_copies(scenario_id, flatten=True)
     #Check whether the ref_id is correct.
 
     if group_item.ref_key == 'NODE':
@@ -123,9 +124,18 @@ def add_resourcegroupitem(group_item, scenario_id,**kwargs):
 
     return group_item_i
 
-def delete_resourcegroupitem(item_id,**kwargs):
+def delete_resourcegroupitem(item_id, scenario_id=None, **kwargs):
+    """
+        Delete a group item. A copy-on-write clone shows the group items of
+        the scenario it was cloned from, so to delete one of those from the
+        clone, rather than from the scenario it is in, pass the clone's ID as scenario_id.
+    """
     group_item_i = _get_item(item_id)
-    scenario._check_can_edit_scenario(group_item_i.scenario_id, kwargs['user_id'])
+    if scenario_id is None:
+        scenario_id = group_item_i.scenario_id
+    scenario._check_can_edit_scenario(scenario_id, kwargs['user_id'])
+    scenario._materialize_copies(scenario_id, flatten=True)
+    group_item_i = scenario._get_scenario_group_item(group_item_i, scenario_id)
     db.DBSession.delete(group_item_i)
     db.DBSession.flush()
 
@@ -19,14 +19,13 @@
 
 import datetime
 import time
-import json
 import six
 
 from ..exceptions import HydraError, ResourceNotFoundError
 from . import scenario, rules
 from . import data
 from . import units
-from .objects import JSONObject, Dataset as JSONDataset
+from .objects import JSONObject, Dataset as JSONDataset, make_json_objects
 
 from ..util.permissions import required_perms
 from . import template
@@ -35,15 +34,25 @@ from ..db.model import Project, Network, Scenario, Node, Link, ResourceGroup,\
         ResourceScenario, TemplateType, TypeAttr, Template, NetworkOwner, User, Rule
 from sqlalchemy.orm import noload, joinedload
 from .. import db
+from .. import config
 from sqlalchemy import func, and_, or_, distinct
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm import aliased
 from ..util import hdb
-
-from sqlalchemy import case
+from ..util import jsonutil
+from ..util import rows_to_columns, format_columns, filter_columns, get_column
+from ..util.graph import NetworkGraph
+from ..util.spatial import PointIndex, SegmentIndex
+from ..util.lookup import in_keys
+from ..util.cache import get_network_snapshot_key, get_network_snapshot, set_network_snapshot,\
+        invalidate_network, get_network_cache
+
+from sqlalchemy import case, select, literal, union_all, Integer
 from sqlalchemy.sql import null
+from zope.sqlalchemy import mark_changed
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+import numpy as np
 
 import logging
 log = logging.getLogger(__name__)
@@ -574,7 +583,7 @@ def add_network(network,**kwargs):
 
     return net_i
 
-def _get_all_resource_attributes(network_id, template_id=None, include_non_template_attributes=False):
+def _get_all_resource_attributes(network_id, template_id=None, include_non_template_attributes=False, result_format='json'):
     """
         Get all the attributes for the nodes, links and groups of a network.
         Return these attributes as a dictionary, keyed on type (NODE, LINK, GROUP)
@@ -587,23 +596,13 @@ def _get_all_resource_attributes(network_id, template_id=None, include_non_templ
            include_non_template_attributes (bool): If template_id is specified and any
                                 resource has attribtues which are NOT associated to any
                                 network template, this flag indicates whether to return them or not.
+           result_format (string): 'json' (default) or one of the columnar formats
+                                accepted by util.rows_to_columns, in which case
+                                a single table of all the attributes is returned.
         returns:
             A list of sqlalchemy result proxy objects
     """
-    base_qry = db.DBSession.query(
-                               ResourceAttr.id.label('id'),
-                               ResourceAttr.ref_key.label('ref_key'),
-                               ResourceAttr.cr_date.label('cr_date'),
-                               ResourceAttr.attr_is_var.label('attr_is_var'),
-                               ResourceAttr.node_id.label('node_id'),
-                               ResourceAttr.link_id.label('link_id'),
-                               ResourceAttr.group_id.label('group_id'),
-                               ResourceAttr.network_id.label('network_id'),
-                               ResourceAttr.attr_id.label('attr_id'),
-                               Attr.name.label('name'),
-                               Attr.dimension_id.label('dimension_id'),
-                              ).filter(Attr.id==ResourceAttr.attr_id)
-
+    base_qry = _get_resource_attribute_qry()
 
     all_node_attribute_qry = base_qry.join(Node).filter(Node.network_id==network_id)
 
@@ -618,9 +617,21 @@ def _get_all_resource_attributes(network_id, template_id=None, include_non_templ
     attribute_qry = all_node_attribute_qry.union(all_link_attribute_qry,
                                                  all_group_attribute_qry,
                                                  network_attribute_qry)
-    all_resource_attributes = db.DBSession.execute(attribute_qry.statement).fetchall()
+    result = db.DBSession.execute(attribute_qry.statement)
+    all_resource_attributes = result.fetchall()
     log.info("%s attrs retrieved in %s", len(all_resource_attributes), time.time()-x)
 
+    if result_format != 'json':
+        attribute_columns = rows_to_columns(result.keys(), all_resource_attributes, result_format)
+        if template_id is not None:
+            template_attr_lookup, all_network_typeattrs = _get_network_template_attribute_lookup(network_id)
+            attr_ids = get_column(attribute_columns, 'attr_id')
+            in_template = np.isin(attr_ids, template_attr_lookup.get(template_id, []))
+            if include_non_template_attributes is True:
+                in_template |= ~np.isin(attr_ids, all_network_typeattrs)
+            attribute_columns = filter_columns(attribute_columns, in_template)
+        return attribute_columns
+
     logging.info("Attributes retrieved. Processing results...")
     x = time.time()
 
@@ -634,19 +645,12 @@ def _get_all_resource_attributes(network_id, template_id=None, include_non_templ
     template_attr_lookup, all_network_typeattrs = _get_network_template_attribute_lookup(network_id)
 
     for resource_attr in all_resource_attributes:
-        if template_id is not None:
-            #check if it's in the template. If not, it's either associated to another
-            #template or to no template
-            if resource_attr.attr_id not in template_attr_lookup.get(template_id, []):
-                #check if it's in any other template
-                if include_non_template_attributes is True:
-                    #if it's associated to a template (but not this one because
-                    #it wouldn't have reached this far) then ignore it
-                    if resource_attr.attr_id in all_network_typeattrs:
-                        continue
-                else:
-                    #The attr is associated to another template.
-                    continue
+        if not _is_template_attribute(resource_attr,
+                                      template_id,
+                                      include_non_template_attributes,
+                                      template_attr_lookup,
+                                      all_network_typeattrs):
+            continue
 
         attr_dict = rt_attribute_dict[resource_attr.ref_key]
         resourceid = _get_resource_id(resource_attr)
@@ -657,6 +661,53 @@ def _get_all_resource_attributes(network_id, template_id=None, include_non_templ
     logging.info("Attributes processed in %s", time.time()-x)
     return rt_attribute_dict
 
+def _get_resource_attribute_qry():
+    """
+        The base query used to retrieve resource attributes, along with the
+        name and dimension of their attribute, as plain rows.
+    """
+    return db.DBSession.query(
+                               ResourceAttr.id.label('id'),
+                               ResourceAttr.ref_key.label('ref_key'),
+                               ResourceAttr.cr_date.label('cr_date'),
+                               ResourceAttr.attr_is_var.label('attr_is_var'),
+                               ResourceAttr.node_id.label('node_id'),
+                               ResourceAttr.link_id.label('link_id'),
+                               ResourceAttr.group_id.label('group_id'),
+                               ResourceAttr.network_id.label('network_id'),
+                               ResourceAttr.attr_id.label('attr_id'),
+                               Attr.name.label('name'),
+                               Attr.dimension_id.label('dimension_id'),
+                              ).filter(Attr.id==ResourceAttr.attr_id)
+
+def _is_template_attribute(resource_attr,
+                           template_id,
+                           include_non_template_attributes,
+                           template_attr_lookup,
+                           all_network_typeattrs):
+    """
+        Check whether a resource attribute should be returned when a network
+        is being filtered by template. If template_id is None, everything
+        is returned.
+    """
+    if template_id is None:
+        return True
+
+    #check if it's in the template. If not, it's either associated to another
+    #template or to no template
+    if resource_attr.attr_id not in template_attr_lookup.get(template_id, []):
+        #check if it's in any other template
+        if include_non_template_attributes is True:
+            #if it's associated to a template (but not this one because
+            #it wouldn't have reached this far) then ignore it
+            if resource_attr.attr_id in all_network_typeattrs:
+                return False
+        else:
+            #The attr is associated to another template.
+            return False
+
+    return True
+
 def _get_resource_id(attr):
     """
         return either the node, link, group or network ID of an attribute.
@@ -701,13 +752,12 @@ def _get_network_template_attribute_lookup(network_id):
 
     return typeattr_lookup, all_network_typeattrs
 
-def _get_all_templates(network_id, template_id):
+def _get_resource_type_qry():
     """
-        Get all the templates for the nodes, links and groups of a network.
-        Return these templates as a dictionary, keyed on type (NODE, LINK, GROUP)
-        then by ID of the node or link.
+        The base query used to retrieve the types of resources, along with
+        their template, as plain rows.
     """
-    base_qry = db.DBSession.query(
+    return db.DBSession.query(
                                ResourceType.ref_key.label('ref_key'),
                                ResourceType.node_id.label('node_id'),
                                ResourceType.link_id.label('link_id'),
@@ -721,6 +771,25 @@ def _get_all_templates(network_id, template_id):
                               ).filter(TemplateType.id==ResourceType.type_id,
                                        Template.id==TemplateType.template_id)
 
+def _make_template_type(t):
+    """
+        Turn a row from the resource type query into a template type object
+    """
+    return JSONObject({
+                       'template_id':t.template_id,
+                       'id':t.type_id,
+                       'template_name':t.template_name,
+                       'layout': t.layout,
+                       'name': t.type_name,})
+
+def _get_all_templates(network_id, template_id, result_format='json'):
+    """
+        Get all the templates for the nodes, links and groups of a network.
+        Return these templates as a dictionary, keyed on type (NODE, LINK, GROUP)
+        then by ID of the node or link. If a columnar result_format is requested,
+        return a single table of all the types instead.
+    """
+    base_qry = _get_resource_type_qry()
 
     all_node_type_qry = base_qry.filter(Node.id==ResourceType.node_id,
                                         Node.network_id==network_id)
@@ -742,9 +811,13 @@ def _get_all_templates(network_id, template_id):
     x = time.time()
     log.info("Getting all types")
     type_qry = all_node_type_qry.union(all_link_type_qry, all_group_type_qry, network_type_qry)
-    all_types = db.DBSession.execute(type_qry.statement).fetchall()
+    result = db.DBSession.execute(type_qry.statement)
+    all_types = result.fetchall()
     log.info("%s types retrieved in %s", len(all_types), time.time()-x)
 
+    if result_format != 'json':
+        return rows_to_columns(result.keys(), all_types, result_format)
+
 
     log.info("Attributes retrieved. Processing results...")
     x = time.time()
@@ -754,12 +827,7 @@ def _get_all_templates(network_id, template_id):
     network_type_dict = dict()
 
     for t in all_types:
-        templatetype = JSONObject({
-                                    'template_id':t.template_id,
-                                   'id':t.type_id,
-                                   'template_name':t.template_name,
-                                   'layout': t.layout,
-                                   'name': t.type_name,})
+        templatetype = _make_template_type(t)
 
         if t.ref_key == 'NODE':
             nodetype = node_type_dict.get(t.node_id, [])
@@ -790,40 +858,94 @@ def _get_all_templates(network_id, template_id):
     return all_types
 
 
-def _get_all_group_items(network_id):
+def _get_all_group_items(network_id, result_format='json'):
     """
         Get all the resource group items in the network, across all scenarios
-        returns a dictionary of dict objects, keyed on scenario_id
+        returns a dictionary of dict objects, keyed on scenario_id, or a single
+        table of all the items if a columnar result_format is requested.
     """
     base_qry = db.DBSession.query(ResourceGroupItem)
 
-    item_qry = base_qry.join(Scenario).filter(Scenario.network_id==network_id)
+    #The items of copy-on-write clones are loaded by _get_copied_group_items
+    item_qry = base_qry.join(Scenario).filter(Scenario.network_id==network_id,
+                                              Scenario.copy_on_write=='N')
 
     x = time.time()
     logging.info("Getting all items")
-    all_items = db.DBSession.execute(item_qry.statement).fetchall()
+    result = db.DBSession.execute(item_qry.statement)
+    all_items = result.fetchall()
     log.info("%s groups jointly retrieved in %s", len(all_items), time.time()-x)
 
+    if result_format != 'json':
+        return rows_to_columns(result.keys(), all_items, result_format)
+
 
     logging.info("items retrieved. Processing results...")
     x = time.time()
     item_dict = dict()
-    for item in all_items:
+    for item, item_obj in zip(all_items, make_json_objects(all_items, result.keys())):
 
         items = item_dict.get(item.scenario_id, [])
-        items.append(JSONObject(item))
+        items.append(item_obj)
         item_dict[item.scenario_id] = items
 
     logging.info("items processed in %s", time.time()-x)
 
     return item_dict
 
-def _get_all_resourcescenarios(network_id, include_results, user_id):
+def _get_copied_scenarios(network_id, scenario_ids=None):
     """
-        Get all the resource scenarios in a network, across all scenarios
-        returns a dictionary of dict objects, keyed on scenario_id
+        Get the active copy-on-write clones in a network. The data and group
+        items a clone shares with its source are stored against the source,
+        so each clone is loaded on its own, with Scenario.filter_data and
+        Scenario.filter_group_items.
+    """
+    scen_qry = db.DBSession.query(Scenario).filter(
+                    Scenario.network_id == network_id,
+                    Scenario.status == 'A',
+                    Scenario.copy_on_write == 'Y').options(
+                        noload('network'))
+
+    if scenario_ids:
+        scen_qry = scen_qry.filter(Scenario.id.in_(scenario_ids))
+
+    return scen_qry.all()
+
+def _get_copied_group_items(network_id, scenario_ids=None, result_format='json'):
+    """
+        Get the resource group items of each copy-on-write clone in a network,
+        including those it shares with its source. Returns a dictionary, keyed
+        on the ID of the clone, of a list of dict objects, or of a table if a
+        columnar result_format is requested.
     """
+    item_dict = dict()
+    for scenario_i in _get_copied_scenarios(network_id, scenario_ids):
+        item_qry = scenario_i.filter_group_items(db.DBSession.query(ResourceGroupItem))
+        result = db.DBSession.execute(item_qry.statement)
+        items = result.fetchall()
+
+        if result_format != 'json':
+            item_dict[scenario_i.id] = rows_to_columns(result.keys(), items, result_format)
+        else:
+            item_dict[scenario_i.id] = make_json_objects(items, result.keys())
+
+    return item_dict
 
+def _data_requested(include_data):
+    """
+        Check the include_data argument of get_network and iter_network.
+        'Y' (or True) requests data with values. 'L' (lazy) requests data without
+        values, which can be fetched later using get_dataset_values.
+    """
+    return include_data in ('Y', True, 'L')
+
+def _get_resourcescenario_qry(include_results, user_id, include_values=True):
+    """
+        The base query used to retrieve resource scenarios and their datasets
+        as plain rows, excluding any datasets the user is not allowed to see.
+        If include_values is False, the value column is null. Values can
+        be large, so this significantly reduces the amount of data retrieved.
+    """
     rs_qry = db.DBSession.query(
                 Dataset.type,
                 Dataset.unit_id,
@@ -832,7 +954,7 @@ def _get_all_resourcescenarios(network_id, include_results, user_id):
                 Dataset.cr_date,
                 Dataset.created_by,
                 Dataset.hidden,
-                Dataset.value,
+                Dataset.value if include_values else null().label('value'),
                 ResourceScenario.dataset_id,
                 ResourceScenario.scenario_id,
                 ResourceScenario.resource_attr_id,
@@ -841,24 +963,21 @@ def _get_all_resourcescenarios(network_id, include_results, user_id):
     ).outerjoin(DatasetOwner, and_(DatasetOwner.dataset_id==Dataset.id, DatasetOwner.user_id==user_id)).filter(
                 or_(Dataset.hidden=='N', Dataset.created_by==user_id, DatasetOwner.user_id != None),
                 ResourceAttr.id == ResourceScenario.resource_attr_id,
-                Scenario.id==ResourceScenario.scenario_id,
-                Scenario.network_id==network_id,
                 Dataset.id==ResourceScenario.dataset_id)
 
     if include_results == 'N' or include_results == False:
         rs_qry = rs_qry.filter(ResourceAttr.attr_is_var=='N')
 
-    x = time.time()
-    logging.info("Getting all resource scenarios")
-    all_rs = db.DBSession.execute(rs_qry.statement).fetchall()
-    log.info("%s resource scenarios retrieved in %s", len(all_rs), time.time()-x)
+    return rs_qry
 
+def _make_resourcescenarios(rows, keys=None):
+    """
+        Turn the rows from the resource scenario query into resource scenario
+        objects, each with its dataset nested inside it.
+    """
+    rs_objs = make_json_objects(rows, keys)
 
-    logging.info("resource scenarios retrieved. Processing results...")
-    x = time.time()
-    rs_dict = dict()
-    for rs in all_rs:
-        rs_obj = JSONObject(rs)
+    for rs, rs_obj in zip(rows, rs_objs):
         rs_attr = JSONObject({'attr_id':rs.attr_id})
 
         value = rs.value
@@ -879,6 +998,36 @@ def _get_all_resourcescenarios(network_id, include_results, user_id):
         rs_obj.value = rs_dataset
         rs_obj.dataset = rs_dataset
 
+    return rs_objs
+
+def _get_all_resourcescenarios(network_id, include_results, user_id, result_format='json', include_values=True):
+    """
+        Get all the resource scenarios in a network, across all scenarios
+        returns a dictionary of dict objects, keyed on scenario_id, or a single
+        table of all the resource scenarios if a columnar result_format is requested.
+    """
+
+    #The data of copy-on-write clones is loaded by _get_copied_resourcescenarios
+    rs_qry = _get_resourcescenario_qry(include_results, user_id, include_values).filter(
+                Scenario.id==ResourceScenario.scenario_id,
+                Scenario.network_id==network_id,
+                Scenario.copy_on_write=='N')
+
+    x = time.time()
+    logging.info("Getting all resource scenarios")
+    result = db.DBSession.execute(rs_qry.statement)
+    all_rs = result.fetchall()
+    log.info("%s resource scenarios retrieved in %s", len(all_rs), time.time()-x)
+
+    if result_format != 'json':
+        return rows_to_columns(result.keys(), all_rs, result_format)
+
+
+    logging.info("resource scenarios retrieved. Processing results...")
+    x = time.time()
+    rs_dict = dict()
+    for rs, rs_obj in zip(all_rs, _make_resourcescenarios(all_rs, result.keys())):
+
         scenario_rs = rs_dict.get(rs.scenario_id, [])
         scenario_rs.append(rs_obj)
         rs_dict[rs.scenario_id] = scenario_rs
@@ -887,11 +1036,34 @@ def _get_all_resourcescenarios(network_id, include_results, user_id):
 
     return rs_dict
 
+def _get_copied_resourcescenarios(network_id, include_results, user_id, scenario_ids=None,
+                                  result_format='json', include_values=True):
+    """
+        Get the resource scenarios of each copy-on-write clone in a network,
+        including those it shares with its source. Returns a dictionary, keyed
+        on the ID of the clone, of a list of dict objects, or of a table if a
+        columnar result_format is requested.
+    """
+    rs_dict = dict()
+    for scenario_i in _get_copied_scenarios(network_id, scenario_ids):
+        rs_qry = scenario_i.filter_data(
+            _get_resourcescenario_qry(include_results, user_id, include_values))
+        result = db.DBSession.execute(rs_qry.statement)
+        all_rs = result.fetchall()
+
+        if result_format != 'json':
+            rs_dict[scenario_i.id] = rows_to_columns(result.keys(), all_rs, result_format)
+        else:
+            rs_dict[scenario_i.id] = _make_resourcescenarios(all_rs, result.keys())
+
+    return rs_dict
+
 
-def _get_metadata(network_id, user_id):
+def _get_metadata(network_id, user_id, result_format='json'):
     """
         Get all the metadata in a network, across all scenarios
-        returns a dictionary of dict objects, keyed on dataset ID
+        returns a dictionary of dict objects, keyed on dataset ID, or a single
+        table of all the metadata if a columnar result_format is requested.
     """
     log.info("Getting Metadata")
     dataset_qry = db.DBSession.query(
@@ -908,9 +1080,13 @@ def _get_metadata(network_id, user_id):
 
     x = time.time()
     logging.info("Getting all matadata")
-    all_metadata = db.DBSession.execute(rs_qry.statement).fetchall()
+    result = db.DBSession.execute(rs_qry.statement)
+    all_metadata = result.fetchall()
     log.info("%s metadata jointly retrieved in %s",len(all_metadata), time.time()-x)
 
+    if result_format != 'json':
+        return rows_to_columns(result.keys(), all_metadata, result_format)
+
     logging.info("metadata retrieved. Processing results...")
     x = time.time()
     metadata_dict = dict()
@@ -935,9 +1111,10 @@ def _get_network_owners(network_id):
 
     return owners
 
-def _get_nodes(network_id, template_id=None):
+def _get_nodes(network_id, template_id=None, result_format='json'):
     """
-        Get all the nodes in a network
+        Get all the nodes in a network. If a columnar result_format is
+        requested, return them as a single table rather than a list.
     """
     extras = {'types':[], 'attributes':[]}
 
@@ -950,17 +1127,21 @@ def _get_nodes(network_id, template_id=None):
         node_qry = node_qry.filter(ResourceType.node_id==Node.id,
                                    TemplateType.id==ResourceType.type_id,
                                    TemplateType.template_id==template_id)
-    node_res = db.DBSession.execute(node_qry.statement).fetchall()
+    result = db.DBSession.execute(node_qry.statement)
+
+    if result_format != 'json':
+        return rows_to_columns(result.keys(), result.fetchall(), result_format)
 
-    nodes = []
-    for n in node_res:
-        nodes.append(JSONObject(n, extras=extras))
+    node_res = result.fetchall()
+
+    nodes = make_json_objects(node_res, result.keys(), extras=extras)
 
     return nodes
 
-def _get_links(network_id, template_id=None):
+def _get_links(network_id, template_id=None, result_format='json'):
     """
-        Get all the links in a network
+        Get all the links in a network. If a columnar result_format is
+        requested, return them as a single table rather than a list.
     """
     extras = {'types':[], 'attributes':[]}
     link_qry = db.DBSession.query(Link).filter(
@@ -973,17 +1154,21 @@ def _get_links(network_id, template_id=None):
                                    TemplateType.id==ResourceType.type_id,
                                    TemplateType.template_id==template_id)
 
-    link_res = db.DBSession.execute(link_qry.statement).fetchall()
+    result = db.DBSession.execute(link_qry.statement)
+
+    if result_format != 'json':
+        return rows_to_columns(result.keys(), result.fetchall(), result_format)
 
-    links = []
-    for l in link_res:
-        links.append(JSONObject(l, extras=extras))
+    link_res = result.fetchall()
+
+    links = make_json_objects(link_res, result.keys(), extras=extras)
 
     return links
 
-def _get_groups(network_id, template_id=None):
+def _get_groups(network_id, template_id=None, result_format='json'):
     """
-        Get all the resource groups in a network
+        Get all the resource groups in a network. If a columnar result_format is
+        requested, return them as a single table rather than a list.
     """
     extras = {'types':[], 'attributes':[]}
     group_qry = db.DBSession.query(ResourceGroup).filter(
@@ -997,16 +1182,19 @@ def _get_groups(network_id, template_id=None):
                                      TemplateType.id==ResourceType.type_id,
                                      TemplateType.template_id==template_id)
 
-    group_res = db.DBSession.execute(group_qry.statement).fetchall()
-    groups = []
-    for g in group_res:
-        groups.append(JSONObject(g, extras=extras))
+    result = db.DBSession.execute(group_qry.statement)
+
+    if result_format != 'json':
+        return rows_to_columns(result.keys(), result.fetchall(), result_format)
+
+    group_res = result.fetchall()
+    groups = make_json_objects(group_res, result.keys(), extras=extras)
 
     return groups
 
-def _get_scenarios(network_id, include_data, include_results, user_id, scenario_ids=None):
+def _get_scenario_rows(network_id, scenario_ids=None, extras=None):
     """
-        Get all the scenarios in a network
+        Get the active scenarios in a network, without their data
     """
     scen_qry = db.DBSession.query(Scenario).filter(
                     Scenario.network_id == network_id).options(
@@ -1016,19 +1204,49 @@ def _get_scenarios(network_id, include_data, include_results, user_id, scenario_
     if scenario_ids:
         logging.info("Filtering by scenario_ids %s",scenario_ids)
         scen_qry = scen_qry.filter(Scenario.id.in_(scenario_ids))
-    extras = {'resourcescenarios': [], 'resourcegroupitems': []}
-    scens = [JSONObject(s,extras=extras) for s in db.DBSession.execute(scen_qry.statement).fetchall()]
+    result = db.DBSession.execute(scen_qry.statement)
+    return make_json_objects(result.fetchall(), result.keys(), extras=extras or {})
 
-    all_resource_group_items = _get_all_group_items(network_id)
+def _add_scenario_queries(queries, network_id, include_data, include_results, user_id,
+                          scenario_ids=None, result_format='json'):
+    """
+        Add the queries needed to build the scenarios of a network for get_network
+    """
+    queries['scenarios'] = (_get_scenario_rows, (network_id, scenario_ids,
+                            {'resourcescenarios': [], 'resourcegroupitems': []}
+                            if result_format == 'json' else None))
+    queries['group_items'] = (_get_all_group_items, (network_id, result_format))
+    queries['copied_group_items'] = (_get_copied_group_items,
+                                     (network_id, scenario_ids, result_format))
+
+    if _data_requested(include_data):
+        queries['resourcescenarios'] = (_get_all_resourcescenarios,
+                                        (network_id, include_results, user_id,
+                                         result_format, include_data != 'L'))
+        queries['copied_resourcescenarios'] = (_get_copied_resourcescenarios,
+                                               (network_id, include_results, user_id,
+                                                scenario_ids, result_format,
+                                                include_data != 'L'))
+        queries['metadata'] = (_get_metadata, (network_id, user_id, result_format))
+
+def _build_scenarios(results, include_data):
+    """
+        Add the group items and data, returned by the queries from
+        _add_scenario_queries, to each scenario.
+    """
+    scens = results['scenarios']
+    all_resource_group_items = results['group_items']
+    all_resource_group_items.update(results['copied_group_items'])
 
-    if include_data == 'Y' or include_data == True:
-        all_rs = _get_all_resourcescenarios(network_id, include_results, user_id)
-        metadata = _get_metadata(network_id, user_id)
+    if _data_requested(include_data):
+        all_rs = results['resourcescenarios']
+        all_rs.update(results['copied_resourcescenarios'])
+        metadata = results['metadata']
 
     for s in scens:
         s.resourcegroupitems = all_resource_group_items.get(s.id, [])
 
-        if include_data == 'Y' or include_data == True:
+        if _data_requested(include_data):
             s.resourcescenarios  = all_rs.get(s.id, [])
 
             for rs in s.resourcescenarios:
@@ -1036,13 +1254,183 @@ def _get_scenarios(network_id, include_data, include_results, user_id, scenario_
 
     return scens
 
+def _get_scenarios(network_id, include_data, include_results, user_id, scenario_ids=None):
+    """
+        Get all the scenarios in a network
+    """
+    queries = OrderedDict()
+    _add_scenario_queries(queries, network_id, include_data, include_results, user_id, scenario_ids)
+
+    return _build_scenarios(_run_network_queries(queries), include_data)
+
+def _get_network_load_workers():
+    """
+        The number of connections to use to load a network. This is set by
+        [db] network_load_workers, and limited by the size of the connection pool.
+        The load can only be split if other connections would see the same data as
+        the current one (see db.can_read_concurrently).
+    """
+    workers = config.getint('db', 'network_load_workers', 1)
+    workers = min(workers, config.getint('mysqld', 'pool_size', 5))
+
+    if workers > 1 and not db.can_read_concurrently():
+        log.info("Unable to load network concurrently. Loading on a single connection.")
+        workers = 1
+
+    return workers
+
+def _run_network_queries(queries, workers=1):
+    """
+        Run the independent queries used to build a network, in parallel if
+        workers > 1. Returns the result of each query, keyed on its name.
+    """
+    if workers > 1:
+        return db.run_concurrent_reads(queries, workers)
+
+    return dict((name, func(*args)) for name, (func, args) in queries.items())
+
+def _get_network_objects(net,
+                         include_attributes,
+                         include_data,
+                         include_results,
+                         scenario_ids,
+                         template_id,
+                         include_non_template_attributes,
+                         user_id,
+                         workers=1):
+    """
+        Populate a network object for get_network with its nodes, links,
+        groups, attributes, types and scenarios.
+    """
+    network_id = net.id
+
+    queries = OrderedDict()
+    queries['nodes']          = (_get_nodes, (network_id, template_id))
+    queries['links']          = (_get_links, (network_id, template_id))
+    queries['resourcegroups'] = (_get_groups, (network_id, template_id))
+    queries['owners']         = (_get_network_owners, (network_id,))
+    if include_attributes in ('Y', True):
+        queries['attributes'] = (_get_all_resource_attributes,
+                                 (network_id, template_id, include_non_template_attributes))
+    queries['types']          = (_get_all_templates, (network_id, template_id))
+    _add_scenario_queries(queries, network_id, include_data, include_results, user_id, scenario_ids)
+
+    results = _run_network_queries(queries, workers)
+
+    net.nodes          = results['nodes']
+    net.links          = results['links']
+    net.resourcegroups = results['resourcegroups']
+    net.owners         = results['owners']
+
+    if include_attributes in ('Y', True):
+        all_attributes = results['attributes']
+        log.info("Setting attributes")
+        net.attributes = all_attributes['NETWORK'].get(network_id, [])
+        for node_i in net.nodes:
+            node_i.attributes = all_attributes['NODE'].get(node_i.id, [])
+        log.info("Node attributes set")
+        for link_i in net.links:
+            link_i.attributes = all_attributes['LINK'].get(link_i.id, [])
+        log.info("Link attributes set")
+        for group_i in net.resourcegroups:
+            group_i.attributes = all_attributes['GROUP'].get(group_i.id, [])
+        log.info("Group attributes set")
+
+
+    log.info("Setting types")
+    all_types = results['types']
+    net.types = all_types['NETWORK'].get(network_id, [])
+    for node_i in net.nodes:
+        node_i.types = all_types['NODE'].get(node_i.id, [])
+    for link_i in net.links:
+        link_i.types = all_types['LINK'].get(link_i.id, [])
+    for group_i in net.resourcegroups:
+        group_i.types = all_types['GROUP'].get(group_i.id, [])
+
+    log.info("Getting scenarios")
+
+    net.scenarios = _build_scenarios(results, include_data)
+
+    return net
+
+def _get_network_columns(net,
+                         include_attributes,
+                         include_data,
+                         include_results,
+                         scenario_ids,
+                         template_id,
+                         include_non_template_attributes,
+                         user_id,
+                         result_format,
+                         workers=1):
+    """
+        Populate a network object for get_network using a columnar result
+        format. Instead of a list of objects, the nodes, links, groups,
+        attributes and types of the network are each a single table,
+        and the group items and data of each scenario are tables
+        filtered from one table for the whole network.
+    """
+    network_id = net.id
+
+    queries = OrderedDict()
+    queries['nodes']          = (_get_nodes, (network_id, template_id, result_format))
+    queries['links']          = (_get_links, (network_id, template_id, result_format))
+    queries['resourcegroups'] = (_get_groups, (network_id, template_id, result_format))
+    queries['owners']         = (_get_network_owners, (network_id,))
+    if include_attributes in ('Y', True):
+        queries['attributes'] = (_get_all_resource_attributes,
+                                 (network_id, template_id, include_non_template_attributes,
+                                  result_format))
+    queries['types']          = (_get_all_templates, (network_id, template_id, result_format))
+    _add_scenario_queries(queries, network_id, include_data, include_results, user_id,
+                          scenario_ids, result_format)
+
+    results = _run_network_queries(queries, workers)
+
+    net.nodes          = results['nodes']
+    net.links          = results['links']
+    net.resourcegroups = results['resourcegroups']
+    net.owners         = results['owners']
+
+    if include_attributes in ('Y', True):
+        net.attributes = results['attributes']
+
+    net.types = results['types']
+
+    net.scenarios = results['scenarios']
+
+    all_items = results['group_items']
+    item_scenario_ids = get_column(all_items, 'scenario_id')
+    copied_items = results['copied_group_items']
+
+    if _data_requested(include_data):
+        all_rs = results['resourcescenarios']
+        rs_scenario_ids = get_column(all_rs, 'scenario_id')
+        copied_rs = results['copied_resourcescenarios']
+        net.metadata = results['metadata']
+
+    for s in net.scenarios:
+        if s.id in copied_items:
+            s.resourcegroupitems = copied_items[s.id]
+        else:
+            s.resourcegroupitems = filter_columns(all_items, item_scenario_ids == s.id)
+
+        if _data_requested(include_data):
+            if s.id in copied_rs:
+                s.resourcescenarios = copied_rs[s.id]
+            else:
+                s.resourcescenarios = filter_columns(all_rs, rs_scenario_ids == s.id)
+
+    return net
+
 def get_network(network_id,
                 include_attributes=True,
                 include_data='N',
                 include_results='Y',
                 scenario_ids=None,
                 template_id=None,
-                include_non_template_attributes=False, **kwargs):
+                include_non_template_attributes=False,
+                result_format='json', **kwargs):
     """
         Return a whole network as a dictionary.
         network_id: ID of the network to retrieve
@@ -1050,6 +1438,8 @@ def get_network(network_id,
         include_data: 'Y' or 'N'. Indicate whether scenario data is to be returned.
                       This has a significant speed impact as retrieving large amounts
                       of data can be expensive.
+                      'L' (lazy) returns the data without the dataset values, which can
+                      then be fetched as they are needed using get_dataset_values.
         include_results: 'Y' or 'N'. If data is requested, this flag allows results
                          data to be ignored (attr is var), as this can often be very large.
         scenario_ids: list of IDS to be returned. Used if a network has multiple
@@ -1057,6 +1447,14 @@ def get_network(network_id,
                       will speed up this function call.
         template_id:  Return the network with only attributes associated with this
                       template on the network, groups, nodes and links.
+        result_format: 'json' (default) returns the network as nested objects.
+                      'columnar', 'dataframe' or 'arrow' return the nodes, links,
+                      groups, attributes, types and each scenario's group items
+                      and data as tables (a dict of numpy arrays, a pandas dataframe
+                      or a pyarrow table respectively), built directly from the query
+                      results. Metadata is returned as a single table on the network.
+                      These formats are intended for use in-process, as they are
+                      not JSON serialisable.
     """
     log.debug("getting network %s"%network_id)
 
@@ -1077,48 +1475,289 @@ def get_network(network_id,
 
         net_i.check_read_permission(user_id)
 
+        snapshot_key = get_network_snapshot_key(network_id,
+                                                include_attributes=include_attributes,
+                                                include_data=include_data,
+                                                include_results=include_results,
+                                                scenario_ids=sorted(scenario_ids) if scenario_ids else None,
+                                                template_id=template_id,
+                                                include_non_template_attributes=include_non_template_attributes,
+                                                result_format=result_format,
+                                                user_id=user_id)
+
+        net = get_network_snapshot(snapshot_key)
+        if net is not None:
+            log.info("Network %s retrieved from the cache", network_id)
+            return net
+
         net = JSONObject(net_i)
 
-        net.nodes          = _get_nodes(network_id, template_id=template_id)
-        net.links          = _get_links(network_id, template_id=template_id)
-        net.resourcegroups = _get_groups(network_id, template_id=template_id)
-        net.owners         = _get_network_owners(network_id)
+        workers = _get_network_load_workers()
+
+        if result_format != 'json':
+            _get_network_columns(net,
+                                 include_attributes,
+                                 include_data,
+                                 include_results,
+                                 scenario_ids,
+                                 template_id,
+                                 include_non_template_attributes,
+                                 user_id,
+                                 result_format,
+                                 workers=workers)
+        else:
+            _get_network_objects(net,
+                                 include_attributes,
+                                 include_data,
+                                 include_results,
+                                 scenario_ids,
+                                 template_id,
+                                 include_non_template_attributes,
+                                 user_id,
+                                 workers=workers)
+
+        set_network_snapshot(snapshot_key, net)
+
+    except NoResultFound:
+        raise ResourceNotFoundError("Network (network_id=%s) not found." % network_id)
+
+    return net
+
+def _iter_keyset_chunks(qry, key_column, chunk_size):
+    """
+        Execute a query in chunks of chunk_size rows, ordered by key_column,
+        using the last key of each chunk as the starting point of the next.
+        Unlike a single server-side cursor, this leaves the connection free
+        between chunks, so other queries can be issued while the chunks are
+        being consumed.
+    """
+    last_key = None
+    while True:
+        chunk_qry = qry
+        if last_key is not None:
+            chunk_qry = chunk_qry.filter(key_column > last_key)
+
+        chunk_qry = chunk_qry.order_by(key_column).limit(chunk_size)
+
+        rows = db.DBSession.execute(chunk_qry.statement).fetchall()
+
+        if len(rows) == 0:
+            return
+
+        yield rows
 
+        if len(rows) < chunk_size:
+            return
+
+        last_key = getattr(rows[-1], key_column.key)
+
+def _make_network_chunk(section, items, **extras):
+    """
+        Build one chunk of a streamed network. The items are assigned
+        after construction to avoid them being re-parsed by JSONObject.
+    """
+    chunk = JSONObject(extras)
+    chunk.section = section
+    chunk['items'] = items
+    return chunk
+
+def _iter_resources(network_id,
+                    resource_class,
+                    ref_key,
+                    include_attributes,
+                    template_id,
+                    include_non_template_attributes,
+                    template_attr_lookup,
+                    all_network_typeattrs,
+                    chunk_size):
+    """
+        Stream the active nodes, links or groups of a network in chunks, with
+        the attributes and types of each chunk retrieved alongside it.
+    """
+
+    id_column = {'NODE': ResourceAttr.node_id,
+                 'LINK': ResourceAttr.link_id,
+                 'GROUP': ResourceAttr.group_id}[ref_key]
+    type_id_column = {'NODE': ResourceType.node_id,
+                      'LINK': ResourceType.link_id,
+                      'GROUP': ResourceType.group_id}[ref_key]
+
+    resource_qry = db.DBSession.query(resource_class).filter(
+                        resource_class.network_id==network_id,
+                        resource_class.status=='A').options(
+                            noload('network')
+                        )
+
+    if template_id is not None:
+        resource_qry = resource_qry.filter(type_id_column==resource_class.id,
+                                           TemplateType.id==ResourceType.type_id,
+                                           TemplateType.template_id==template_id)
+
+    extras = {'types':[], 'attributes':[]}
+    for rows in _iter_keyset_chunks(resource_qry, resource_class.id, chunk_size):
+        resources = make_json_objects(rows, extras=extras)
+        resource_ids = [r.id for r in resources]
+
+        resource_attrs = {}
         if include_attributes in ('Y', True):
-            all_attributes = _get_all_resource_attributes(network_id,
-                                                          template_id,
-                                                          include_non_template_attributes)
-            log.info("Setting attributes")
-            net.attributes = all_attributes['NETWORK'].get(network_id, [])
-            for node_i in net.nodes:
-                node_i.attributes = all_attributes['NODE'].get(node_i.id, [])
-            log.info("Node attributes set")
-            for link_i in net.links:
-                link_i.attributes = all_attributes['LINK'].get(link_i.id, [])
-            log.info("Link attributes set")
-            for group_i in net.resourcegroups:
-                group_i.attributes = all_attributes['GROUP'].get(group_i.id, [])
-            log.info("Group attributes set")
-
-
-        log.info("Setting types")
-        all_types = _get_all_templates(network_id, template_id)
-        net.types = all_types['NETWORK'].get(network_id, [])
-        for node_i in net.nodes:
-            node_i.types = all_types['NODE'].get(node_i.id, [])
-        for link_i in net.links:
-            link_i.types = all_types['LINK'].get(link_i.id, [])
-        for group_i in net.resourcegroups:
-            group_i.types = all_types['GROUP'].get(group_i.id, [])
+            attr_qry = _get_resource_attribute_qry().filter(id_column.in_(resource_ids))
+            for resource_attr in db.DBSession.execute(attr_qry.statement).fetchall():
+                if not _is_template_attribute(resource_attr,
+                                              template_id,
+                                              include_non_template_attributes,
+                                              template_attr_lookup,
+                                              all_network_typeattrs):
+                    continue
+                resource_attrs.setdefault(_get_resource_id(resource_attr), []).append(resource_attr)
+
+        resource_types = {}
+        type_qry = _get_resource_type_qry().filter(type_id_column.in_(resource_ids))
+        if template_id is not None:
+            type_qry = type_qry.filter(Template.id==template_id)
+        for t in db.DBSession.execute(type_qry.statement).fetchall():
+            resource_types.setdefault(getattr(t, type_id_column.key), []).append(_make_template_type(t))
+
+        for resource in resources:
+            resource.attributes = resource_attrs.get(resource.id, [])
+            resource.types = resource_types.get(resource.id, [])
+
+        yield resources
+
+def iter_network(network_id,
+                 include_attributes=True,
+                 include_data='N',
+                 include_results='Y',
+                 scenario_ids=None,
+                 template_id=None,
+                 include_non_template_attributes=False,
+                 chunk_size=None,
+                 **kwargs):
+    """
+        Stream a network in chunks, rather than building it in memory as
+        get_network does. The arguments are the same as for get_network,
+        with the addition of:
+        chunk_size: The maximum number of nodes, links, groups, group items
+                    or resource scenarios in each chunk. Defaults to the
+                    'stream_chunk_size' setting in the 'db' section of the config.
+
+        Yields a sequence of objects, each with a 'section' and 'items':
+            network:            A single item: the network, with its own
+                                attributes, types and owners.
+            nodes:              A chunk of nodes, with attributes and types
+            links:              A chunk of links, with attributes and types
+            resourcegroups:     A chunk of groups, with attributes and types
+            scenario:           A single item: a scenario, without its data.
+                                This is followed by the chunks for that scenario:
+            resourcegroupitems: A chunk of the scenario's group items
+            resourcescenarios:  A chunk of the scenario's data (if include_data is 'Y' or 'L')
+
+        Chunks within a scenario also carry a 'scenario_id'.
+    """
+    log.debug("streaming network %s"%network_id)
 
-        log.info("Getting scenarios")
+    user_id = kwargs.get('user_id')
+
+    network_id = int(network_id)
 
-        net.scenarios = _get_scenarios(network_id, include_data, include_results, user_id, scenario_ids)
+    if chunk_size is None:
+        chunk_size = config.getint('db', 'stream_chunk_size', 500)
+    chunk_size = int(chunk_size)
 
+    try:
+        net_i = db.DBSession.query(Network).filter(
+            Network.id == network_id).options(
+            noload('scenarios')).options(
+            noload('nodes')).options(
+            noload('links')).options(
+            noload('types')).options(
+            noload('attributes')).options(
+            noload('resourcegroups')).one()
     except NoResultFound:
         raise ResourceNotFoundError("Network (network_id=%s) not found." % network_id)
 
-    return net
+    net_i.check_read_permission(user_id)
+
+    net = JSONObject(net_i)
+    net.owners = _get_network_owners(network_id)
+
+    template_attr_lookup, all_network_typeattrs = _get_network_template_attribute_lookup(network_id)
+
+    net.attributes = []
+    if include_attributes in ('Y', True):
+        attr_qry = _get_resource_attribute_qry().filter(ResourceAttr.network_id==network_id)
+        net.attributes = [a for a in db.DBSession.execute(attr_qry.statement).fetchall()
+                          if _is_template_attribute(a,
+                                                    template_id,
+                                                    include_non_template_attributes,
+                                                    template_attr_lookup,
+                                                    all_network_typeattrs)]
+
+    type_qry = _get_resource_type_qry().filter(ResourceType.network_id==network_id)
+    net.types = [_make_template_type(t) for t in db.DBSession.execute(type_qry.statement).fetchall()]
+
+    yield _make_network_chunk('network', [net])
+
+    for section, resource_class, ref_key in (('nodes', Node, 'NODE'),
+                                             ('links', Link, 'LINK'),
+                                             ('resourcegroups', ResourceGroup, 'GROUP')):
+        for resources in _iter_resources(network_id,
+                                         resource_class,
+                                         ref_key,
+                                         include_attributes,
+                                         template_id,
+                                         include_non_template_attributes,
+                                         template_attr_lookup,
+                                         all_network_typeattrs,
+                                         chunk_size):
+            yield _make_network_chunk(section, resources)
+
+    scen_qry = db.DBSession.query(Scenario).filter(
+                    Scenario.network_id == network_id).options(
+                        noload('network')).filter(
+                        Scenario.status == 'A')
+
+    if scenario_ids:
+        scen_qry = scen_qry.filter(Scenario.id.in_(scenario_ids))
+
+    result = db.DBSession.execute(scen_qry.statement)
+    scenarios = make_json_objects(result.fetchall(), result.keys())
+
+    for scen in scenarios:
+
+        yield _make_network_chunk('scenario', [scen])
+
+        #A copy-on-write clone shares the group items and data of its source
+        scenario_i = db.DBSession.query(Scenario).filter(Scenario.id == scen.id).one()
+
+        item_qry = scenario_i.filter_group_items(db.DBSession.query(ResourceGroupItem))
+        for rows in _iter_keyset_chunks(item_qry, ResourceGroupItem.id, chunk_size):
+            yield _make_network_chunk('resourcegroupitems',
+                                      make_json_objects(rows),
+                                      scenario_id=scen.id)
+
+        if not _data_requested(include_data):
+            continue
+
+        rs_qry = scenario_i.filter_data(_get_resourcescenario_qry(include_results,
+                                                                  user_id,
+                                                                  include_values=include_data != 'L'))
+
+        for rows in _iter_keyset_chunks(rs_qry, ResourceScenario.resource_attr_id, chunk_size):
+            resourcescenarios = _make_resourcescenarios(rows)
+
+            dataset_ids = set(rs.dataset_id for rs in resourcescenarios)
+            metadata = {}
+            with in_keys(Metadata.dataset_id, dataset_ids) as dataset_filter:
+                metadata_qry = db.DBSession.query(Metadata).filter(dataset_filter)
+                for m in db.DBSession.execute(metadata_qry.statement).fetchall():
+                    metadata.setdefault(m.dataset_id, {})[m.key] = six.text_type(m.value)
+
+            for rs in resourcescenarios:
+                rs.dataset.metadata = metadata.get(rs.dataset_id, {})
+
+            yield _make_network_chunk('resourcescenarios',
+                                      resourcescenarios,
+                                      scenario_id=scen.id)
 
 def get_nodes(network_id, template_id=None, **kwargs):
     """
@@ -1521,6 +2160,8 @@ def update_network(network,
 
     db.DBSession.flush()
 
+    invalidate_network(network.id)
+
     updated_net = get_network(network.id, summary=True, **kwargs)
     return updated_net
 
@@ -1530,10 +2171,10 @@ def update_resource_layout(resource_type, resource_id, key, value, **kwargs):
     if resource.layout is None:
         layout = dict()
     else:
-        layout = json.loads(resource.layout)
+        layout = jsonutil.loads(resource.layout)
 
     layout[key] = value
-    resource.layout = json.dumps(layout)
+    resource.layout = jsonutil.dumps(layout)
 
     db.DBSession.flush()
 
@@ -1578,8 +2219,13 @@ def get_network_extents(network_id,**kwargs):
 
     @returns NetworkExtents object
     """
-    rs = db.DBSession.query(Node.x, Node.y).filter(Node.network_id==network_id).all()
-    if len(rs) == 0:
+    extents = db.DBSession.query(func.count(Node.id).label('num_nodes'),
+                                 func.min(Node.x).label('min_x'),
+                                 func.max(Node.x).label('max_x'),
+                                 func.min(Node.y).label('min_y'),
+                                 func.max(Node.y).label('max_y')).filter(
+                                     Node.network_id==network_id).one()
+    if extents.num_nodes == 0:
         return dict(
             network_id = network_id,
             min_x=None,
@@ -1588,21 +2234,16 @@ def get_network_extents(network_id,**kwargs):
             max_y=None,
         )
 
-    # Compute min/max extent of the network.
-    x = [r.x for r in rs if r.x is not None]
-    if len(x) > 0:
-        x_min = min(x)
-        x_max = max(x)
+    # Default x extent if all None values
+    if extents.min_x is not None:
+        x_min, x_max = extents.min_x, extents.max_x
     else:
-        # Default x extent if all None values
         x_min, x_max = 0, 1
 
-    y = [r.y for r in rs if r.y is not None]
-    if len(y) > 0:
-        y_min = min(y)
-        y_max = max(y)
+    # Default y extent if all None values
+    if extents.min_y is not None:
+        y_min, y_max = extents.min_y, extents.max_y
     else:
-        # Default y extent if all None values
         y_min, y_max = 0, 1
 
     ne = JSONObject(dict(
@@ -1614,6 +2255,120 @@ def get_network_extents(network_id,**kwargs):
     ))
     return ne
 
+def _get_node_index(network_id):
+    """
+        Get the spatial index of the active nodes in a network. It is cached
+        until the network is next changed, so this is only used when the
+        network cache is enabled.
+    """
+    snapshot_key = get_network_snapshot_key(network_id, spatial='nodes')
+
+    node_index = get_network_snapshot(snapshot_key)
+    if node_index is not None:
+        return node_index
+
+    nodes = db.DBSession.query(Node.id, Node.x, Node.y).filter(
+        Node.network_id==network_id, Node.status=='A').all()
+
+    node_index = PointIndex(*(list(zip(*nodes)) if len(nodes) > 0 else [[], [], []]))
+
+    set_network_snapshot(snapshot_key, node_index)
+
+    return node_index
+
+def _get_link_index(network_id):
+    """
+        Get the spatial index of the active links in a network, using the
+        coordinates of their nodes. It is cached until the network is next
+        changed, so this is only used when the network cache is enabled.
+    """
+    snapshot_key = get_network_snapshot_key(network_id, spatial='links')
+
+    link_index = get_network_snapshot(snapshot_key)
+    if link_index is not None:
+        return link_index
+
+    node_1 = aliased(Node)
+    node_2 = aliased(Node)
+    links = db.DBSession.query(Link.id, node_1.x, node_1.y, node_2.x, node_2.y).join(
+        node_1, Link.node_1_id==node_1.id).join(
+        node_2, Link.node_2_id==node_2.id).filter(
+            Link.network_id==network_id, Link.status=='A').all()
+
+    link_index = SegmentIndex(*(list(zip(*links)) if len(links) > 0 else [[], [], [], [], []]))
+
+    set_network_snapshot(snapshot_key, link_index)
+
+    return link_index
+
+def _get_resources(resource_qry):
+    """
+        Get the nodes or links of a query, as JSONObjects.
+    """
+    extras = {'types':[], 'attributes':[]}
+
+    result = db.DBSession.execute(resource_qry.options(noload('network')).statement)
+
+    return make_json_objects(result.fetchall(), result.keys(), extras=extras)
+
+def _get_resources_by_id(resource_class, resource_ids):
+    """
+        Get the nodes or links with the specified IDs, as JSONObjects.
+    """
+    with in_keys(resource_class.id, resource_ids) as id_filter:
+        return _get_resources(db.DBSession.query(resource_class).filter(
+            id_filter).order_by(resource_class.id))
+
+def get_nodes_in_extent(network_id, min_x, min_y, max_x, max_y, **kwargs):
+    """
+        Get the active nodes of a network which lie within a bounding box,
+        such as the area shown in a map. Nodes on the edge of the box are included.
+        Nodes without coordinates are never returned.
+    """
+    user_id = kwargs.get('user_id')
+    net_i = _get_network(network_id)
+    net_i.check_read_permission(user_id)
+
+    #Without a cache to keep it in, building the index costs more than a query
+    if get_network_cache() is None:
+        return _get_resources(db.DBSession.query(Node).filter(
+            Node.network_id==network_id, Node.status=='A',
+            Node.x >= min_x, Node.x <= max_x, Node.y >= min_y, Node.y <= max_y).order_by(Node.id))
+
+    node_ids = _get_node_index(network_id).query(float(min_x), float(min_y),
+                                                 float(max_x), float(max_y))
+
+    return _get_resources_by_id(Node, node_ids.tolist())
+
+def get_links_in_extent(network_id, min_x, min_y, max_x, max_y, **kwargs):
+    """
+        Get the active links of a network which may cross a bounding box,
+        such as the area shown in a map. These are the links for which the box
+        containing both their nodes overlaps the requested box.
+    """
+    user_id = kwargs.get('user_id')
+    net_i = _get_network(network_id)
+    net_i.check_read_permission(user_id)
+
+    if get_network_cache() is None:
+        node_1 = aliased(Node)
+        node_2 = aliased(Node)
+        #The lower end of the link is before the right edge of the box, and so on
+        return _get_resources(db.DBSession.query(Link).join(
+            node_1, Link.node_1_id==node_1.id).join(
+            node_2, Link.node_2_id==node_2.id).filter(
+                Link.network_id==network_id, Link.status=='A',
+                node_1.x != None, node_1.y != None, node_2.x != None, node_2.y != None,
+                or_(node_1.x <= max_x, node_2.x <= max_x),
+                or_(node_1.x >= min_x, node_2.x >= min_x),
+                or_(node_1.y <= max_y, node_2.y <= max_y),
+                or_(node_1.y >= min_y, node_2.y >= min_y)).order_by(Link.id))
+
+    link_ids = _get_link_index(network_id).query(float(min_x), float(min_y),
+                                                 float(max_x), float(max_y))
+
+    return _get_resources_by_id(Link, link_ids.tolist())
+
 #########################################
 def add_nodes(network_id, nodes,**kwargs):
     """
@@ -1653,6 +2408,8 @@ def add_nodes(network_id, nodes,**kwargs):
 
     _bulk_add_resource_attrs(network_id, 'NODE', nodes, iface_nodes)
 
+    invalidate_network(network_id)
+
     log.info("Nodes added in %s", get_timing(start_time))
     return node_s
 
@@ -1686,6 +2443,7 @@ def add_links(network_id, links,**kwargs):
     for l_i in link_s:
         iface_links[l_i.name] = l_i
     link_attrs = _bulk_add_resource_attrs(net_i.id, 'LINK', links, iface_links)
+    invalidate_network(network_id)
     log.info("Nodes added in %s", get_timing(start_time))
     return link_s
 #########################################
@@ -1741,6 +2499,8 @@ def add_node(network_id, node,**kwargs):
             if len(all_rs) > 0:
                 db.DBSession.bulk_insert_mappings(ResourceScenario, all_rs)
 
+    invalidate_network(network_id)
+
     db.DBSession.refresh(new_node)
     #lazy load attributes
     new_node.attributes
@@ -1872,6 +2632,7 @@ def purge_network(network_id, purge_data,**kwargs):
     net_i.check_write_permission(user_id)
     db.DBSession.delete(net_i)
     db.DBSession.flush()
+    invalidate_network(network_id)
     return 'OK'
 
 
@@ -1933,6 +2694,7 @@ def delete_node(node_id, purge_data,**kwargs):
     log.info("Deleting node %s, id=%s", node_i.name, node_id)
 
     node_i.network.check_write_permission(user_id)
+    invalidate_network(node_i.network_id)
     db.DBSession.delete(node_i)
     db.DBSession.flush()
     return 'OK'
@@ -1992,6 +2754,8 @@ def add_link(network_id, link,**kwargs):
             if len(all_rs) > 0:
                 db.DBSession.bulk_insert_mappings(ResourceScenario, all_rs)
 
+    invalidate_network(network_id)
+
     db.DBSession.refresh(link_i)
 
     #lazy load attributes
@@ -2070,6 +2834,7 @@ def delete_link(link_id, purge_data,**kwargs):
     log.info("Deleting link %s, id=%s", link_i.name, link_id)
 
     link_i.network.check_write_permission(user_id)
+    invalidate_network(link_i.network_id)
     db.DBSession.delete(link_i)
     db.DBSession.flush()
 
@@ -2119,6 +2884,8 @@ def add_group(network_id, group,**kwargs):
             if len(all_rs) > 0:
                 db.DBSession.bulk_insert_mappings(ResourceScenario, all_rs)
 
+    invalidate_network(network_id)
+
     db.DBSession.refresh(res_grp_i)
     #lazy load attributes
     res_grp_i.attributes
@@ -2196,6 +2963,7 @@ def delete_group(group_id, purge_data,**kwargs):
     log.info("Deleting group %s, id=%s", group_i.name, group_id)
 
     group_i.network.check_write_permission(user_id)
+    invalidate_network(group_i.network_id)
     db.DBSession.delete(group_i)
     db.DBSession.flush()
 
@@ -2213,39 +2981,128 @@ def get_scenarios(network_id,**kwargs):
 
     return net_i.scenarios
 
-def validate_network_topology(network_id,**kwargs):
+def _get_network_graph(network_id):
     """
-        Check for the presence of orphan nodes in a network.
+        Get the topology of the active nodes and links in a network as a
+        NetworkGraph. When the network cache is enabled, the graph is cached
+        until the network is next changed.
     """
+    snapshot_key = get_network_snapshot_key(network_id, topology='Y')
 
-    user_id = kwargs.get('user_id')
+    graph = get_network_snapshot(snapshot_key)
+    if graph is not None:
+        return graph
+
+    node_ids = db.DBSession.query(Node.id).filter(Node.network_id==network_id,
+                                                  Node.status=='A').all()
+    links = db.DBSession.query(Link.id, Link.node_1_id, Link.node_2_id).filter(
+        Link.network_id==network_id, Link.status=='A').all()
+
+    link_columns = list(zip(*links)) if len(links) > 0 else [[], [], []]
+    graph = NetworkGraph([n.id for n in node_ids], *link_columns)
+
+    set_network_snapshot(snapshot_key, graph)
+
+    return graph
+
+def _get_network(network_id):
     try:
         net_i = db.DBSession.query(Network).filter(Network.id == network_id).one()
-        net_i.check_write_permission(user_id=user_id)
+        return net_i
     except NoResultFound:
         raise ResourceNotFoundError("Network %s not found"%(network_id))
 
-    nodes = []
-    for node_i in net_i.nodes:
-        if node_i.status == 'A':
-            nodes.append(node_i.node_id)
+def validate_network_topology(network_id,**kwargs):
+    """
+        Check for the presence of orphan nodes in a network.
+    """
+
+    user_id = kwargs.get('user_id')
+    net_i = _get_network(network_id)
+    net_i.check_write_permission(user_id=user_id)
+
+    graph = _get_network_graph(network_id)
 
-    link_nodes = []
-    for link_i in net_i.links:
-        if link_i.status != 'A':
-            continue
-        if link_i.node_1_id not in link_nodes:
-            link_nodes.append(link_i.node_1_id)
+    return set(graph.isolated_nodes().tolist())
 
-        if link_i.node_2_id not in link_nodes:
-            link_nodes.append(link_i.node_2_id)
+def get_network_components(network_id, **kwargs):
+    """
+        Get the groups of nodes in a network which are connected to each other,
+        ignoring the direction of the links.
 
-    nodes = set(nodes)
-    link_nodes = set(link_nodes)
+        returns:
+            A list of lists of node IDs, largest first.
+    """
+    user_id = kwargs.get('user_id')
+    net_i = _get_network(network_id)
+    net_i.check_read_permission(user_id)
 
-    isolated_nodes = nodes - link_nodes
+    graph = _get_network_graph(network_id)
 
-    return isolated_nodes
+    return [c.tolist() for c in graph.connected_components()]
+
+def get_downstream_nodes(network_id, node_id, max_depth=None, **kwargs):
+    """
+        Get the nodes which can be reached from a node by following
+        links from their start node (node_1) to their end node (node_2).
+
+        args:
+            max_depth (int): The maximum number of links to follow. Unlimited if None.
+        returns:
+            A dict of node ID to the number of links between it and the
+            requested node.
+    """
+    user_id = kwargs.get('user_id')
+    net_i = _get_network(network_id)
+    net_i.check_read_permission(user_id)
+
+    graph = _get_network_graph(network_id)
+
+    return graph.traverse(int(node_id), 'downstream', max_depth=max_depth)
+
+def get_upstream_nodes(network_id, node_id, max_depth=None, **kwargs):
+    """
+        Get the nodes from which a node can be reached, following
+        links from their start node (node_1) to their end node (node_2).
+
+        args:
+            max_depth (int): The maximum number of links to follow. Unlimited if None.
+        returns:
+            A dict of node ID to the number of links between it and the
+            requested node.
+    """
+    user_id = kwargs.get('user_id')
+    net_i = _get_network(network_id)
+    net_i.check_read_permission(user_id)
+
+    graph = _get_network_graph(network_id)
+
+    return graph.traverse(int(node_id), 'upstream', max_depth=max_depth)
+
+def get_shortest_path(network_id, from_node_id, to_node_id, directed='Y', **kwargs):
+    """
+        Get the path between two nodes which passes through the fewest links.
+
+        args:
+            directed (char): 'Y' to only follow links from node_1 to node_2,
+                             'N' to follow them in either direction.
+        returns:
+            A dict with the node IDs and link IDs along the path, in order,
+            or None if there is no path between the nodes.
+    """
+    user_id = kwargs.get('user_id')
+    net_i = _get_network(network_id)
+    net_i.check_read_permission(user_id)
+
+    graph = _get_network_graph(network_id)
+
+    direction = 'downstream' if directed in ('Y', True) else 'both'
+    path = graph.shortest_path(int(from_node_id), int(to_node_id), direction)
+
+    if path is None:
+        return None
+
+    return {'nodes': path[0], 'links': path[1]}
 
 def get_resource(resource_type, resource_id, **kwargs):
     user_id = kwargs.get('user_id')
@@ -2384,73 +3241,35 @@ def get_attributes_for_resource(network_id, scenario_id, ref_key, ref_ids=None,
             .join(ResourceScenario.dataset)\
             .options(noload('dataset.metadata'))
 
+    metadata_qry = db.DBSession.query(Metadata).filter(
+                        ResourceAttr.ref_key==ref_key,
+                        ResourceScenario.resource_attr_id==ResourceAttr.id,
+                        ResourceScenario.scenario_id==scenario_id,
+                        Metadata.dataset_id==ResourceScenario.dataset_id)
+
+    ref_id_column = {'NODE': ResourceAttr.node_id,
+                     'LINK': ResourceAttr.link_id,
+                     'GROUP': ResourceAttr.group_id}.get(ref_key)
+
     log.info("Querying %s data",ref_key)
-    if ref_ids is not None and len(ref_ids) < 999:
-        if ref_key == 'NODE':
-            rs_qry = rs_qry.filter(ResourceAttr.node_id.in_(ref_ids))
-        elif ref_key == 'LINK':
-            rs_qry = rs_qry.filter(ResourceAttr.link_id.in_(ref_ids))
-        elif ref_key == 'GROUP':
-            rs_qry = rs_qry.filter(ResourceAttr.group_id.in_(ref_ids))
-
-    all_resource_scenarios = rs_qry.all()
-    log.info("Data retrieved")
-    resource_scenarios = []
-    dataset_ids      = []
-    if ref_ids is not None:
-        log.info("Pulling out requested info")
-        for rs in all_resource_scenarios:
-            ra = rs.resourceattr
-            if ref_key == 'NODE':
-                if ra.node_id in ref_ids:
-                    resource_scenarios.append(rs)
-                    if rs.dataset_id not in dataset_ids:
-                        dataset_ids.append(rs.dataset_id)
-            elif ref_key == 'LINK':
-                if ra.link_id in ref_ids:
-                    resource_scenarios.append(rs)
-                    if rs.dataset_id not in dataset_ids:
-                        dataset_ids.append(rs.dataset_id)
-            elif ref_key == 'GROUP':
-                if ra.group_id in ref_ids:
-                    resource_scenarios.append(rs)
-                    if rs.dataset_id not in dataset_ids:
-                        dataset_ids.append(rs.dataset_id)
-            else:
-                resource_scenarios.append(ra)
-        log.info("Requested info pulled out.")
+    metadata = []
+    if ref_ids is not None and ref_id_column is not None:
+        with in_keys(ref_id_column, ref_ids) as ref_filter:
+            resource_scenarios = rs_qry.filter(ref_filter).all()
+            if include_metadata == 'Y':
+                metadata = metadata_qry.filter(ref_filter).all()
     else:
-        resource_scenarios = all_resource_scenarios
+        resource_scenarios = rs_qry.all()
+        if include_metadata == 'Y':
+            metadata = metadata_qry.all()
 
     log.info("Retrieved %s resource attrs", len(resource_scenarios))
 
     if include_metadata == 'Y':
-        metadata_qry = db.DBSession.query(Metadata).filter(
-                            ResourceAttr.ref_key==ref_key,
-                            ResourceScenario.resource_attr_id==ResourceAttr.id,
-                            ResourceScenario.scenario_id==scenario_id,
-                            Dataset.id==ResourceScenario.dataset_id,
-                            Metadata.dataset_id==Dataset.id)
-
-        log.info("Querying node metadata")
-        all_metadata = metadata_qry.all()
-        log.info("Node metadata retrieved")
-
-        metadata   = []
-        if ref_ids is not None:
-            for m in all_metadata:
-                if m.dataset_id in dataset_ids:
-                    metadata.append(m)
-        else:
-            metadata = all_metadata
-
         log.info("%s metadata items retrieved", len(metadata))
         metadata_dict = {}
         for m in metadata:
-            if metadata_dict.get(m.dataset_id):
-                metadata_dict[m.dataset_id].append(m)
-            else:
-                metadata_dict[m.dataset_id] = [m]
+            metadata_dict.setdefault(m.dataset_id, []).append(m)
 
     for rs in resource_scenarios:
         d = rs.dataset
@@ -2517,11 +3336,52 @@ def get_all_resource_attributes_in_network(attr_id, network_id, **kwargs):
     return json_ra
 
 
-def get_all_resource_data(scenario_id, include_metadata='N', page_start=None, page_end=None, **kwargs):
-    """
-        A function which returns the data for all resources in a network.
-        -
-    """
+def _get_unreadable_datasets(dataset_ids, user_id):
+    """
+        Of the (hidden) datasets specified, return the IDs of those which
+        the user is not permitted to read.
+    """
+    unreadable = set()
+    if len(dataset_ids) == 0:
+        return unreadable
+
+    with in_keys(Dataset.id, dataset_ids) as dataset_filter:
+        datasets = db.DBSession.query(Dataset).filter(
+                        dataset_filter).options(noload('metadata')).all()
+    for d in datasets:
+        if not d.check_read_permission(user_id, do_raise=False):
+            unreadable.add(d.id)
+
+    return unreadable
+
+ResourceData = namedtuple('ResourceData', ['attr_id',
+                                           'attr_name',
+                                           'resource_attr_id',
+                                           'ref_key',
+                                           'network_id',
+                                           'node_id',
+                                           'link_id',
+                                           'group_id',
+                                           'project_id',
+                                           'attr_is_var',
+                                           'scenario_id',
+                                           'source',
+                                           'dataset_id',
+                                           'dataset_name',
+                                           'value',
+                                           'unit_id',
+                                           'hidden',
+                                           'type',
+                                           'metadata',
+                                           'ref_name'])
+
+def _get_resource_data_qry(scenario_id):
+    """
+        Get the query for all the data in a scenario, with one row per
+        resource attribute, in the order of the fields of ResourceData.
+        The data a copy-on-write clone shares with its source is included.
+    """
+    scenario_i = db.DBSession.query(Scenario).filter(Scenario.id == scenario_id).first()
 
     rs_qry = db.DBSession.query(
                ResourceAttr.attr_id,
@@ -2555,60 +3415,182 @@ def get_all_resource_data(scenario_id, include_metadata='N', page_start=None, pa
                 outerjoin(Node, ResourceAttr.node_id==Node.id).\
                 outerjoin(Link, ResourceAttr.link_id==Link.id).\
                 outerjoin(ResourceGroup, ResourceAttr.group_id==ResourceGroup.id).\
-                outerjoin(Network, ResourceAttr.network_id==Network.id).\
-            filter(ResourceScenario.scenario_id==scenario_id)
+                outerjoin(Network, ResourceAttr.network_id==Network.id)
 
-    all_resource_data = rs_qry.all()
+    if scenario_i is None:
+        return rs_qry.filter(ResourceScenario.scenario_id==scenario_id)
 
-    if page_start is not None and page_end is None:
-        all_resource_data = all_resource_data[page_start:]
-    elif page_start is not None and page_end is not None:
-        all_resource_data = all_resource_data[page_start:page_end]
+    return scenario_i.filter_data(rs_qry)
 
-    log.info("%s datasets retrieved", len(all_resource_data))
+def _get_resource_data_metadata(scenario_id, rows):
+    """
+        Get the metadata of the datasets in a set of rows of get_all_resource_data.
+        The rows are ordered by resource_attr_id, so only the metadata of the
+        resource scenarios between their first and last resource_attr_id is needed.
+        The rows of a copy-on-write clone may come from any of the scenarios it
+        shares data with.
+        Returns a list of metadata rows.
+    """
+    if len(rows) == 0:
+        return []
 
-    if include_metadata == 'Y':
-        metadata_qry = db.DBSession.query(distinct(Metadata.dataset_id).label('dataset_id'),
+    metadata_qry = db.DBSession.query(Metadata.dataset_id,
                                       Metadata.key,
                                       Metadata.value).filter(
-                            ResourceScenario.resource_attr_id==ResourceAttr.id,
-                            ResourceScenario.scenario_id==scenario_id,
-                            Dataset.id==ResourceScenario.dataset_id,
-                            Metadata.dataset_id==Dataset.id)
+                        ResourceScenario.scenario_id.in_(set(r.scenario_id for r in rows)),
+                        ResourceScenario.resource_attr_id.between(rows[0].resource_attr_id,
+                                                                  rows[-1].resource_attr_id),
+                        Metadata.dataset_id==ResourceScenario.dataset_id).distinct()
 
-        log.info("Querying node metadata")
-        metadata = metadata_qry.all()
-        log.info("%s metadata items retrieved", len(metadata))
+    return db.DBSession.execute(metadata_qry.statement).fetchall()
 
-        metadata_dict = {}
+def _make_resource_data(scenario_id, rows, include_metadata, user_id):
+    """
+        Build the ResourceData tuples for a set of rows of get_all_resource_data.
+        The values and metadata of hidden datasets which the user cannot
+        read are removed.
+    """
+    unreadable = _get_unreadable_datasets(set(r.dataset_id for r in rows if r.hidden == 'Y'),
+                                          user_id)
+
+    metadata_dict = {}
+    if include_metadata == 'Y':
+        metadata = _get_resource_data_metadata(scenario_id, rows)
+        log.info("%s metadata items retrieved", len(metadata))
         for m in metadata:
-            if metadata_dict.get(m.dataset_id):
-                metadata_dict[m.dataset_id].append(m)
-            else:
-                metadata_dict[m.dataset_id] = [m]
+            metadata_dict.setdefault(m.dataset_id, []).append(m)
+
+    resource_data = []
+    for row in rows:
+        rd = ResourceData(*row)
+        if rd.dataset_id in unreadable:
+            rd = rd._replace(value=None, metadata=[])
+        elif include_metadata == 'Y':
+            rd = rd._replace(metadata=metadata_dict.get(rd.dataset_id, []))
+        resource_data.append(rd)
+
+    return resource_data
+
+def get_all_resource_data(scenario_id,
+                          include_metadata='N',
+                          page_start=None,
+                          page_end=None,
+                          result_format='json',
+                          start_after=None,
+                          page_size=None,
+                          **kwargs):
+    """
+        A function which returns the data for all resources in a network.
+        -
+        The data is ordered by resource_attr_id, and can be returned a page at a time,
+        either by position, using page_start and page_end, or by key:
+        start_after: Only return the data of resource attributes with a greater ID
+                     than this, which is the resource_attr_id of the last item of the
+                     previous page. Unlike page_start, this does not need the
+                     database to skip over the previous pages.
+        page_size: The maximum number of items to return, if page_end is not set.
+
+        To read all the data of a large scenario, see iter_all_resource_data.
+        -
+        result_format: 'json' (default) returns a list of named tuples. 'columnar',
+                       'dataframe' and 'arrow' return a single table, built directly
+                       from the query result (see util.rows_to_columns). In these
+                       formats, the metadata of each dataset is a dict rather than a
+                       list of metadata objects.
+    """
 
-    return_data = []
-    for ra in all_resource_data:
-        ra_dict = ra._asdict()
-        if ra.hidden == 'Y':
-           try:
-                d = db.DBSession.query(Dataset).filter(
-                    Dataset.id == ra.dataset_id
-                    ).options(noload('metadata')).one()
-                d.check_read_permission(kwargs.get('user_id'))
-           except:
-                ra_dict['value'] = None
-                ra_dict['metadata'] = []
-        else:
-            if include_metadata == 'Y':
-                ra_dict['metadata'] = metadata_dict.get(ra.dataset_id, [])
+    rs_qry = _get_resource_data_qry(scenario_id)
+
+    if start_after is not None:
+        rs_qry = rs_qry.filter(ResourceScenario.resource_attr_id > start_after)
+
+    rs_qry = rs_qry.order_by(ResourceScenario.resource_attr_id)
+
+    if page_start is not None:
+        rs_qry = rs_qry.offset(page_start)
+        if page_end is not None:
+            rs_qry = rs_qry.limit(max(page_end - page_start, 0))
 
-        return_data.append(namedtuple('ResourceData', ra_dict.keys())(**ra_dict))
+    if page_size is not None and (page_start is None or page_end is None):
+        rs_qry = rs_qry.limit(page_size)
+
+    result = db.DBSession.execute(rs_qry.statement)
+    all_resource_data = result.fetchall()
+
+    log.info("%s datasets retrieved", len(all_resource_data))
+
+    if result_format != 'json':
+        return _get_all_resource_data_columns(result.keys(),
+                                              all_resource_data,
+                                              scenario_id,
+                                              include_metadata,
+                                              kwargs.get('user_id'),
+                                              result_format)
+
+    return_data = _make_resource_data(scenario_id,
+                                      all_resource_data,
+                                      include_metadata,
+                                      kwargs.get('user_id'))
 
     log.info("Returning %s datasets", len(return_data))
 
     return return_data
 
+def iter_all_resource_data(scenario_id, include_metadata='N', chunk_size=None, **kwargs):
+    """
+        Stream the data for all resources in a scenario, rather than building it
+        in memory as get_all_resource_data does. Each chunk is read with a
+        query starting after the last resource_attr_id of the previous one.
+        args:
+            scenario_id (int): The scenario to read
+            include_metadata (char): 'Y' to include the metadata of each dataset
+            chunk_size (int): The maximum number of items in each chunk. Defaults to the
+                             'stream_chunk_size' setting in the 'db' section of the config.
+        Yields lists of ResourceData named tuples, as returned by get_all_resource_data.
+    """
+    user_id = kwargs.get('user_id')
+
+    if chunk_size is None:
+        chunk_size = config.getint('db', 'stream_chunk_size', 500)
+    chunk_size = int(chunk_size)
+
+    rs_qry = _get_resource_data_qry(scenario_id)
+
+    for rows in _iter_keyset_chunks(rs_qry, ResourceScenario.resource_attr_id, chunk_size):
+        yield _make_resource_data(scenario_id, rows, include_metadata, user_id)
+
+def _get_all_resource_data_columns(keys,
+                                   all_resource_data,
+                                   scenario_id,
+                                   include_metadata,
+                                   user_id,
+                                   result_format):
+    """
+        The columnar version of get_all_resource_data. Values (and metadata)
+        of hidden datasets which the user cannot read are set to None.
+    """
+    columns = rows_to_columns(keys, all_resource_data, 'columnar')
+
+    dataset_ids = columns['dataset_id']
+    hidden = columns['hidden'] == 'Y'
+    unreadable = np.zeros(len(dataset_ids), dtype=bool)
+    if hidden.any():
+        unreadable_ids = _get_unreadable_datasets(set(dataset_ids[hidden].tolist()), user_id)
+        unreadable = np.isin(dataset_ids, list(unreadable_ids))
+        columns['value'][unreadable] = None
+
+    if include_metadata == 'Y':
+        metadata_dict = {}
+        for m in _get_resource_data_metadata(scenario_id, all_resource_data):
+            metadata_dict.setdefault(m.dataset_id, {})[m.key] = m.value
+
+        metadata = np.empty(len(dataset_ids), dtype=object)
+        metadata[:] = [metadata_dict.get(d, {}) for d in dataset_ids.tolist()]
+        metadata[unreadable] = None
+        columns['metadata'] = metadata
+
+    return format_columns(columns, result_format)
+
 def clone_network(network_id,
                   recipient_user_id=None,
                   new_network_name=None,
@@ -2752,6 +3734,8 @@ def clone_network(network_id,
 
 def _clone_rules(old_network_id, new_network_id, node_id_map, link_id_map, group_id_map, scenario_id_map, user_id):
     """
+        Clone the rules of a network and its resources into the new network.
+        Only the IDs of the resources which have rules are read from the ID maps.
     """
     rules.clone_resource_rules('NETWORK',
                                old_network_id,
@@ -2761,272 +3745,200 @@ def _clone_rules(old_network_id, new_network_id, node_id_map, link_id_map, group
                                user_id=user_id)
 
     node_rules = db.DBSession.query(Rule).join(Node).filter(Node.network_id==old_network_id).all()
+    new_node_ids = _read_id_map(node_id_map, [r.node_id for r in node_rules])
     for node_rule in node_rules:
         rules.clone_rule(node_rule.id,
                          target_ref_key='NODE',
-                         target_ref_id=node_id_map[node_rule.node_id],
+                         target_ref_id=new_node_ids[node_rule.node_id],
                          scenario_id_map=scenario_id_map,
                          user_id=user_id)
 
     link_rules = db.DBSession.query(Rule).join(Link).filter(Link.network_id==old_network_id).all()
-
+    new_link_ids = _read_id_map(link_id_map, [r.link_id for r in link_rules])
     for link_rule in link_rules:
         rules.clone_rule(link_rule.id,
                          target_ref_key='LINK',
-                         target_ref_id=link_id_map[link_rule.link_id],
+                         target_ref_id=new_link_ids[link_rule.link_id],
                          scenario_id_map=scenario_id_map,
                          user_id=user_id)
 
     group_rules = db.DBSession.query(Rule).join(ResourceGroup).filter(ResourceGroup.network_id==old_network_id).all()
-
+    new_group_ids = _read_id_map(group_id_map, [r.group_id for r in group_rules])
     for group_rule in group_rules:
         rules.clone_rule(group_rule.id,
-                         group_rule.node_id,
                          target_ref_key='GROUP',
-                         target_ref_id=group_id_map[group_rule.group_id],
+                         target_ref_id=new_group_ids[group_rule.group_id],
                          scenario_id_map=scenario_id_map,
                          user_id=user_id)
 
+def _id_map(table, old_network_id, new_network_id, *keys):
+    """
+        Build a query which maps the IDs of the rows of a table in one network
+        to the IDs of their copies in another, as (old_id, new_id). Rows are
+        matched on the given columns, which must identify a row within a network.
 
-def _clone_nodes(old_network_id, new_network_id, user_id):
-
-    nodes = db.DBSession.query(Node).filter(Node.network_id==old_network_id).all()
-    newnodes = []
-    old_node_name_map = {}
-    id_map = {}
-    for ex_n in nodes:
-        new_n = dict(
-            network_id=new_network_id,
-            name = ex_n.name,
-            description = ex_n.description,
-            x = ex_n.x,
-            y = ex_n.y,
-            layout = ex_n.layout,
-            status = ex_n.status,
-        )
-
-        old_node_name_map[ex_n.name] = ex_n.node_id
-
-        newnodes.append(new_n)
+        The map is never read into python. Each clone statement joins to it,
+        so the copying is done entirely by the database.
+    """
+    old = table.alias()
+    new = table.alias()
+    return select([old.c.id.label('old_id'), new.c.id.label('new_id')]).where(and_(
+        old.c.network_id == old_network_id,
+        new.c.network_id == new_network_id,
+        *[old.c[k] == new.c[k] for k in keys]))
 
-    db.DBSession.bulk_insert_mappings(Node, newnodes)
+def _read_id_map(id_map, old_ids):
+    """
+        Read the new IDs of a set of old IDs from an ID map.
+        Returns a dict of old ID: new ID.
+    """
+    if len(old_ids) == 0:
+        return {}
 
-    db.DBSession.flush()
-    #map old IDS to new IDS
+    ids = id_map.alias()
+    rows = db.DBSession.execute(select([ids.c.old_id, ids.c.new_id]).where(
+        ids.c.old_id.in_(set(old_ids)))).fetchall()
 
-    nodes = db.DBSession.query(Node).filter(Node.network_id==new_network_id).all()
+    return dict((r.old_id, r.new_id) for r in rows)
 
+def _insert_from_select(table, columns, query):
+    """
+        Copy the rows returned by a query into a table using a single
+        INSERT ... SELECT statement. Returns the number of rows inserted.
+    """
+    result = db.DBSession.execute(table.insert().from_select(columns, query))
+    mark_changed(db.DBSession())
+    return result.rowcount
 
-    for n in nodes:
-        old_node_id = old_node_name_map[n.name]
-        id_map[old_node_id] = n.node_id
+def _clone_nodes(old_network_id, new_network_id, user_id):
+    """
+        Copy the nodes of a network into the new network.
+        Returns a query mapping the old node IDs to the new ones.
+    """
+    nodes = Node.__table__
 
+    num_nodes = _insert_from_select(nodes,
+        ['network_id', 'name', 'description', 'x', 'y', 'layout', 'status'],
+        select([literal(new_network_id, Integer), nodes.c.name, nodes.c.description,
+                nodes.c.x, nodes.c.y, nodes.c.layout, nodes.c.status]).where(
+                    nodes.c.network_id == old_network_id))
+    log.info("%s nodes cloned", num_nodes)
 
-    return id_map
+    #Node names are unique within a network for each status
+    return _id_map(nodes, old_network_id, new_network_id, 'name', 'status')
 
 def _clone_links(old_network_id, new_network_id, node_id_map, user_id):
+    """
+        Copy the links of a network into the new network, connected to the new nodes.
+        Returns a query mapping the old link IDs to the new ones.
+    """
+    links = Link.__table__
+    node_1 = node_id_map.alias()
+    node_2 = node_id_map.alias()
 
-    links = db.DBSession.query(Link).filter(Link.network_id==old_network_id).all()
-    newlinks = []
-    old_link_name_map = {}
-    id_map = {}
-    for ex_l in links:
-        new_l = dict(
-            network_id=new_network_id,
-            name = ex_l.name,
-            description = ex_l.description,
-            node_1_id = node_id_map[ex_l.node_1_id],
-            node_2_id = node_id_map[ex_l.node_2_id],
-            layout = ex_l.layout,
-            status = ex_l.status,
-        )
-
-        newlinks.append(new_l)
-
-        old_link_name_map[ex_l.name] = ex_l.id
-
-    db.DBSession.bulk_insert_mappings(Link, newlinks)
-
-    db.DBSession.flush()
-    #map old IDS to new IDS
-
-    links = db.DBSession.query(Link).filter(Link.network_id==new_network_id).all()
-    for l in links:
-        old_link_id = old_link_name_map[l.name]
-        id_map[old_link_id] = l.link_id
+    num_links = _insert_from_select(links,
+        ['network_id', 'name', 'description', 'node_1_id', 'node_2_id', 'layout', 'status'],
+        select([literal(new_network_id, Integer), links.c.name, links.c.description,
+                node_1.c.new_id, node_2.c.new_id, links.c.layout, links.c.status]).select_from(
+                    links.join(node_1, links.c.node_1_id == node_1.c.old_id).join(
+                        node_2, links.c.node_2_id == node_2.c.old_id)).where(
+                    links.c.network_id == old_network_id))
+    log.info("%s links cloned", num_links)
 
-    return id_map
+    return _id_map(links, old_network_id, new_network_id, 'name')
 
 def _clone_groups(old_network_id, new_network_id, node_id_map, link_id_map, user_id):
+    """
+        Copy the resource groups of a network into the new network.
+        Returns a query mapping the old group IDs to the new ones.
+    """
+    groups = ResourceGroup.__table__
 
-    groups = db.DBSession.query(ResourceGroup).filter(ResourceGroup.network_id==old_network_id).all()
-    newgroups = []
-    old_group_name_map = {}
-    id_map = {}
-    for ex_g in groups:
-        new_g = dict(
-            network_id=new_network_id,
-            name = ex_g.name,
-            description = ex_g.group_description,
-            status = ex_g.status,
-        )
-
-        newgroups.append(new_g)
-
-        old_group_name_map[ex_g.name] = ex_g.id
-
-    db.DBSession.bulk_insert_mappings(ResourceGroup, newgroups)
-
-    db.DBSession.flush()
-    #map old IDS to new IDS
-
-    groups = db.DBSession.query(ResourceGroup).filter(ResourceGroup.network_id==new_network_id).all()
-    for g in groups:
-        old_group_id = old_group_name_map[g.name]
-        id_map[old_group_id] = g.group_id
+    num_groups = _insert_from_select(groups,
+        ['network_id', 'name', 'description', 'status'],
+        select([literal(new_network_id, Integer), groups.c.name, groups.c.description,
+                groups.c.status]).where(groups.c.network_id == old_network_id))
+    log.info("%s groups cloned", num_groups)
 
-    return id_map
+    return _id_map(groups, old_network_id, new_network_id, 'name')
 
 def _clone_resourceattrs(network_id, newnetworkid, node_id_map, link_id_map, group_id_map):
+    """
+        Copy the attributes of a network and its nodes, links and groups onto
+        the new network and resources.
+        Returns a query mapping the old resource attribute IDs to the new ones.
+    """
+    ras = ResourceAttr.__table__
+    resource_id_maps = [('node_id', node_id_map), ('link_id', link_id_map), ('group_id', group_id_map)]
 
     log.info("Cloning Network Attributes")
-    network_ras = db.DBSession.query(ResourceAttr).filter(ResourceAttr.network_id==network_id)
-    id_map = {}
-    new_ras = []
-    old_ra_name_map = {}
-    for ra in network_ras:
-        new_ras.append(dict(
-            network_id=newnetworkid,
-            node_id=None,
-            group_id=None,
-            link_id=None,
-            ref_key='NETWORK',
-            attr_id=ra.attr_id,
-            attr_is_var=ra.attr_is_var,
-        ))
-        #key is (network_id, node_id, link_id, group_id) -- only one of which can be not null for a given row
-        old_ra_name_map[(newnetworkid, None, None, None, ra.attr_id)] = ra.id
-    log.info("Cloning Node Attributes")
-    node_ras = db.DBSession.query(ResourceAttr).filter(and_(ResourceAttr.node_id==Node.id, Node.network_id==network_id)).all()
-    for ra in node_ras:
-        new_ras.append(dict(
-            node_id=node_id_map[ra.node_id],
-            network_id=None,
-            link_id=None,
-            group_id=None,
-            attr_id=ra.attr_id,
-            attr_is_var=ra.attr_is_var,
-            ref_key=ra.ref_key,
-        ))
-        old_ra_name_map[(None, node_id_map[ra.node_id], None, None, ra.attr_id)] = ra.id
-    log.info("Cloning Link Attributes")
-    link_ras = db.DBSession.query(ResourceAttr).filter(and_(ResourceAttr.link_id==Link.id, Link.network_id==network_id)).all()
-    for ra in link_ras:
-        new_ras.append(dict(
-            link_id=link_id_map[ra.link_id],
-            network_id=ra.network_id,
-            node_id=ra.node_id,
-            group_id=ra.group_id,
-            attr_id=ra.attr_id,
-            attr_is_var=ra.attr_is_var,
-            ref_key=ra.ref_key,
-        ))
-        old_ra_name_map[(None, None, link_id_map[ra.link_id], None, ra.attr_id)] = ra.id
-
-    log.info("Cloning Group Attributes")
-    group_ras = db.DBSession.query(ResourceAttr).filter(and_(ResourceAttr.group_id==ResourceGroup.id, ResourceGroup.network_id==network_id)).all()
-    for ra in group_ras:
-        new_ras.append(dict(
-            group_id=group_id_map[ra.group_id],
-            network_id=ra.network_id,
-            link_id=ra.link_id,
-            node_id=ra.node_id,
-            attr_id=ra.attr_id,
-            attr_is_var=ra.attr_is_var,
-            ref_key=ra.ref_key,
-        ))
-        old_ra_name_map[(None, None, None, group_id_map[ra.group_id], ra.attr_id)] = ra.id
-
-    log.info("Inserting new resource attributes")
-    db.DBSession.bulk_insert_mappings(ResourceAttr, new_ras)
-    db.DBSession.flush()
-    log.info("Insertion Complete")
-
-    log.info("Getting new RAs and building ID map")
-
-    new_network_ras = db.DBSession.query(ResourceAttr).filter(ResourceAttr.network_id==newnetworkid).all()
-    for ra in new_network_ras:
-        id_map[old_ra_name_map[(ra.network_id, ra.node_id, ra.link_id, ra.group_id, ra.attr_id)]] = ra.id
-
-    new_node_ras = db.DBSession.query(ResourceAttr).filter(and_(ResourceAttr.node_id==Node.id, Node.network_id==newnetworkid)).all()
-    for ra in new_node_ras:
-        id_map[old_ra_name_map[(ra.network_id, ra.node_id, ra.link_id, ra.group_id, ra.attr_id)]] = ra.id
-
-
-    new_link_ras = db.DBSession.query(ResourceAttr).filter(and_(ResourceAttr.link_id==Link.id, Link.network_id==newnetworkid)).all()
-    for ra in new_link_ras:
-        id_map[old_ra_name_map[(ra.network_id, ra.node_id, ra.link_id, ra.group_id, ra.attr_id)]] = ra.id
-
-    new_group_ras = db.DBSession.query(ResourceAttr).filter(and_(ResourceAttr.group_id==ResourceGroup.id, ResourceGroup.network_id==newnetworkid)).all()
-    for ra in new_group_ras:
-        id_map[old_ra_name_map[(ra.network_id, ra.node_id, ra.link_id, ra.group_id, ra.attr_id)]] = ra.id
-    log.info("ID map completed. Returning")
-
-    return id_map
+    _insert_from_select(ras, ['ref_key', 'network_id', 'attr_id', 'attr_is_var'],
+        select([ras.c.ref_key, literal(newnetworkid, Integer), ras.c.attr_id, ras.c.attr_is_var]).where(
+            ras.c.network_id == network_id))
+
+    for id_column, resource_id_map in resource_id_maps:
+        log.info("Cloning %s attributes", id_column)
+        resource_ids = resource_id_map.alias()
+        _insert_from_select(ras, ['ref_key', id_column, 'attr_id', 'attr_is_var'],
+            select([ras.c.ref_key, resource_ids.c.new_id, ras.c.attr_id, ras.c.attr_is_var]).select_from(
+                ras.join(resource_ids, ras.c[id_column] == resource_ids.c.old_id)))
+
+    #A resource has each attribute at most once, so an attribute is mapped
+    #to the attribute of the same resource, in the new network, with the same attr_id.
+    old_ras = ras.alias()
+    new_ras = ras.alias()
+    ra_id_maps = [select([old_ras.c.id.label('old_id'), new_ras.c.id.label('new_id')]).where(and_(
+        old_ras.c.network_id == network_id,
+        new_ras.c.network_id == newnetworkid,
+        old_ras.c.attr_id == new_ras.c.attr_id))]
+
+    for id_column, resource_id_map in resource_id_maps:
+        old_ras = ras.alias()
+        new_ras = ras.alias()
+        resource_ids = resource_id_map.alias()
+        ra_id_maps.append(select([old_ras.c.id.label('old_id'), new_ras.c.id.label('new_id')]).select_from(
+            old_ras.join(resource_ids, old_ras.c[id_column] == resource_ids.c.old_id).join(
+                new_ras, and_(new_ras.c[id_column] == resource_ids.c.new_id,
+                              new_ras.c.attr_id == old_ras.c.attr_id))))
+
+    return union_all(*ra_id_maps)
 
 def _clone_resourcetypes(network_id, newnetworkid, node_id_map, link_id_map, group_id_map):
+    """
+        Copy the types of a network and its nodes, links and groups onto
+        the new network and resources.
+    """
+    rts = ResourceType.__table__
 
     log.info("Cloning Network Types")
-    network_ras = db.DBSession.query(ResourceType).filter(ResourceType.network_id==network_id)
-    new_ras = []
-    for rt in network_ras:
-        new_ras.append(dict(
-            ref_key=rt.ref_key,
-            network_id=newnetworkid,
-            node_id=rt.node_id,
-            link_id=rt.link_id,
-            group_id=rt.group_id,
-            type_id=rt.type_id,
-        ))
-    log.info("Cloning Node Types")
-    node_rts = db.DBSession.query(ResourceType).filter(and_(ResourceType.node_id==Node.id, Node.network_id==network_id))
-    for rt in node_rts:
-        new_ras.append(dict(
-            ref_key=rt.ref_key,
-            network_id=rt.network_id,
-            node_id=node_id_map[rt.node_id],
-            link_id=rt.link_id,
-            group_id=rt.group_id,
-            type_id=rt.type_id,
-        ))
-    log.info("Cloning Link Types")
-    link_rts = db.DBSession.query(ResourceType).filter(and_(ResourceType.link_id==Link.id, Link.network_id==network_id))
-    for rt in link_rts:
-        new_ras.append(dict(
-            ref_key=rt.ref_key,
-            network_id=rt.network_id,
-            node_id=rt.node_id,
-            link_id=link_id_map[rt.link_id],
-            group_id=rt.group_id,
-            type_id=rt.type_id,
-        ))
-
-    log.info("Cloning Group Types")
-    group_rts = db.DBSession.query(ResourceType).filter(and_(ResourceType.group_id==ResourceGroup.id, ResourceGroup.network_id==network_id))
-    for rt in group_rts:
-        new_ras.append(dict(
-            ref_key=rt.ref_key,
-            network_id=rt.network_id,
-            node_id=rt.node_id,
-            link_id=rt.link_id,
-            group_id=group_id_map[rt.group_id],
-            type_id=rt.type_id,
-        ))
-
-    log.info("Inserting new resource types")
-    db.DBSession.bulk_insert_mappings(ResourceType, new_ras)
-    db.DBSession.flush()
-    log.info("Insertion Complete")
+    _insert_from_select(rts, ['ref_key', 'network_id', 'type_id'],
+        select([rts.c.ref_key, literal(newnetworkid, Integer), rts.c.type_id]).where(
+            rts.c.network_id == network_id))
+
+    for id_column, resource_id_map in [('node_id', node_id_map),
+                                       ('link_id', link_id_map),
+                                       ('group_id', group_id_map)]:
+        log.info("Cloning %s types", id_column)
+        resource_ids = resource_id_map.alias()
+        _insert_from_select(rts, ['ref_key', id_column, 'type_id'],
+            select([rts.c.ref_key, resource_ids.c.new_id, rts.c.type_id]).select_from(
+                rts.join(resource_ids, rts.c[id_column] == resource_ids.c.old_id)))
+
+def _flatten_uncopied_sources(network_id, scenario_ids):
+    """
+        Flatten the copy-on-write clones among the scenarios of a network
+        which are to be copied, where the scenario they share data with is not.
+    """
+    scenario_qry = db.DBSession.query(Scenario).filter(Scenario.network_id == network_id,
+                                                       Scenario.status == 'A')
+    if len(scenario_ids) > 0:
+        scenario_qry = scenario_qry.filter(Scenario.id.in_(scenario_ids))
+
+    copied = scenario_qry.all()
+    copied_ids = set(s.id for s in copied)
+    for scenario_i in copied:
+        if scenario_i.copy_on_write == 'Y' and scenario_i.parent_id not in copied_ids:
+            scenario._flatten_scenario(scenario_i)
 
 def _clone_scenarios(network_id,
                      newnetworkid,
@@ -3037,102 +3949,85 @@ def _clone_scenarios(network_id,
                      user_id,
                      include_outputs=False,
                      scenario_ids=[]):
-
-    scenarios = db.DBSession.query(Scenario).filter(Scenario.network_id == network_id).all()
-
-    id_map = {}
-
-    for scenario in scenarios:
-        #if scenario_ids are specified (the list is not empty) then filter out
-        #the scenarios not specified.
-        if len(scenario_ids) > 0 and scenario.id not in scenario_ids:
-            log.info("Not cloning scenario %s", scenario.id)
-            continue
-
-        if scenario.status == 'A':
-            new_scenario_id = _clone_scenario(scenario,
-                                              newnetworkid,
-                                              ra_id_map,
-                                              node_id_map,
-                                              link_id_map,
-                                              group_id_map,
-                                              user_id,
-                                              include_outputs=include_outputs)
-            id_map[scenario.id] = new_scenario_id
-
-    return id_map
-
-def _clone_scenario(old_scenario,
-                    newnetworkid,
-                    ra_id_map,
-                    node_id_map,
-                    link_id_map,
-                    group_id_map,
-                    user_id,
-                    include_outputs=False):
-
-    log.info("Adding scenario shell to get scenario ID")
-    news = Scenario()
-    news.network_id = newnetworkid
-    news.name = old_scenario.name
-    news.description = old_scenario.description
-    news.layout = old_scenario.layout
-    news.start_time = old_scenario.start_time
-    news.end_time = old_scenario.end_time
-    news.time_step = old_scenario.time_step
-    news.parent_id = old_scenario.parent_id
-    news.created_by = user_id
-
-    db.DBSession.add(news)
-
-    db.DBSession.flush()
-
-    scenario_id = news.id
-    log.info("New Scenario %s created", scenario_id)
-
-    log.info("Getting old resource scenarios for scenario %s", old_scenario.id)
-    old_rscen_qry = db.DBSession.query(ResourceScenario).filter(
-        ResourceScenario.scenario_id == old_scenario.id,
-        ResourceAttr.id == ResourceScenario.resource_attr_id,
-    )
+    """
+        Copy the active scenarios of a network, with their data and group
+        items, into the new network. If scenario_ids is not empty, only
+        those scenarios are copied. Output data is only copied if
+        include_outputs is True.
+
+        Returns a dict mapping the old scenario IDs to the new ones.
+    """
+    scenarios = Scenario.__table__
+
+    _flatten_uncopied_sources(network_id, scenario_ids)
+
+    scenario_qry = select([literal(newnetworkid, Integer), scenarios.c.name, scenarios.c.description,
+                           scenarios.c.layout, scenarios.c.start_time, scenarios.c.end_time,
+                           scenarios.c.time_step, scenarios.c.parent_id, scenarios.c.copy_on_write,
+                           literal(user_id, Integer)]).where(and_(
+                               scenarios.c.network_id == network_id,
+                               scenarios.c.status == 'A'))
+
+    #if scenario_ids are specified (the list is not empty) then filter out
+    #the scenarios not specified.
+    if len(scenario_ids) > 0:
+        scenario_qry = scenario_qry.where(scenarios.c.id.in_(scenario_ids))
+
+    num_scenarios = _insert_from_select(scenarios,
+        ['network_id', 'name', 'description', 'layout', 'start_time', 'end_time',
+         'time_step', 'parent_id', 'copy_on_write', 'created_by'],
+        scenario_qry)
+    log.info("%s scenarios cloned", num_scenarios)
+
+    scenario_id_map = _id_map(scenarios, network_id, newnetworkid, 'name')
+
+    #The copy-on-write clones share the data of the new copies of their sources
+    copies = db.DBSession.execute(select([scenarios.c.id, scenarios.c.parent_id]).where(and_(
+        scenarios.c.network_id == newnetworkid,
+        scenarios.c.copy_on_write == 'Y'))).fetchall()
+    new_source_ids = _read_id_map(scenario_id_map, [c.parent_id for c in copies])
+    for c in copies:
+        db.DBSession.execute(scenarios.update().where(scenarios.c.id == c.id).values(
+            parent_id=new_source_ids[c.parent_id]))
+
+    log.info("Cloning resource scenarios")
+    rscens = ResourceScenario.__table__
+    ras = ResourceAttr.__table__
+    new_scenarios = scenario_id_map.alias()
+    new_ras = ra_id_map.alias()
+
+    rscen_qry = select([rscens.c.dataset_id, new_scenarios.c.new_id, new_ras.c.new_id]).select_from(
+        rscens.join(new_scenarios, rscens.c.scenario_id == new_scenarios.c.old_id).join(
+            new_ras, rscens.c.resource_attr_id == new_ras.c.old_id).join(
+            ras, rscens.c.resource_attr_id == ras.c.id))
 
     #Filter out output data unless explicitly requested not to.
     if include_outputs is not True:
-        old_rscen_qry = old_rscen_qry.filter(ResourceAttr.attr_is_var == 'N')
-
-    old_rscen_rs = old_rscen_qry.all()
-
-    new_rscens = []
-    for old_rscen in old_rscen_rs:
-        new_rscens.append(dict(
-            dataset_id=old_rscen.dataset_id,
-            scenario_id=scenario_id,
-            resource_attr_id=ra_id_map[old_rscen.resource_attr_id],
-        ))
-
-    log.info("Inserting new resource scenarios")
-    db.DBSession.bulk_insert_mappings(ResourceScenario, new_rscens)
-    log.info("Insertion Complete")
-
-
-
-    log.info("Getting old resource group items for scenario %s", old_scenario.id)
-    old_rgis = db.DBSession.query(ResourceGroupItem).filter(
-        ResourceGroupItem.scenario_id == old_scenario.id).all()
-
-    new_rgis = []
-    for old_rgi in old_rgis:
-        new_rgis.append(dict(
-            ref_key=old_rgi.ref_key,
-            node_id=node_id_map.get(old_rgi.node_id),
-            link_id=link_id_map.get(old_rgi.link_id),
-            group_id=group_id_map.get(old_rgi.group_id),
-            scenario_id=scenario_id,
-        ))
-
-    db.DBSession.bulk_insert_mappings(ResourceGroupItem, new_rgis)
-
-    return scenario_id
+        rscen_qry = rscen_qry.where(ras.c.attr_is_var == 'N')
+
+    num_rscens = _insert_from_select(rscens, ['dataset_id', 'scenario_id', 'resource_attr_id'], rscen_qry)
+    log.info("%s resource scenarios cloned", num_rscens)
+
+    log.info("Cloning resource group items")
+    items = ResourceGroupItem.__table__
+    new_scenarios = scenario_id_map.alias()
+    new_groups = group_id_map.alias()
+    new_nodes = node_id_map.alias()
+    new_links = link_id_map.alias()
+    new_subgroups = group_id_map.alias()
+
+    num_items = _insert_from_select(items,
+        ['ref_key', 'node_id', 'link_id', 'subgroup_id', 'group_id', 'scenario_id'],
+        select([items.c.ref_key, new_nodes.c.new_id, new_links.c.new_id,
+                new_subgroups.c.new_id, new_groups.c.new_id, new_scenarios.c.new_id]).select_from(
+            items.join(new_scenarios, items.c.scenario_id == new_scenarios.c.old_id).outerjoin(
+                new_groups, items.c.group_id == new_groups.c.old_id).outerjoin(
+                new_nodes, items.c.node_id == new_nodes.c.old_id).outerjoin(
+                new_links, items.c.link_id == new_links.c.old_id).outerjoin(
+                new_subgroups, items.c.subgroup_id == new_subgroups.c.old_id)))
+    log.info("%s resource group items cloned", num_items)
+
+    return dict(db.DBSession.execute(scenario_id_map).fetchall())
 
 @required_perms("edit_network")
 def apply_unit_to_network_rs(network_id, unit_id, attr_id, scenario_id=None, **kwargs):
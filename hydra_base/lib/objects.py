@@ -17,16 +17,18 @@
 # along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
 #
 
-import json
 import six
 import enum
 
 from datetime import datetime
+from decimal import Decimal
 from ..exceptions import HydraError
 
 from .HydraTypes.Registry import HydraObjectFactory
+from .HydraTypes.Codecs import DecodedValue
 
 from ..util import generate_data_hash, get_layout_as_dict, get_layout_as_string
+from ..util import jsonutil
 from .. import config
 import pandas as pd
 
@@ -36,16 +38,138 @@ log = logging.getLogger(__name__)
 
 VALID_JSON_FIRST_CHARS = ['{', '[']
 
+def _coerce_value(v):
+    """
+        Convert a plain value as it is set on a JSONObject: numbers
+        and numeric strings become ints or floats and datetimes become strings.
+    """
+    try:
+        int(v)
+        if v.find('.'):
+            if int(v.split('.')[0]) == int(v):
+                v = int(v)
+        else:
+            v = int(v)
+    except:
+        pass
+
+    try:
+        if not isinstance(v, int):
+            v = float(v)
+    except:
+        pass
+
+    if isinstance(v, datetime):
+        v = six.text_type(v)
+
+    return v
+
+#The (ascii) characters which a string accepted by int() or float() can start with
+_NUMBER_START_CHARS = frozenset('0123456789+-._ \t\n\r\x0b\x0ciInN')
+
+def _coerce_string(v):
+    """
+        The result of _coerce_value for a string
+    """
+    #Most strings are not numbers, so avoid raising exceptions for them
+    if len(v) == 0 or (v[0] < '\x80' and v[0] not in _NUMBER_START_CHARS):
+        return v
+
+    try:
+        return int(v)
+    except ValueError:
+        pass
+
+    try:
+        return float(v)
+    except ValueError:
+        return v
+
+def _identity(v):
+    return v
+
+#The result of _coerce_value for the types which come out of the DB,
+#avoiding the exceptions raised there for most values.
+_VALUE_COERCIONS = {
+    six.text_type : _coerce_string,
+    int           : _identity,
+    float         : _identity,
+    type(None)    : _identity,
+    Decimal       : float,
+    datetime      : six.text_type,
+    #Encoded dataset values are always JSON, never numbers. They are kept as
+    #they are so that the value can still be loaded from its binary form.
+    DecodedValue  : _identity,
+}
+
+def make_json_objects(rows, keys=None, extras={}, cls=None):
+    """
+        Build a JSONObject from each of a list of plain result rows, such as those
+        returned by DBSession.execute(qry.statement).fetchall().
+
+        This gives the same result as calling JSONObject(row, extras=extras)
+        on each row, but the columns are mapped once for the whole result, rather
+        than once per row, and each value is converted according to its type,
+        without trial conversions. Any row with a value which can not be
+        handled this way (a nested dict or list for example) falls back to the
+        JSONObject constructor.
+
+        args:
+            rows (list): The rows to convert
+            keys (list): The column names of the rows. If not specified,
+                         they are taken from the first row.
+            extras (dict): Values to set on every object, as for JSONObject
+            cls (class): The JSONObject subclass to create. Defaults to JSONObject
+    """
+    if cls is None:
+        cls = JSONObject
+
+    if len(rows) == 0:
+        return []
+
+    if keys is None:
+        keys = rows[0].keys()
+
+    keys = [six.text_type(k) for k in keys]
+    layout_idx = keys.index('layout') if 'layout' in keys else None
+
+    coercions = _VALUE_COERCIONS
+    objects = []
+    for row in rows:
+        values = []
+        for v in row:
+            coerce = coercions.get(type(v))
+            if coerce is None:
+                break
+            values.append(coerce(v))
+        else:
+            if layout_idx is not None:
+                values[layout_idx] = get_layout_as_dict(row[layout_idx])
+            #The values are already converted, so skip JSONObject.__init__
+            obj = cls.__new__(cls)
+            dict.update(obj, zip(keys, values))
+            for k, v in extras.items():
+                obj[k] = v
+            objects.append(obj)
+            continue
+
+        objects.append(cls(dict(zip(keys, row)), extras=extras))
+
+    return objects
+
 class JSONObject(dict):
     """
         A dictionary object whose attributes can be accesed via a '.'.
         Pass in a nested dictionary, a SQLAlchemy object or a JSON string.
     """
+    #All attributes are stored as items, so instances need no __dict__
+    __slots__ = ()
+
     def __init__(self, obj_dict={}, parent=None, extras={}):
 
         if isinstance(obj_dict, six.string_types):
             try:
-                obj = json.loads(obj_dict)
+                obj = jsonutil.loads(obj_dict)
                 assert isinstance(obj, dict), "JSON string does not evaluate to a dict"
             except Exception:
                 log.critical(obj_dict)
@@ -145,26 +269,7 @@ class JSONObject(dict):
                 if parent is not None and type(v) == type(parent):
                     continue
 
-                try:
-                    int(v)
-                    if v.find('.'):
-                        if int(v.split('.')[0]) == int(v):
-                            v = int(v)
-                    else:
-                        v = int(v)
-                except:
-                    pass
-
-                try:
-                    if not isinstance(v, int):
-                        v = float(v)
-                except:
-                    pass
-
-                if isinstance(v, datetime):
-                    v = six.text_type(v)
-
-                setattr(self, six.text_type(k), v)
+                setattr(self, six.text_type(k), _coerce_value(v))
 
         for k, v in extras.items():
             setattr(self, k, v)
@@ -183,7 +288,7 @@ class JSONObject(dict):
 
     def as_json(self):
 
-        return json.dumps(self)
+        return jsonutil.dumps(self)
 
     def get_layout(self):
         if self.get('layout') is not None:
@@ -198,6 +303,33 @@ class JSONObject(dict):
         else:
             return None
 
+def parse_dataset_value(data_type, value, metadata=None):
+    """
+        Turn the value of an incoming dataset into a hydra-friendly value,
+        validating it against its data type.
+        This is a plain function, rather than only a method of Dataset, so
+        that it can be run in a worker process.
+    """
+    try:
+        if value is None:
+            log.warning("Cannot parse dataset. No value specified.")
+            return None
+
+        # attr_data.value is a dictionary but the keys have namespaces which must be stripped
+        data = six.text_type(value)
+
+        if data.upper().strip() in ("NULL", ""):
+            return "NULL"
+
+        data = data[0:100]
+        log.debug("[Dataset.parse_value] Parsing %s (%s)", data, type(data))
+
+        return HydraObjectFactory.valueFromDataset(data_type, value, metadata)
+
+    except Exception as e:
+        log.exception(e)
+        raise HydraError("Error parsing value %s: %s"%(value, e))
+
 class ResourceScenario(JSONObject):
     def __init__(self, rs):
         super(ResourceScenario, self).__init__(rs)
@@ -226,25 +358,7 @@ class Dataset(JSONObject):
         """
             Turn the value of an incoming dataset into a hydra-friendly value.
         """
-        try:
-            if self.value is None:
-                log.warning("Cannot parse dataset. No value specified.")
-                return None
-
-            # attr_data.value is a dictionary but the keys have namespaces which must be stripped
-            data = six.text_type(self.value)
-
-            if data.upper().strip() in ("NULL", ""):
-                return "NULL"
-
-            data = data[0:100]
-            log.debug("[Dataset.parse_value] Parsing %s (%s)", data, type(data))
-
-            return HydraObjectFactory.valueFromDataset(self.type, self.value, self.get_metadata_as_dict())
-
-        except Exception as e:
-            log.exception(e)
-            raise HydraError("Error parsing value %s: %s"%(self.value, e))
+        return parse_dataset_value(self.type, self.value, self.get_metadata_as_dict())
 
 
     def get_metadata_as_dict(self, user_id=None, source=None):
@@ -262,7 +376,7 @@ class Dataset(JSONObject):
         if self.metadata is None or self.metadata == "":
             return {}
 
-        metadata_dict = self.metadata if isinstance(self.metadata, dict) else json.loads(self.metadata)
+        metadata_dict = self.metadata if isinstance(self.metadata, dict) else jsonutil.loads(self.metadata)
 
         # These should be set on all datasets by default, but we don't enforce this rigidly
         metadata_keys = [m.lower() for m in metadata_dict]
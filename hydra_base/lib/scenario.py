@@ -18,9 +18,14 @@
 #
 
 import logging
+import json
 import six
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
 from ..exceptions import HydraError, PermissionError, ResourceNotFoundError
 from .. import db
+from .. import config
 from ..db.model import Scenario,\
         ResourceGroupItem,\
         ResourceScenario,\
@@ -30,18 +35,26 @@ from ..db.model import Scenario,\
         Dataset,\
         Network,\
         Attr,\
-        ResourceAttrMap
+        ResourceAttrMap,\
+        Metadata
 
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy import or_, and_, func
+from sqlalchemy import or_, and_, func, bindparam, select, union_all, literal, Integer
+from sqlalchemy.sql import null
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from zope.sqlalchemy import mark_changed
 from sqlalchemy.orm import joinedload, aliased
 from . import data
-from collections import namedtuple
-from copy import deepcopy
 
-from .network import get_resource
+from .network import get_resource, _get_unreadable_datasets, _insert_from_select
 
-from .objects import JSONObject
+from .objects import JSONObject, make_json_objects
+from .HydraTypes.Codecs import encode_value
+from .HydraTypes.Types import RegularTimeseries, Tensor
+from ..util.cache import invalidate_network
+from ..util.lookup import in_keys
+from ..util import generate_data_hash, get_val
+from ..util import jsonutil
 
 log = logging.getLogger(__name__)
 
@@ -63,6 +76,9 @@ def _get_scenario(scenario_id, user_id):
     scenario.network.check_read_permission(user_id)
 
 def set_rs_dataset(resource_attr_id, scenario_id, dataset_id, **kwargs):
+    #The resource scenario may be shared with a copy-on-write clone's source
+    _materialize_copies(scenario_id, flatten=True)
+
     rs = db.DBSession.query(ResourceScenario).filter(
         ResourceScenario.resource_attr_id==resource_attr_id,
         ResourceScenario.scenario_id==scenario_id).first()
@@ -91,6 +107,8 @@ def copy_data_from_scenario(resource_attrs, source_scenario_id, target_scenario_
         the resource scenarios in the source scenario to those in the 'target' scenario.
     """
 
+    _materialize_copies(target_scenario_id)
+
     #Get all the resource scenarios we wish to update
     target_resourcescenarios = db.DBSession.query(ResourceScenario).filter(
             ResourceScenario.scenario_id==target_scenario_id,
@@ -274,6 +292,10 @@ def update_scenario(scenario,update_data=True,update_groups=True,flush=True,**kw
     if scen.locked == 'Y':
         raise PermissionError('Scenario is locked. Unlock before editing.')
 
+    if update_data is True or update_groups is True:
+        _materialize_copies(scen.id,
+                            flatten=update_groups is True and bool(scenario.resourcegroupitems))
+
     scen.name                 = scenario.name
     scen.description          = scenario.description
     scen.layout               = scenario.get_layout()
@@ -336,6 +358,8 @@ def purge_scenario(scenario_id, **kwargs):
 
     scenario_i = _get_scenario(scenario_id, user_id)
 
+    _materialize_copies(scenario_id)
+
     db.DBSession.delete(scenario_i)
     db.DBSession.flush()
     return 'OK'
@@ -393,13 +417,19 @@ def create_child_scenario(parent_scenario_id, child_name, **kwargs):
 
     return child_scenario_j
 
-def clone_scenario(scenario_id, retain_results=False, scenario_name=None, **kwargs):
+def clone_scenario(scenario_id, retain_results=False, scenario_name=None, copy_on_write=False, **kwargs):
     """
         Create an exact copy of a scenario and place it in the same network
         args:
             scenario_id (int): The scenario ID to clone
             retain_results (bool): Flag to indicated whether resource scenarios connected to resource attribtues which have an 'attr_is_var' are copied or not. Defaults to False, so results are not retained by default.
             scenario_name (string): The name of the new scenario. If None, the existing scenario's name is used, appended with '(clone'). Multiple clones of the same network result in  "... (clone) 1", "... (clone) 2" etc,
+            copy_on_write (bool): Don't copy the data. The clone shares the data and group
+                                  items of the original scenario, and stores only what is
+                                  written to it. Its shared data is copied into it when the
+                                  original scenario is changed, or by flatten_scenario.
+                                  The clone shares all the original's data, so retain_results
+                                  is not applied.
     """
 
     user_id = kwargs.get('user_id')
@@ -443,6 +473,10 @@ def clone_scenario(scenario_id, retain_results=False, scenario_name=None, **kwar
     cloned_scen.end_time             = scen_i.end_time
     cloned_scen.time_step            = scen_i.time_step
 
+    if copy_on_write is True:
+        cloned_scen.parent_id     = scen_i.id
+        cloned_scen.copy_on_write = 'Y'
+
     db.DBSession.add(cloned_scen)
 
     db.DBSession.flush()
@@ -450,18 +484,24 @@ def clone_scenario(scenario_id, retain_results=False, scenario_name=None, **kwar
     cloned_scenario_id = cloned_scen.id
     log.info("New scenario created. Scenario ID: %s", cloned_scenario_id)
 
+    if copy_on_write is True:
+        cloned_scen = JSONObject(_get_scenario(cloned_scenario_id, user_id))
+        cloned_scen.resourcescenarios = []
+        cloned_scen.resourcegroupitems = []
+        log.info("Returning copy-on-write clone")
+        return cloned_scen
 
+
+    #If the scenario being cloned is a copy-on-write clone, the clone
+    #gets the data and group items it shares too.
     log.info("Getting in resource scenarios to clone from scenario %s", scenario_id)
     if retain_results is False:
-        old_rscen_rs = db.DBSession.query(ResourceScenario).filter(
-                                        ResourceScenario.scenario_id==scenario_id,
+        old_rscen_rs = scen_i.filter_data(db.DBSession.query(ResourceScenario).filter(
                                         ResourceAttr.id==ResourceScenario.resource_attr_id,
                                         ResourceAttr.attr_is_var == 'N'
-                                    ).all()
+                                    )).all()
     else:
-        old_rscen_rs = db.DBSession.query(ResourceScenario).filter(
-                                        ResourceScenario.scenario_id==scenario_id
-                                    ).all()
+        old_rscen_rs = scen_i.filter_data(db.DBSession.query(ResourceScenario)).all()
 
 
     new_rscens = []
@@ -479,7 +519,7 @@ def clone_scenario(scenario_id, retain_results=False, scenario_name=None, **kwar
     log.info("ResourceScenarios cloned")
 
     log.info("Getting old resource group items for scenario %s", scenario_id)
-    old_rgis = db.DBSession.query(ResourceGroupItem).filter(ResourceGroupItem.scenario_id==scenario_id).all()
+    old_rgis = scen_i.filter_group_items(db.DBSession.query(ResourceGroupItem)).all()
     new_rgis = []
     for old_rgi in old_rgis:
         new_rgis.append(dict(
@@ -507,112 +547,486 @@ def clone_scenario(scenario_id, retain_results=False, scenario_name=None, **kwar
 
     return cloned_scen
 
-def _get_dataset_as_dict(rs, user_id):
-    if rs.dataset is None:
-        return None
+def flatten_scenario(scenario_id, **kwargs):
+    """
+        Copy the data and group items which a copy-on-write clone shares with
+        the scenario it was cloned from into the clone, so it becomes an
+        ordinary scenario. Does nothing to a scenario which is not a copy-on-write clone.
+    """
+    user_id = kwargs.get('user_id')
 
-    dataset = deepcopy(rs.dataset.__dict__)
+    _check_can_edit_scenario(scenario_id, user_id)
 
-    dataset['metadata'] = {}
+    scenario_i = _get_scenario(scenario_id, user_id)
 
-    del dataset['_sa_instance_state']
+    _flatten_scenario(scenario_i)
+
+    return 'OK'
+
+def _flatten_scenario(scenario_i):
+    """
+        Copy the shared data and group items of a copy-on-write clone into it,
+        with an INSERT ... SELECT from its sources for each.
+    """
+    if scenario_i.copy_on_write != 'Y':
+        return
 
+    source_ids = scenario_i.get_copy_source_ids()
+    last_source = db.DBSession.query(Scenario).filter(Scenario.id == source_ids[-1]).one()
+
+    log.info("Flattening copy-on-write scenario %s", scenario_i.id)
+
+    rs_qry = scenario_i.filter_data(db.DBSession.query(ResourceScenario.resource_attr_id,
+                                                       ResourceScenario.dataset_id,
+                                                       ResourceScenario.source,
+                                                       literal(scenario_i.id, Integer)),
+                                    scenario_ids=source_ids).filter(
+                                        ResourceScenario.scenario_id != scenario_i.id)
+    num_rs = _insert_from_select(ResourceScenario.__table__,
+                                 ['resource_attr_id', 'dataset_id', 'source', 'scenario_id'],
+                                 rs_qry.statement)
+
+    rgi_qry = scenario_i.filter_group_items(db.DBSession.query(ResourceGroupItem.ref_key,
+                                                               ResourceGroupItem.node_id,
+                                                               ResourceGroupItem.link_id,
+                                                               ResourceGroupItem.subgroup_id,
+                                                               ResourceGroupItem.group_id,
+                                                               literal(scenario_i.id, Integer)),
+                                            scenario_ids=source_ids).filter(
+                                                ResourceGroupItem.scenario_id != scenario_i.id)
+    num_rgi = _insert_from_select(ResourceGroupItem.__table__,
+                                  ['ref_key', 'node_id', 'link_id', 'subgroup_id', 'group_id', 'scenario_id'],
+                                  rgi_qry.statement)
+
+    log.info("%s resource scenarios and %s group items copied", num_rs, num_rgi)
+
+    #It now inherits what the last of its sources inherited, as an ordinary clone would
+    scenario_i.parent_id = last_source.parent_id
+    scenario_i.copy_on_write = 'N'
+
+    db.DBSession.flush()
+    db.DBSession.expire(scenario_i)
+
+def _materialize_copies(scenario_id, flatten=False):
+    """
+        Before the data of a scenario is changed, flatten the copy-on-write
+        clones which share it, so the change is not seen by them.
+
+        With flatten, the scenario is also flattened if it is a copy-on-write
+        clone. Data and group items it shares are not its own rows, so this
+        must be done before they are deleted, or before its group items change,
+        as a group's items are shared or stored as a whole.
+    """
+    if flatten is True:
+        _flatten_scenario(db.DBSession.query(Scenario).filter(Scenario.id == scenario_id).one())
+
+    for child_i in db.DBSession.query(Scenario).filter(Scenario.parent_id == scenario_id,
+                                                       Scenario.copy_on_write == 'Y').all():
+        _flatten_scenario(child_i)
+
+def create_scenario_ensemble(scenario_id, members, **kwargs):
+    """
+        Create many copy-on-write clones of a scenario (see clone_scenario),
+        each with some of its numeric data perturbed. Each perturbed value is
+        base_value * scale + offset, calculated for all the members at once.
+        Identical datasets are only stored once, and the scenarios, datasets
+        and resource scenarios are each inserted in bulk.
+        args:
+            scenario_id (int): The base scenario
+            members (list): A dict for each scenario to create, with:
+                name (string): The name of the scenario. Defaults to
+                               "<base scenario name> (ensemble N)"
+                perturbations (list): Dicts, applied in order, of:
+                    resource_attr_ids (list): The resource attributes to perturb
+                    attr_ids (list): Perturb the base scenario's data for
+                                     all the resource attributes of these attributes
+                    scale (float): Defaults to 1
+                    offset (float): Defaults to 0
+        returns:
+            A list of the new scenarios, with the resource scenarios added to each.
+        Only scalar, array and timeseries data with numeric values can be perturbed.
+    """
+    user_id = kwargs.get('user_id')
+    source = kwargs.get('app_name')
+
+    scen_i = _get_scenario(scenario_id, user_id)
+    scen_i.network.check_write_permission(user_id)
+
+    if len(members) == 0:
+        return []
+
+    names = [m.get('name') or "%s (ensemble %s)"%(scen_i.name, i + 1) for i, m in enumerate(members)]
+    if len(set(names)) < len(names):
+        raise HydraError("The scenarios of an ensemble must have different names")
+
+    with in_keys(Scenario.name, names) as name_filter:
+        existing_names = [s.name for s in db.DBSession.query(Scenario.name).filter(
+            Scenario.network_id == scen_i.network_id, name_filter)]
+    if len(existing_names) > 0:
+        raise HydraError("Scenarios named %s already exist in network %s"%
+                         (existing_names, scen_i.network_id))
+
+    ra_ids = set()
+    attr_ids = set()
+    for member in members:
+        for perturbation in member.get('perturbations', []):
+            ra_ids.update(perturbation.get('resource_attr_ids') or [])
+            attr_ids.update(perturbation.get('attr_ids') or [])
+
+    rs_qry = db.DBSession.query(ResourceScenario).join(ResourceAttr).filter(
+        or_(ResourceScenario.resource_attr_id.in_(ra_ids),
+            ResourceAttr.attr_id.in_(attr_ids))).options(joinedload('dataset'))
+    base_data = dict((rs.resource_attr_id, rs) for rs in scen_i.filter_data(rs_qry).all())
+
+    unreadable = _get_unreadable_datasets(set(rs.dataset.id for rs in base_data.values()
+                                              if rs.dataset.hidden == 'Y'), user_id)
+    if len(unreadable) > 0:
+        raise PermissionError("Datasets %s of scenario %s can not be read by user %s"%
+                              (sorted(unreadable), scenario_id, user_id))
+
+    base_metadata = {}
+    for m in data._get_metadata(set(rs.dataset_id for rs in base_data.values())):
+        base_metadata.setdefault(m.dataset_id, {})[m.key] = m.value
+
+    #The combined scale and offset of each perturbed resource attribute of each member
+    member_changes = []
+    for member in members:
+        changes = OrderedDict()
+        for perturbation in member.get('perturbations', []):
+            scale = float(perturbation.get('scale', 1))
+            offset = float(perturbation.get('offset', 0))
+            perturbed_ras = set(perturbation.get('resource_attr_ids') or [])
+            perturbed_ras.update(ra_id for ra_id, rs in base_data.items()
+                                 if rs.resourceattr.attr_id in (perturbation.get('attr_ids') or []))
+            for ra_id in sorted(perturbed_ras):
+                if ra_id not in base_data:
+                    raise ResourceNotFoundError("Scenario %s has no data for resource attribute %s"%
+                                                (scenario_id, ra_id))
+                current_scale, current_offset = changes.get(ra_id, (1.0, 0.0))
+                changes[ra_id] = (current_scale * scale, current_offset * scale + offset)
+        member_changes.append(changes)
+
+    #Calculate the values of each resource attribute for all the members at once
+    member_values = [{} for _ in members]
+    new_data = {}
+    for ra_id, rs in base_data.items():
+        member_idx = [i for i, changes in enumerate(member_changes) if ra_id in changes]
+        if len(member_idx) == 0:
+            continue
+
+        scales = np.array([member_changes[i][ra_id][0] for i in member_idx])
+        offsets = np.array([member_changes[i][ra_id][1] for i in member_idx])
+
+        values = _perturb_values(rs.dataset, scales, offsets)
+
+        metadata = dict(base_metadata.get(rs.dataset_id, {}))
+        if user_id is not None:
+            metadata.setdefault('user_id', str(user_id))
+        if source is not None:
+            metadata.setdefault('source', str(source))
+
+        for i, value in zip(member_idx, values):
+            dataset_dict = dict(type=rs.dataset.type,
+                                name=rs.dataset.name,
+                                unit_id=rs.dataset.unit_id,
+                                created_by=user_id,
+                                value=value,
+                                metadata=dict(metadata))
+            dataset_dict['hash'] = generate_data_hash(dataset_dict)
+            new_data[dataset_dict['hash']] = dataset_dict
+            member_values[i][ra_id] = dataset_dict['hash']
+
+    log.info("%s distinct datasets in an ensemble of %s scenarios", len(new_data), len(members))
+
+    hash_dataset_map = data._insert_datasets(new_data, user_id=user_id)
+
+    scenario_rows = [dict(network_id=scen_i.network_id,
+                          name=name,
+                          description=scen_i.description,
+                          created_by=user_id,
+                          parent_id=scen_i.id,
+                          copy_on_write='Y',
+                          start_time=scen_i.start_time,
+                          end_time=scen_i.end_time,
+                          time_step=scen_i.time_step) for name in names]
+    db.DBSession.execute(Scenario.__table__.insert(), scenario_rows)
+    mark_changed(db.DBSession())
+
+    with in_keys(Scenario.name, names) as name_filter:
+        new_scenarios = dict((s.name, s) for s in db.DBSession.query(Scenario).filter(
+            Scenario.network_id == scen_i.network_id, name_filter))
+
+    rs_rows = []
+    for name, values in zip(names, member_values):
+        for ra_id, data_hash in values.items():
+            rs_rows.append(dict(scenario_id=new_scenarios[name].id,
+                                resource_attr_id=ra_id,
+                                dataset_id=hash_dataset_map[data_hash].id,
+                                source=source))
+    if len(rs_rows) > 0:
+        db.DBSession.execute(ResourceScenario.__table__.insert(), rs_rows)
+
+    #The inserts bypass the ORM, so the network is not invalidated on flush
+    invalidate_network(scen_i.network_id)
+
+    log.info("Created %s scenarios with %s resource scenarios", len(names), len(rs_rows))
+
+    ensemble = []
+    for name in names:
+        scenario_j = JSONObject(new_scenarios[name])
+        scenario_j.resourcescenarios = [JSONObject(r) for r in rs_rows
+                                        if r['scenario_id'] == scenario_j.id]
+        scenario_j.resourcegroupitems = []
+        ensemble.append(scenario_j)
+
+    return ensemble
+
+def _perturb_values(dataset, scales, offsets):
+    """
+        Calculate value * scale + offset of a numeric dataset for each
+        scale and offset, with one array operation. Returns the values
+        in the form they are stored in, as the types in HydraTypes make them.
+    """
+    data_type = dataset.type.lower()
     try:
-        rs.dataset.check_read_permission(user_id)
-    except PermissionError:
-           dataset['value']      = None
-           dataset['metadata'] = {}
+        if data_type == 'scalar':
+            base = np.array(float(dataset.value))
+        elif data_type == 'array':
+            base = np.array(jsonutil.loads(dataset.value), dtype=float)
+        elif data_type == 'tensor':
+            base = Tensor.fromDataset(dataset.value).get_array().astype(float)
+        elif data_type == 'timeseries':
+            frame = pd.DataFrame.from_dict(jsonutil.loads(dataset.value))
+            base = frame.values.astype(float)
+        elif data_type == 'regular_timeseries':
+            regular = RegularTimeseries.fromDataset(dataset.value)
+            frame = regular.get_frame()
+            base = frame.values.astype(float)
+        else:
+            raise HydraError("Data of type %s can not be perturbed"%(dataset.type,))
+    except (TypeError, ValueError):
+        raise HydraError("Dataset %s does not have a numeric value"%(dataset.id,))
+
+    shape = (len(scales),) + (1,) * base.ndim
+    values = base[np.newaxis] * scales.reshape(shape) + offsets.reshape(shape)
+
+    if data_type == 'scalar':
+        return [str(v) for v in values.tolist()]
+    elif data_type == 'array':
+        return [json.dumps(v) for v in values.tolist()]
+    elif data_type == 'tensor':
+        return [Tensor(v).value for v in values]
+    elif data_type == 'regular_timeseries':
+        return [RegularTimeseries(pd.DataFrame(v, index=frame.index, columns=frame.columns),
+                                  seasonal=regular.seasonal).value for v in values]
+    else:
+        return [pd.DataFrame(v, index=frame.index, columns=frame.columns).to_json(
+                    date_format='iso', date_unit='ns') for v in values]
+
+def _get_scenario_diff_qry(scenario_1, scenario_2, start_after=None):
+    """
+        Build a query of the resource attributes whose data differs between two
+        scenarios, as (resource_attr_id, dataset_id_1, dataset_id_2), where a
+        dataset ID is None if the scenario has no data for the resource attribute.
+        The data of each scenario includes what it shares as a copy-on-write clone.
+
+        Neither MySQL nor SQLite support a full outer join, so this is the union
+        of the data in scenario 1 which is missing or different in scenario 2 and
+        the data which is only in scenario 2. If start_after is set, only
+        the resource attributes with a greater ID are included.
+    """
+    def scenario_data(scenario_i):
+        rs_qry = db.DBSession.query(ResourceScenario.resource_attr_id,
+                                    ResourceScenario.dataset_id)
+        if start_after is not None:
+            rs_qry = rs_qry.filter(ResourceScenario.resource_attr_id > start_after)
+        return scenario_i.filter_data(rs_qry).subquery()
+
+    rs_1 = scenario_data(scenario_1)
+    rs_2 = scenario_data(scenario_2)
+    in_1 = select([rs_1.c.resource_attr_id,
+                   rs_1.c.dataset_id.label('dataset_id_1'),
+                   rs_2.c.dataset_id.label('dataset_id_2')]).select_from(
+                       rs_1.outerjoin(rs_2, rs_2.c.resource_attr_id == rs_1.c.resource_attr_id)).where(
+                       or_(rs_2.c.dataset_id == None, rs_2.c.dataset_id != rs_1.c.dataset_id))
+
+    rs_1 = scenario_data(scenario_1)
+    rs_2 = scenario_data(scenario_2)
+    only_in_2 = select([rs_2.c.resource_attr_id,
+                        null().label('dataset_id_1'),
+                        rs_2.c.dataset_id.label('dataset_id_2')]).select_from(
+                       rs_2.outerjoin(rs_1, rs_1.c.resource_attr_id == rs_2.c.resource_attr_id)).where(
+                       rs_1.c.resource_attr_id == None)
+
+    diff = union_all(in_1, only_in_2).alias('diff')
+
+    return select([diff]).order_by(diff.c.resource_attr_id)
+
+def _get_diff_datasets(dataset_ids, user_id):
+    """
+        Get the datasets in a scenario comparison as JSONObjects, keyed on ID,
+        with their metadata as a dict. The value and metadata of hidden datasets
+        which the user cannot read are removed.
+    """
+    datasets = {}
+    with in_keys(Dataset.id, dataset_ids) as dataset_filter:
+        result = db.DBSession.execute(db.DBSession.query(Dataset).filter(dataset_filter).statement)
+        for d in make_json_objects(result.fetchall(), result.keys()):
+            d['metadata'] = {}
+            datasets[d.id] = d
 
-    for m in rs.dataset.metadata:
-        dataset['metadata'][m.key] = m.value
+    for m in data._get_metadata(list(datasets.keys())):
+        datasets[m.dataset_id].metadata[m.key] = m.value
 
-    return dataset
+    hidden_ids = set(d.id for d in datasets.values() if d.hidden == 'Y')
+    for dataset_id in _get_unreadable_datasets(hidden_ids, user_id):
+        datasets[dataset_id]['value'] = None
+        datasets[dataset_id].metadata = {}
 
-def _get_as_obj(obj_dict, name):
+    return datasets
+
+def _get_value_delta(dataset_1, dataset_2):
     """
-        Turn a dictionary into a named tuple so it can be
-        passed into the constructor of a complex model generator.
+        Compare the values of two numeric datasets of the same type (scalar,
+        array or timeseries). Timeseries are compared at the times and columns
+        they have in common.
+
+        Returns a dict of the number of values compared, the largest absolute
+        difference and the root mean square difference between them, or None
+        if the datasets can not be compared.
     """
-    if obj_dict.get('_sa_instance_state'):
-        del obj_dict['_sa_instance_state']
-    obj = namedtuple(name, tuple(obj_dict.keys()))
-    for k, v in obj_dict.items():
-        setattr(obj, k, v)
-        log.info("%s = %s",k,getattr(obj,k))
-    return obj
+    if dataset_1 is None or dataset_2 is None:
+        return None
+    if dataset_1.value is None or dataset_2.value is None:
+        return None
+
+    data_type = dataset_1.type.lower()
+    if data_type != dataset_2.type.lower():
+        return None
+
+    try:
+        if data_type == 'scalar':
+            values_1 = np.array([float(dataset_1.value)])
+            values_2 = np.array([float(dataset_2.value)])
+        elif data_type == 'array':
+            values_1 = np.array(jsonutil.loads(dataset_1.value), dtype=float)
+            values_2 = np.array(jsonutil.loads(dataset_2.value), dtype=float)
+            if values_1.shape != values_2.shape:
+                return None
+        elif data_type == 'tensor':
+            values_1 = Tensor.fromDataset(dataset_1.value).get_array().astype(float)
+            values_2 = Tensor.fromDataset(dataset_2.value).get_array().astype(float)
+            if values_1.shape != values_2.shape:
+                return None
+        elif data_type in ('timeseries', 'regular_timeseries'):
+            timeseries_1, timeseries_2 = get_val(dataset_1).align(
+                get_val(dataset_2), join='inner')
+            values_1 = timeseries_1.values.astype(float)
+            values_2 = timeseries_2.values.astype(float)
+        else:
+            return None
+    except (ValueError, TypeError, HydraError) as e:
+        log.debug("Unable to compare datasets %s and %s: %s", dataset_1.id, dataset_2.id, e)
+        return None
+
+    differences = np.abs(values_1 - values_2).ravel()
+    differences = differences[~np.isnan(differences)]
+
+    if len(differences) == 0:
+        return JSONObject({'count': 0, 'max_abs_diff': None, 'rmse': None})
 
+    return JSONObject({'count'       : len(differences),
+                       'max_abs_diff': float(differences.max()),
+                       'rmse'        : float(np.sqrt(np.mean(differences ** 2)))})
 
-def compare_scenarios(scenario_id_1, scenario_id_2,**kwargs):
+def iter_scenario_diff(scenario_id_1, scenario_id_2, include_deltas='N', chunk_size=None, **kwargs):
+    """
+        Stream the differences between the data of two scenarios in the same network.
+        The comparison is done by the database, a chunk of resource attributes at a time.
+        args:
+            scenario_id_1, scenario_id_2 (int): The scenarios to compare
+            include_deltas (char): 'Y' to compare the values of numeric datasets which
+                                   are in both scenarios. See _get_value_delta.
+            chunk_size (int): The maximum number of differences in each chunk. Defaults to
+                              the 'stream_chunk_size' setting in the 'db' section of the config.
+        Yields lists of dicts, with the resource_attr_id, scenario_1_dataset,
+        scenario_2_dataset and, if include_deltas is 'Y', the delta between
+        the values. A dataset is None if the scenario has no data for that
+        resource attribute.
+    """
     user_id = kwargs.get('user_id')
 
     scenario_1 = _get_scenario(scenario_id_1, user_id)
     scenario_2 = _get_scenario(scenario_id_2, user_id)
 
-    scenario_1_rs = db.DBSession.query(ResourceScenario).filter(ResourceScenario.scenario_id==scenario_id_1).all()
-    scenario_2_rs = db.DBSession.query(ResourceScenario).filter(ResourceScenario.scenario_id==scenario_id_2).all()
-    scenario_1_rgi = db.DBSession.query(ResourceGroupItem).filter(ResourceGroupItem.scenario_id==scenario_id_1).all()
-    scenario_2_rgi = db.DBSession.query(ResourceGroupItem).filter(ResourceGroupItem.scenario_id==scenario_id_2).all()
-
     if scenario_1.network_id != scenario_2.network_id:
         raise HydraError("Cannot compare scenarios that are not"
                          " in the same network!")
 
-    scenariodiff = dict(
-       object_type = 'ScenarioDiff'
-    )
-    resource_diffs = []
+    if chunk_size is None:
+        chunk_size = config.getint('db', 'stream_chunk_size', 500)
+    chunk_size = int(chunk_size)
 
-    #Make a list of all the resource scenarios (aka data) that are unique
-    #to scenario 1 and that are in both scenarios, but are not the same.
-
-    #For efficiency, build a dictionary of the data in scenarios and refer
-    #them rather than nesting for loops.
-    r_scen_1_dict = dict()
-    r_scen_2_dict = dict()
-    for s1_rs in scenario_1_rs:
-        r_scen_1_dict[s1_rs.resource_attr_id] = s1_rs
-    for s2_rs in scenario_2_rs:
-        r_scen_2_dict[s2_rs.resource_attr_id] = s2_rs
-
-    rscen_1_dataset_ids = set([r_scen.dataset_id for r_scen in scenario_1_rs])
-    rscen_2_dataset_ids = set([r_scen.dataset_id for r_scen in scenario_2_rs])
-
-    log.info("Datasets In 1 not in 2: %s"%(rscen_1_dataset_ids - rscen_2_dataset_ids))
-    log.info("Datasets In 2 not in 1: %s"%(rscen_2_dataset_ids - rscen_1_dataset_ids))
-
-    for ra_id, s1_rs in r_scen_1_dict.items():
-        s2_rs = r_scen_2_dict.get(ra_id)
-        if s2_rs is not None:
-            log.debug("Is %s == %s?"%(s1_rs.dataset_id, s2_rs.dataset_id))
-            if s1_rs.dataset_id != s2_rs.dataset_id:
-                resource_diff = dict(
-                    resource_attr_id = s1_rs.resource_attr_id,
-                    scenario_1_dataset = _get_as_obj(_get_dataset_as_dict(s1_rs, user_id), 'Dataset'),
-                    scenario_2_dataset = _get_as_obj(_get_dataset_as_dict(s2_rs, user_id), 'Dataset'),
-                )
-                resource_diffs.append(resource_diff)
+    last_ra_id = None
+    while True:
+        diff_qry = _get_scenario_diff_qry(scenario_1, scenario_2, last_ra_id).limit(chunk_size)
+        rows = db.DBSession.execute(diff_qry).fetchall()
 
-            continue
-        else:
-            resource_diff = dict(
-                resource_attr_id = s1_rs.resource_attr_id,
-                scenario_1_dataset = _get_as_obj(_get_dataset_as_dict(s1_rs, user_id), 'Dataset'),
-                scenario_2_dataset = None,
-            )
-            resource_diffs.append(resource_diff)
+        if len(rows) == 0:
+            return
 
-    #make a list of all the resource scenarios (aka data) that are unique
-    #in scenario 2.
-    for ra_id, s2_rs in r_scen_2_dict.items():
-        s1_rs = r_scen_1_dict.get(ra_id)
-        if s1_rs is None:
+        dataset_ids = set(r.dataset_id_1 for r in rows) | set(r.dataset_id_2 for r in rows)
+        dataset_ids.discard(None)
+        datasets = _get_diff_datasets(dataset_ids, user_id)
+
+        resource_diffs = []
+        for row in rows:
             resource_diff = dict(
-                resource_attr_id = s1_rs.resource_attr_id,
-                scenario_1_dataset = None,
-                scenario_2_dataset = _get_as_obj(_get_dataset_as_dict(s2_rs, user_id), 'Dataset'),
+                resource_attr_id   = row.resource_attr_id,
+                scenario_1_dataset = datasets.get(row.dataset_id_1),
+                scenario_2_dataset = datasets.get(row.dataset_id_2),
             )
+            if include_deltas == 'Y':
+                resource_diff['delta'] = _get_value_delta(resource_diff['scenario_1_dataset'],
+                                                          resource_diff['scenario_2_dataset'])
             resource_diffs.append(resource_diff)
 
+        yield resource_diffs
+
+        if len(rows) < chunk_size:
+            return
+
+        last_ra_id = rows[-1].resource_attr_id
+
+def compare_scenarios(scenario_id_1, scenario_id_2, include_deltas='N', **kwargs):
+    """
+        Compare the data and group items of two scenarios in the same network.
+        The differences in data are found as in iter_scenario_diff, which
+        should be used instead for very large scenarios.
+    """
+    user_id = kwargs.get('user_id')
+
+    #The group items of each scenario include what it shares as a copy-on-write clone
+    scenario_1_rgi = _get_scenario(scenario_id_1, user_id).filter_group_items(
+        db.DBSession.query(ResourceGroupItem)).all()
+    scenario_2_rgi = _get_scenario(scenario_id_2, user_id).filter_group_items(
+        db.DBSession.query(ResourceGroupItem)).all()
+
+    scenariodiff = dict(
+       object_type = 'ScenarioDiff'
+    )
+
+    #Make a list of all the resource scenarios (aka data) that are unique
+    #to either scenario and that are in both scenarios, but are not the same.
+    resource_diffs = []
+    for chunk in iter_scenario_diff(scenario_id_1,
+                                    scenario_id_2,
+                                    include_deltas=include_deltas,
+                                    user_id=user_id):
+        resource_diffs.extend(chunk)
+
+    log.info("%s differences in data", len(resource_diffs))
+
     scenariodiff['resourcescenarios'] = resource_diffs
 
     #Now compare groups.
@@ -740,21 +1154,27 @@ def bulk_update_resourcedata(scenario_ids, resource_scenarios,**kwargs):
 
     for scenario_id in scenario_ids:
         _check_can_edit_scenario(scenario_id, kwargs['user_id'])
+        _materialize_copies(scenario_id,
+                            flatten=any(rs.dataset is None for rs in resource_scenarios))
 
         scen_i = _get_scenario(scenario_id, user_id)
-        #this is cast as a string so it can be read into a JSONObject
-        res[str(scenario_id)] = []
-
+        rs_to_update = []
         for rs in resource_scenarios:
             if rs.dataset is not None:
-                updated_rs = _update_resourcescenario(scen_i, rs, user_id=user_id, source=kwargs.get('app_name'))
-                #this is cast as a string so it can be read into a JSONObject
-                res[str(scenario_id)].append(updated_rs)
+                rs_to_update.append(rs)
             else:
                 _delete_resourcescenario(scenario_id, rs.resource_attr_id)
 
+        #this is cast as a string so it can be read into a JSONObject
+        res[str(scenario_id)] = _bulk_update_resourcescenarios(scen_i,
+                                                              rs_to_update,
+                                                              user_id=user_id,
+                                                              source=kwargs.get('app_name'))
+
         db.DBSession.flush()
 
+    invalidate_network(net_ids[0].network_id)
+
     return res
 
 def update_resourcedata(scenario_id, resource_scenarios,**kwargs):
@@ -778,19 +1198,27 @@ def update_resourcedata(scenario_id, resource_scenarios,**kwargs):
     res = None
 
     _check_can_edit_scenario(scenario_id, kwargs['user_id'])
+    _materialize_copies(scenario_id,
+                        flatten=any(rs.dataset is None for rs in resource_scenarios))
 
     scen_i = _get_scenario(scenario_id, user_id)
 
-    res = []
+    rs_to_update = []
     for rs in resource_scenarios:
         if rs.dataset is not None:
-            updated_rs = _update_resourcescenario(scen_i, rs, user_id=user_id, source=kwargs.get('app_name'))
-            res.append(updated_rs)
+            rs_to_update.append(rs)
         else:
             _delete_resourcescenario(scenario_id, rs.resource_attr_id)
 
+    res = _bulk_update_resourcescenarios(scen_i,
+                                         rs_to_update,
+                                         user_id=user_id,
+                                         source=kwargs.get('app_name'))
+
     db.DBSession.flush()
 
+    invalidate_network(scen_i.network_id)
+
     return res
 
 def delete_resource_scenario(scenario_id, resource_attr_id, quiet=False, **kwargs):
@@ -798,6 +1226,7 @@ def delete_resource_scenario(scenario_id, resource_attr_id, quiet=False, **kwarg
         Remove the data associated with a resource in a scenario.
     """
     _check_can_edit_scenario(scenario_id, kwargs['user_id'])
+    _materialize_copies(scenario_id, flatten=True)
 
     _delete_resourcescenario(scenario_id, resource_attr_id, suppress_error=quiet)
 
@@ -809,6 +1238,7 @@ def delete_resource_scenarios(scenario_id, resource_attr_ids, quiet=False, **kwa
     log.info("Deleting %s resource scenarios from from scenario %s", len(resource_attr_ids), scenario_id)
 
     _check_can_edit_scenario(scenario_id, kwargs['user_id'])
+    _materialize_copies(scenario_id, flatten=True)
 
     for resource_attr_id in resource_attr_ids:
         _delete_resourcescenario(scenario_id, resource_attr_id, suppress_error=quiet)
@@ -822,6 +1252,7 @@ def delete_resourcedata(scenario_id, resource_scenario, quiet = False, **kwargs)
 
 
     _check_can_edit_scenario(scenario_id, kwargs['user_id'])
+    _materialize_copies(scenario_id, flatten=True)
 
     _delete_resourcescenario(scenario_id, resource_scenario.resource_attr_id, suppress_error=quiet)
 
@@ -907,6 +1338,238 @@ def _update_resourcescenario(scenario, resource_scenario, dataset=None, new=Fals
                  source=source)
     return r_scen_i
 
+def _bulk_update_resourcescenarios(scenario, resource_scenarios, user_id=None, source=None):
+    """
+        Insert or update the values of many resource scenarios in a scenario,
+        with the same outcome as calling _update_resourcescenario for each one,
+        but with a fixed number of queries, rather than several per item:
+
+            1: The existing resource scenarios are retrieved in one query
+            2: The incoming values are parsed and hashed. Unchanged values are skipped.
+            3: Datasets used only by the resource scenario being changed
+               are updated in place, as in assign_value. Other values are
+               inserted (or matched to existing datasets) using data._insert_datasets
+            4: The resource scenarios are inserted or updated using executemany
+
+        returns a list of ResourceScenario objects, one per incoming resource
+        scenario, (None for any whose value can not be parsed).
+    """
+
+    if len(resource_scenarios) == 0:
+        return []
+
+    #Make sure everything in the session is in the DB, as the rest of this
+    #function bypasses the ORM.
+    db.DBSession.flush()
+
+    ra_ids = list(set([rs.resource_attr_id for rs in resource_scenarios]))
+
+    existing_rs = {}
+    with in_keys(ResourceScenario.resource_attr_id, ra_ids) as ra_filter:
+        rs_qry = db.DBSession.query(ResourceScenario.resource_attr_id,
+                                    ResourceScenario.dataset_id,
+                                    Dataset.hash).filter(
+                                        ResourceScenario.dataset_id == Dataset.id,
+                                        ResourceScenario.scenario_id == scenario.id,
+                                        ra_filter)
+        for rs in rs_qry:
+            existing_rs[rs.resource_attr_id] = rs
+
+    if scenario.locked == 'Y':
+        log.info("Scenario %s is locked", scenario.id)
+        rs_map = _get_resourcescenarios(scenario.id, existing_rs.keys())
+        return [rs_map.get(rs.resource_attr_id) for rs in resource_scenarios]
+
+    #The new value of each resource attribute whose value has changed.
+    changed_data = {}
+    #The resource attributes whose value can not be set
+    unset_ra_ids = set()
+    for rs in resource_scenarios:
+        dataset = rs.dataset
+
+        value = dataset.parse_value()
+
+        if value is None:
+            log.info("Cannot set data on resource attribute %s", rs.resource_attr_id)
+            unset_ra_ids.add(rs.resource_attr_id)
+            continue
+
+        metadata = dataset.get_metadata_as_dict(source=source, user_id=user_id)
+        data_hash = dataset.get_hash(value, metadata)
+
+        existing = existing_rs.get(rs.resource_attr_id)
+        if existing is not None and existing.hash == data_hash:
+            log.debug("Dataset has not changed.")
+            continue
+
+        changed_data[rs.resource_attr_id] = {'name'      : dataset.name,
+                                             'type'      : dataset.type.lower(),
+                                             'unit_id'   : dataset.unit_id,
+                                             'value'     : value,
+                                             'metadata'  : metadata,
+                                             'hash'      : data_hash,
+                                             'created_by': user_id}
+
+    existing_data = data._get_existing_data(set([d['hash'] for d in changed_data.values()]))
+
+    #Datasets which are only used by the resource scenario which is being
+    #changed can be updated in place, as in assign_value
+    old_dataset_ids = [existing_rs[ra_id].dataset_id for ra_id in changed_data if ra_id in existing_rs]
+    dataset_use_count = {}
+    with in_keys(ResourceScenario.dataset_id, old_dataset_ids) as dataset_filter:
+        count_qry = db.DBSession.query(ResourceScenario.dataset_id,
+                                       func.count(ResourceScenario.scenario_id)).filter(
+                                           dataset_filter
+                                       ).group_by(ResourceScenario.dataset_id)
+        for dataset_id, use_count in count_qry:
+            dataset_use_count[dataset_id] = use_count
+
+    hash_dataset_id_map = {}
+    datasets_to_update = {}
+    datasets_to_insert = {}
+    for ra_id, dataset_dict in changed_data.items():
+        data_hash = dataset_dict['hash']
+        existing = existing_rs.get(ra_id)
+        if data_hash in hash_dataset_id_map or data_hash in datasets_to_insert:
+            continue
+        elif data_hash not in existing_data and existing is not None \
+                and dataset_use_count.get(existing.dataset_id) == 1:
+            datasets_to_update[existing.dataset_id] = dataset_dict
+            hash_dataset_id_map[data_hash] = existing.dataset_id
+        else:
+            datasets_to_insert[data_hash] = dataset_dict
+
+    if len(datasets_to_update) > 0:
+        log.info("Updating %s datasets", len(datasets_to_update))
+        _update_datasets(datasets_to_update)
+
+    if len(datasets_to_insert) > 0:
+        log.info("Inserting %s datasets", len(datasets_to_insert))
+        inserted_datasets = data._insert_datasets(datasets_to_insert,
+                                                  user_id=user_id,
+                                                  existing_data=existing_data)
+        for data_hash, dataset in inserted_datasets.items():
+            hash_dataset_id_map[data_hash] = dataset.id
+
+    new_rs = []
+    updated_rs = []
+    for ra_id, dataset_dict in changed_data.items():
+        rs_dict = {'b_scenario_id'      : scenario.id,
+                   'b_resource_attr_id' : ra_id,
+                   'b_dataset_id'       : hash_dataset_id_map[dataset_dict['hash']],
+                   'b_source'           : source}
+        if ra_id in existing_rs:
+            updated_rs.append(rs_dict)
+        else:
+            new_rs.append(rs_dict)
+
+    _upsert_resourcescenarios(new_rs, updated_rs)
+
+    rs_map = _get_resourcescenarios(scenario.id, ra_ids)
+
+    return [rs_map.get(rs.resource_attr_id) if rs.resource_attr_id not in unset_ra_ids else None
+            for rs in resource_scenarios]
+
+def _update_datasets(datasets_to_update):
+    """
+        Update datasets in place, replacing their metadata. As in
+        Dataset.set_metadata, which the ORM path used, keys which are not
+        in the new metadata are removed, so the stored metadata is the
+        metadata the new hash was made from.
+        args:
+            datasets_to_update (dict): Dataset dicts, keyed on the ID of the dataset to update
+    """
+    dataset_ids = list(datasets_to_update.keys())
+
+    update_qry = Dataset.__table__.update().where(
+        Dataset.__table__.c.id == bindparam('b_id')).values(
+            name       = bindparam('b_name'),
+            type       = bindparam('b_type'),
+            unit_id    = bindparam('b_unit_id'),
+            value      = bindparam('b_value'),
+            hash       = bindparam('b_hash'),
+            created_by = bindparam('b_created_by'))
+
+    db.DBSession.execute(update_qry, [{'b_id'        : dataset_id,
+                                       'b_name'      : d['name'],
+                                       'b_type'      : d['type'],
+                                       'b_unit_id'   : d['unit_id'],
+                                       'b_value'     : encode_value(d['value'], d['type']),
+                                       'b_hash'      : d['hash'],
+                                       'b_created_by': d['created_by']}
+                                      for dataset_id, d in datasets_to_update.items()])
+
+    with in_keys(Metadata.__table__.c.dataset_id, dataset_ids) as dataset_filter:
+        db.DBSession.execute(Metadata.__table__.delete().where(dataset_filter))
+
+    data._insert_metadata(dict((d['hash'], d['metadata']) for d in datasets_to_update.values()),
+                          dict((d['hash'], JSONObject({'id': dataset_id}))
+                               for dataset_id, d in datasets_to_update.items()))
+
+def _upsert_resourcescenarios(new_rs, updated_rs):
+    """
+        Insert and update resource scenarios, using executemany.
+        The dicts in new_rs and updated_rs have keys b_scenario_id,
+        b_resource_attr_id, b_dataset_id and b_source.
+
+        On MySQL this is done in a single INSERT ... ON DUPLICATE KEY UPDATE.
+        Other databases do an UPDATE for the existing resource
+        scenarios and an INSERT for the new ones.
+    """
+    rs_table = ResourceScenario.__table__
+
+    if db.DBSession.bind.dialect.name == 'mysql':
+        all_rs = new_rs + updated_rs
+        if len(all_rs) > 0:
+            upsert_qry = mysql_insert(rs_table).values(
+                scenario_id      = bindparam('b_scenario_id'),
+                resource_attr_id = bindparam('b_resource_attr_id'),
+                dataset_id       = bindparam('b_dataset_id'),
+                source           = bindparam('b_source'))
+            upsert_qry = upsert_qry.on_duplicate_key_update(
+                dataset_id = upsert_qry.inserted.dataset_id,
+                source     = upsert_qry.inserted.source)
+            db.DBSession.execute(upsert_qry, all_rs)
+    else:
+        if len(updated_rs) > 0:
+            update_qry = rs_table.update().where(and_(
+                rs_table.c.scenario_id == bindparam('b_scenario_id'),
+                rs_table.c.resource_attr_id == bindparam('b_resource_attr_id'))).values(
+                    dataset_id = bindparam('b_dataset_id'),
+                    source     = bindparam('b_source'))
+            db.DBSession.execute(update_qry, updated_rs)
+
+        if len(new_rs) > 0:
+            insert_qry = rs_table.insert().values(
+                scenario_id      = bindparam('b_scenario_id'),
+                resource_attr_id = bindparam('b_resource_attr_id'),
+                dataset_id       = bindparam('b_dataset_id'),
+                source           = bindparam('b_source'))
+            db.DBSession.execute(insert_qry, new_rs)
+
+    #These statements bypass the ORM, so the transaction manager must be
+    #told there is something to commit, and any resource scenarios already
+    #loaded in the session are out of date.
+    mark_changed(db.DBSession())
+    db.DBSession.expire_all()
+
+def _get_resourcescenarios(scenario_id, ra_ids):
+    """
+        Get the resource scenarios for the given resource attributes
+        in a scenario, with their datasets, keyed on resource attribute ID.
+    """
+    ra_ids = list(ra_ids)
+    rs_map = {}
+    with in_keys(ResourceScenario.resource_attr_id, ra_ids) as ra_filter:
+        rs_qry = db.DBSession.query(ResourceScenario).options(
+            joinedload('dataset')).filter(
+                ResourceScenario.scenario_id == scenario_id,
+                ra_filter)
+        for rs in rs_qry:
+            rs_map[rs.resource_attr_id] = rs
+
+    return rs_map
+
 def assign_value(rs, data_type, val,
                  unit_id, name, metadata={}, data_hash=None, user_id=None, source=None):
     """
@@ -974,6 +1637,7 @@ def add_data_to_attribute(scenario_id, resource_attr_id, dataset,**kwargs):
     user_id = kwargs.get('user_id')
 
     _check_can_edit_scenario(scenario_id, user_id)
+    _materialize_copies(scenario_id)
 
     scenario_i = _get_scenario(scenario_id, user_id)
 
@@ -1214,10 +1878,11 @@ def delete_resourcegroupitems(scenario_id, item_ids, **kwargs):
     user_id = int(kwargs.get('user_id'))
     #check the scenario exists
     _get_scenario(scenario_id, user_id)
+    _materialize_copies(scenario_id, flatten=True)
     for item_id in item_ids:
         rgi = db.DBSession.query(ResourceGroupItem).\
                 filter(ResourceGroupItem.id==item_id).one()
-        db.DBSession.delete(rgi)
+        db.DBSession.delete(_get_scenario_group_item(rgi, scenario_id))
 
     db.DBSession.flush()
 
@@ -1228,6 +1893,7 @@ def empty_group(group_id, scenario_id, **kwargs):
     user_id = int(kwargs.get('user_id'))
     #check the scenario exists
     _get_scenario(scenario_id, user_id)
+    _materialize_copies(scenario_id, flatten=True)
 
     rgi = db.DBSession.query(ResourceGroupItem).\
             filter(ResourceGroupItem.group_id==group_id).\
@@ -1246,6 +1912,8 @@ def add_resourcegroupitems(scenario_id, items, scenario=None, **kwargs):
 
     _check_network_ownership(scenario.network_id, user_id)
 
+    _materialize_copies(scenario.id, flatten=True)
+
     newitems = []
     for group_item in items:
         group_item_i = _add_resourcegroupitem(group_item, scenario.id)
@@ -1264,6 +1932,7 @@ def _add_resourcegroupitem(group_item, scenario_id):
             group_item_i = db.DBSession.query(ResourceGroupItem).filter(ResourceGroupItem.id == group_item.id).one()
         except NoResultFound:
             raise ResourceNotFoundError("ResourceGroupItem %s not found" % (group_item.id))
+        group_item_i = _get_scenario_group_item(group_item_i, scenario_id)
 
     else:
         group_item_i = ResourceGroupItem()
@@ -1284,6 +1953,25 @@ def _add_resourcegroupitem(group_item, scenario_id):
 
     return group_item_i
 
+def _get_scenario_group_item(group_item_i, scenario_id):
+    """
+        A flattened copy-on-write clone has its own copies of the group items
+        it shared, with new IDs. If a group item is not in the scenario, get
+        the scenario's copy of it, if it has one.
+    """
+    if scenario_id is None or group_item_i.scenario_id == scenario_id:
+        return group_item_i
+
+    scenario_item_i = db.DBSession.query(ResourceGroupItem).filter(
+        ResourceGroupItem.scenario_id == scenario_id,
+        ResourceGroupItem.group_id == group_item_i.group_id,
+        ResourceGroupItem.ref_key == group_item_i.ref_key,
+        ResourceGroupItem.node_id == group_item_i.node_id,
+        ResourceGroupItem.link_id == group_item_i.link_id,
+        ResourceGroupItem.subgroup_id == group_item_i.subgroup_id).first()
+
+    return scenario_item_i if scenario_item_i is not None else group_item_i
+
 def update_value_from_mapping(source_resource_attr_id, target_resource_attr_id, source_scenario_id, target_scenario_id, **kwargs):
     """
         Using a resource attribute mapping, take the value from the source and apply
@@ -1316,6 +2004,9 @@ def update_value_from_mapping(source_resource_attr_id, target_resource_attr_id,
     s1 = _get_scenario(source_scenario_id, user_id)
     s2 = _get_scenario(target_scenario_id, user_id)
 
+    #The target's data is removed if the source has none
+    _materialize_copies(target_scenario_id, flatten=True)
+
     rs = aliased(ResourceScenario, name='rs')
     rs1 = db.DBSession.query(rs).filter(rs.resource_attr_id == source_resource_attr_id,
                                     rs.scenario_id == source_scenario_id).first()
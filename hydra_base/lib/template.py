@@ -25,6 +25,7 @@ from .data import add_dataset
 from ..exceptions import HydraError, ResourceNotFoundError
 from ..import config
 from ..util import dataset_util, get_layout_as_string, get_layout_as_dict
+from ..util import jsonutil
 from lxml import etree
 from decimal import Decimal
 import logging
@@ -358,7 +359,7 @@ def get_template_as_json(template_id, **kwargs):
         string. This is just a wrapper around the get_template_as_dict function.
     """
     user_id = kwargs['user_id']
-    return json.dumps(get_template_as_dict(template_id, user_id=user_id))
+    return jsonutil.dumps(get_template_as_dict(template_id, user_id=user_id))
 
 @required_perms("get_template")
 def get_template_as_dict(template_id, **kwargs):
@@ -479,7 +480,7 @@ def import_template_json(template_json_string, allow_update=True, **kwargs):
     user_id = kwargs.get('user_id')
 
     try:
-        template_dict = json.loads(template_json_string)
+        template_dict = jsonutil.loads(template_json_string)
     except:
         raise HydraError("Unable to parse JSON string. Plese ensure it is JSON compatible.")
 
@@ -516,7 +517,7 @@ def import_template_dict(template_dict, allow_update=True, **kwargs):
     template_layout = None
     if template_j.layout is not None:
         if isinstance(template_j.layout, dict):
-            template_layout = json.dumps(template_j.layout)
+            template_layout = jsonutil.dumps(template_j.layout)
         else:
             template_layout = template_j.layout
 
@@ -603,7 +604,7 @@ def import_template_dict(template_dict, allow_update=True, **kwargs):
 
         if type_j.layout is not None:
             if isinstance(type_j, dict):
-                type_i.layout = json.dumps(type_j.layout)
+                type_i.layout = jsonutil.dumps(type_j.layout)
             else:
                 type_i.layout = type_j.layout
 
@@ -690,7 +691,7 @@ def import_template_xml(template_xml, allow_update=True, **kwargs):
                xml_tree.find('layout').text is not None:
         layout = xml_tree.find('layout')
         layout_string = get_etree_layout_as_dict(layout)
-        template_layout = json.dumps(layout_string)
+        template_layout = jsonutil.dumps(layout_string)
 
     try:
         tmpl_i = db.DBSession.query(Template).filter(Template.name == template_name)\
@@ -763,7 +764,7 @@ def import_template_xml(template_xml, allow_update=True, **kwargs):
             resource.find('layout').text is not None:
             layout = resource.find('layout')
             layout_string = get_etree_layout_as_dict(layout)
-            type_i.layout = json.dumps(layout_string)
+            type_i.layout = jsonutil.dumps(layout_string)
 
         #delete any TypeAttrs which are in the DB but not in the XML file
         existing_attrs = []
@@ -1407,7 +1408,7 @@ def _parse_data_restriction(restriction_dict):
     if isinstance(restriction_dict, dict):
         new_dict = restriction_dict
     else:
-        new_dict = json.loads(restriction_dict)
+        new_dict = jsonutil.loads(restriction_dict)
 
     #Evaluate whether the dict actually contains anything.
     if not isinstance(new_dict, dict) or len(new_dict) == 0:
@@ -1934,7 +1935,7 @@ def _do_validate_resourcescenario(resourcescenario, template_id=None, **kwargs):
             if ta.attr_id == resourcescenario.resourceattr.attr_id:
                 if ta.data_restriction:
                     log.debug("Validating against %s", ta.data_restriction)
-                    validation_dict = json.loads(ta.data_restriction)
+                    validation_dict = jsonutil.loads(ta.data_restriction)
                     dataset_util.validate_value(validation_dict, dataset.get_val())
 
 @required_perms('get_network')
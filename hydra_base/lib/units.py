@@ -30,6 +30,7 @@ from ..util.dataset_util import arr_to_vector
 from ..util.dataset_util import vector_to_arr
 from ..db.model import Dataset, Unit, Dimension
 from .objects import JSONObject
+from .HydraTypes.Types import Tensor
 from ..exceptions import HydraError, ResourceNotFoundError, ValidationError
 
 from ..util.permissions import required_perms
@@ -577,6 +578,9 @@ def convert_dataset(dataset_id, target_unit_abbreviation,**kwargs):
             vecdata = arr_to_vector(dsval)
             newvec = convert(vecdata, source_unit_abbreviation, target_unit_abbreviation)
             new_val = vector_to_arr(newvec, dim)
+        elif dataset_type == 'tensor':
+            newvec = convert(dsval.ravel().tolist(), source_unit_abbreviation, target_unit_abbreviation)
+            new_val = Tensor(numpy.array(newvec).reshape(dsval.shape)).value
         elif dataset_type == 'timeseries':
             new_val = []
             for ts_time, ts_val in dsval.items():
@@ -723,7 +727,11 @@ def validate_resource_attributes(resource, attributes, template, check_unit=True
 
             if tmpl_attr.get('data_type') is not None:
                 if res_attr.get('type') is not None:
-                    if tmpl_attr.get('data_type') != res_attr.get('type'):
+                    #Regular timeseries and tensors are stored differently, but are
+                    #still timeseries and arrays
+                    if tmpl_attr.get('data_type') != res_attr.get('type') and \
+                            (tmpl_attr.get('data_type'), res_attr.get('type')) not in \
+                            (('timeseries', 'regular_timeseries'), ('array', 'tensor')):
                         errors.append("Error in data. Template says that %s on %s is a %s, but data suggests it is a %s"%
                             (attr['name'], resource['name'], tmpl_attr.get('data_type'), res_attr.get('type')))
 
@@ -21,11 +21,16 @@ import logging
 log = logging.getLogger(__name__)
 
 from decimal import Decimal
+import numpy as np
 import pandas as pd
 
 import json
 import six
+import hashlib
+import struct
 from .. import config
+from ..exceptions import HydraError
+from . import jsonutil
 
 from collections import namedtuple
 
@@ -106,29 +111,224 @@ def to_named_tuple(keys, values):
 
     return tuple_instance
 
+RESULT_FORMATS = ('json', 'columnar', 'dataframe', 'arrow')
+
+def _column_to_array(values):
+    """
+        Turn a column of values into a numpy array. Numeric and decimal
+        columns get a native dtype. Anything else (strings, dates, columns
+        containing nulls) is kept as an object array, to avoid numpy padding
+        every string to the length of the longest one.
+    """
+    arr = None
+    if len(values) == 0 or not isinstance(values[0], six.string_types):
+        try:
+            arr = np.array(values)
+        except ValueError:
+            pass
+
+    if arr is not None and arr.dtype.kind in 'biuf':
+        return arr
+
+    #Coordinates are stored as decimals.
+    if len(values) > 0 and isinstance(values[0], Decimal):
+        try:
+            return np.array(values, dtype=float)
+        except TypeError:
+            pass
+
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+
+def rows_to_columns(keys, rows, result_format='columnar'):
+    """
+        Convert the rows of a query result into a struct-of-arrays, without
+        building an object per row.
+
+        args:
+            keys (list): The column names of the result
+            rows (list): The result rows (tuples or row proxies)
+            result_format (string): See format_columns
+    """
+    keys = list(keys)
+
+    if len(rows) > 0:
+        columns = [list(c) for c in zip(*rows)]
+    else:
+        columns = [[] for k in keys]
+
+    columns = dict((k, _column_to_array(c)) for k, c in zip(keys, columns))
+
+    return format_columns(columns, result_format)
+
+def format_columns(columns, result_format='columnar'):
+    """
+        Convert a dict of numpy arrays, as built by rows_to_columns,
+        into the requested result format:
+            'columnar':  The dict of numpy arrays, keyed on column name
+            'dataframe': A pandas dataframe
+            'arrow':     A pyarrow table (requires pyarrow to be installed)
+    """
+    if result_format == 'columnar':
+        return columns
+    elif result_format == 'dataframe':
+        return pd.DataFrame(columns)
+    elif result_format == 'arrow':
+        try:
+            import pyarrow
+        except ImportError:
+            raise HydraError("The 'arrow' result format requires pyarrow to be installed.")
+        return pyarrow.table(columns)
+    else:
+        raise HydraError("Unrecognised result format %s. Must be one of %s"%
+                         (result_format, RESULT_FORMATS))
+
+def filter_columns(columns, mask):
+    """
+        Apply a boolean mask to every column of a result returned by
+        rows_to_columns, in whichever format it was returned.
+    """
+    if isinstance(columns, dict):
+        return dict((k, v[mask]) for k, v in columns.items())
+    elif isinstance(columns, pd.DataFrame):
+        return columns[mask].reset_index(drop=True)
+    else:
+        import pyarrow
+        return columns.filter(pyarrow.array(mask))
+
+def get_column(columns, key):
+    """
+        Get a single column, as a numpy array, from a result returned by
+        rows_to_columns, in whichever format it was returned.
+    """
+    if isinstance(columns, dict):
+        return columns[key]
+    elif isinstance(columns, pd.DataFrame):
+        return columns[key].values
+    else:
+        return columns.column(key).to_numpy()
+
 
 
+def _canonical_bytes(value):
+    """
+        Encode a dataset field as bytes for hashing. Strings, which includes
+        the values of large timeseries and arrays, are encoded directly,
+        without being copied into a larger formatted string. Dicts are
+        dumped with sorted keys so the hash does not depend on key order.
+    """
+    if value is None:
+        return b''
+    elif isinstance(value, bytes):
+        return value
+    elif isinstance(value, six.string_types):
+        return value.encode('utf-8')
+    elif isinstance(value, dict):
+        return json.dumps(value, sort_keys=True, default=str).encode('utf-8')
+    else:
+        return str(value).encode('utf-8')
+
 def generate_data_hash(dataset_dict):
+    """
+        Generate a 64 bit hash of the name, unit, type, value and metadata
+        of a dataset. Unlike the builtin hash(), which is salted per process,
+        this is stable across processes and python versions, so identical
+        datasets inserted by different processes are deduplicated.
+        The hash is a signed integer, to fit in the BIGINT hash column.
+    """
 
     d = dataset_dict
     if d.get('metadata') is None:
         d['metadata'] = {}
 
-    hash_string = "%s %s %s %s %s"%(
-                                str(d['name']),
-                                str(d['unit_id']),
-                                str(d['type']),
-                                d['value'],
-                                d['metadata'])
+    hasher = hashlib.blake2b(digest_size=8)
+    for field in (d['name'], d['unit_id'], d['type'], d['value'], d['metadata']):
+        field_bytes = _canonical_bytes(field)
+        #Prefix each field with its length so that the boundary between
+        #fields is unambiguous.
+        hasher.update(struct.pack('>Q', len(field_bytes)))
+        hasher.update(field_bytes)
 
-    log.debug("Generating data hash from: %s", hash_string)
-
-    data_hash = hash(hash_string)
+    data_hash = int.from_bytes(hasher.digest(), 'big', signed=True)
 
     log.debug("Data hash: %s", data_hash)
 
     return data_hash
 
+#pd.read_json treats numeric labels at least this large as timestamps
+READ_JSON_MIN_STAMP = 31536000
+
+def _read_timeseries_frame(value):
+    """
+        Load a timeseries which was stored by the FRAME codec straight from its
+        buffers, without parsing its JSON text. The result matches what
+        pd.read_json gives for the JSON text. Returns None if the value was not
+        stored this way, or read_json would convert its labels in a way
+        which is not reproduced here.
+    """
+    frame = getattr(value, 'frame', None)
+    if frame is None or not isinstance(frame.index, pd.DatetimeIndex):
+        return None
+
+    labels = list(frame.columns)
+    if all(l.isdigit() and int(l) < READ_JSON_MIN_STAMP for l in labels):
+        frame.columns = [int(l) for l in labels]
+    elif any(l[:1].isdigit() or l[:1] in '+-.' for l in labels):
+        return None
+
+    #read_json stores floats with no fractional part as ints
+    for col in frame.columns:
+        values = frame[col].values
+        if values.dtype.kind == 'f' and np.isfinite(values).all():
+            int_values = values.astype('int64')
+            if (int_values == values).all():
+                frame[col] = int_values
+
+    return frame
+
+def _decode_timeseries(val, seasonal_key, seasonal_year):
+    """
+        Load the JSON value of a timeseries into a dataframe with a UTC index.
+    """
+    #Seasonal timeseries, with the year seasonal_key, can not be stored
+    #with a date index by the FRAME codec, so are never loaded this way.
+    timeseries = _read_timeseries_frame(val)
+
+    if timeseries is None:
+        val = val.replace(seasonal_key, seasonal_year)
+        timeseries = pd.read_json(val, convert_axes=True)
+
+    return _to_utc(timeseries)
+
+def _decode_regular_timeseries(val):
+    """
+        Load the value of a regular timeseries into a dataframe with a UTC
+        index, with its columns labelled as pd.read_json labels those of
+        a timeseries.
+    """
+    from ..lib.HydraTypes.Types import RegularTimeseries
+    timeseries = RegularTimeseries.fromDataset(val).get_frame()
+
+    labels = list(timeseries.columns)
+    if all(l.isdigit() and int(l) < READ_JSON_MIN_STAMP for l in labels):
+        timeseries.columns = [int(l) for l in labels]
+
+    return _to_utc(timeseries)
+
+def _to_utc(timeseries):
+    """
+        Put the dates of a timeseries dataframe in UTC, assuming they are
+        in UTC already if they have no time zone.
+    """
+    if isinstance(timeseries.index, pd.DatetimeIndex):
+        if timeseries.index.tz is None:
+            timeseries = timeseries.tz_localize('UTC')
+        else:
+            timeseries = timeseries.tz_convert('UTC')
+
+    return timeseries
+
 def get_val(dataset, timestamp=None):
     """
         Turn the string value of a dataset into an appropriate
@@ -148,27 +348,26 @@ def get_val(dataset, timestamp=None):
     """
     if dataset.type == 'array':
         #TODO: design a mechansim to retrieve this data if it's stored externally
-        return json.loads(dataset.value)
+        return jsonutil.loads(dataset.value)
 
+    elif dataset.type == 'tensor':
+        from ..lib.HydraTypes.Types import Tensor
+        return Tensor.fromDataset(dataset.value).get_array()
     elif dataset.type == 'descriptor':
         return str(dataset.value)
     elif dataset.type == 'scalar':
         return Decimal(str(dataset.value))
-    elif dataset.type == 'timeseries':
+    elif dataset.type in ('timeseries', 'regular_timeseries'):
         #TODO: design a mechansim to retrieve this data if it's stored externally
-        val = dataset.value
-
         seasonal_year = config.get('DEFAULT','seasonal_year', '1678')
         seasonal_key = config.get('DEFAULT', 'seasonal_key', '9999')
-        val = dataset.value.replace(seasonal_key, seasonal_year)
 
-        timeseries = pd.read_json(val, convert_axes=True)
-
-        if isinstance(timeseries.index, pd.DatetimeIndex):
-            if timeseries.index.tz is None:
-                timeseries = timeseries.tz_localize('UTC')
-            else:
-                timeseries = timeseries.tz_convert('UTC')
+        from .cache import get_decoded_frame
+        if dataset.type == 'regular_timeseries':
+            decode = _decode_regular_timeseries
+        else:
+            decode = lambda val: _decode_timeseries(val, seasonal_key, seasonal_year)
+        timeseries = get_decoded_frame(dataset.value, decode, seasonal_key, seasonal_year)
 
 
         if timestamp is None:
@@ -234,11 +433,11 @@ def get_layout_as_string(layout):
     """
 
     if isinstance(layout, dict):
-        return json.dumps(layout)
+        return jsonutil.dumps(layout)
 
     if(isinstance(layout, six.string_types)):
         try:
-            return get_layout_as_string(json.loads(layout))
+            return get_layout_as_string(jsonutil.loads(layout))
         except:
             return layout
 
@@ -255,6 +454,6 @@ def get_layout_as_dict(layout):
 
     if(isinstance(layout, six.string_types)):
         try:
-            return get_layout_as_dict(json.loads(layout))
+            return get_layout_as_dict(jsonutil.loads(layout))
         except:
             return layout
@@ -0,0 +1,607 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# (c) Copyright 2013 to 2017 University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Caching of network snapshots.
+
+    A snapshot is the result of a network load (get_network). Snapshots are
+    keyed on the network ID, the options used to load it and a version
+    number for the network, which is bumped every time the network is
+    written to. A global version is also included, which is bumped whenever
+    something shared between networks (datasets, templates, attributes)
+    changes. Stale snapshots are therefore never looked up again, and are
+    eventually evicted.
+
+    Two backends are available, configured in the [cache] section of the config:
+        network_cache = memory: An LRU cache in the current process.
+        network_cache = file:   A directory shared by all processes on a machine,
+                                with an in-process LRU cache in front of it.
+                                The network versions are also stored in this
+                                directory, so a write in one process invalidates
+                                the snapshots of all the others.
+        network_cache = none:   No caching (the default)
+
+    Decoded dataset values are cached separately. Parsing a timeseries from its
+    stored JSON is expensive, so the decoded dataframes are kept in an LRU
+    cache bounded by their size in memory. They are keyed on a digest of the
+    stored value, so a cached value can never be stale. Configured by:
+        value_cache = memory:   An LRU cache in the current process (the default)
+        value_cache = file:     The in-process cache, in front of a directory of
+                                numpy files shared by all the processes on a
+                                machine, which are memory-mapped when read.
+        value_cache = none:     No caching
+"""
+
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import transaction
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from .. import config
+from ..exceptions import HydraError
+
+import logging
+log = logging.getLogger(__name__)
+
+GLOBAL_VERSION = 'global'
+
+class MemoryCache(object):
+    """
+        An in-process LRU cache of pickled values, bounded by the total
+        size of the values it holds, as measured by sizeof.
+    """
+    def __init__(self, max_size, sizeof=len):
+        self.max_size = max_size
+        self.size = 0
+        self.sizeof = sizeof
+        self._items = OrderedDict()
+        self._versions = {}
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value):
+        value_size = self.sizeof(value)
+        if value_size > self.max_size:
+            return
+
+        with self._lock:
+            self.delete(key)
+            self._items[key] = (value, value_size)
+            self.size += value_size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.size -= evicted_size
+
+    def delete(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is not None:
+                self.size -= item[1]
+
+    def get_version(self, name):
+        return self._versions.get(name, 0)
+
+    def bump_version(self, name):
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+class FileCache(object):
+    """
+        A cache of pickled values stored as files in a directory, so it can be
+        shared between processes. Versions are stored as files to which a byte
+        is appended every time the version is bumped, which is atomic across
+        processes, making the version the size of the file.
+    """
+    def __init__(self, directory, max_size):
+        self.directory = os.path.expanduser(directory)
+        self.version_dir = os.path.join(self.directory, 'versions')
+        self.max_size = max_size
+        self._writes = 0
+        os.makedirs(self.version_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def set(self, key, value):
+        if len(value) > self.max_size:
+            return
+
+        #Write to a temporary file first so that other processes never
+        #read a partially written snapshot.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, self._path(key))
+
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def prune(self):
+        """
+            Remove the least recently modified snapshots until the directory
+            is within its maximum size.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(e[1] for e in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                total_size -= size
+            except OSError:
+                pass
+
+    def _version_path(self, name):
+        return os.path.join(self.version_dir, str(name))
+
+    def get_version(self, name):
+        try:
+            return os.stat(self._version_path(name)).st_size
+        except OSError:
+            return 0
+
+    def bump_version(self, name):
+        with open(self._version_path(name), 'ab') as f:
+            f.write(b'.')
+
+class FrameFileCache(FileCache):
+    """
+        A directory of dataframes, shared between processes. The values of a
+        numeric dataframe are stored as a numpy file, which is memory-mapped
+        when it is read, so the processes share one copy in the page cache.
+        The index and columns are pickled alongside it. Dataframes which are
+        not all numeric are not stored.
+    """
+    def _labels_path(self, key):
+        return self._path(key) + '.labels'
+
+    def get(self, key):
+        try:
+            with open(self._labels_path(key), 'rb') as f:
+                index, columns = pickle.load(f)
+            values = np.load(self._path(key) + '.npy', mmap_mode='r')
+        except (IOError, OSError, ValueError, pickle.UnpicklingError, EOFError):
+            return None
+
+        return pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+    def set(self, key, frame):
+        if len(set(frame.dtypes)) > 1:
+            return
+
+        values = frame.values
+        if values.dtype.kind not in 'biuf' or values.nbytes > self.max_size:
+            return
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, values)
+        os.replace(tmp_path, self._path(key) + '.npy')
+
+        #The labels are written last, as their presence marks a complete entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((frame.index, frame.columns), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._labels_path(key))
+
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.prune()
+
+class SnapshotCache(object):
+    """
+        A cache of network snapshots. Values are pickled on the way in and
+        unpickled on the way out, so callers always get their own copy, which
+        they are free to modify. An optional shared backend sits behind the
+        in-process cache and holds the versions if present.
+    """
+    def __init__(self, memory, shared=None):
+        self.memory = memory
+        self.shared = shared
+
+    def _version_store(self):
+        return self.shared if self.shared is not None else self.memory
+
+    def get_version(self, name):
+        return self._version_store().get_version(name)
+
+    def bump_version(self, name):
+        self._version_store().bump_version(name)
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+
+        if value is None:
+            return None
+
+        return pickle.loads(value)
+
+    def set(self, key, value):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self.memory.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+class ValueCache(object):
+    """
+        A cache of decoded dataset values, with an optional shared backend
+        behind the in-process cache. Values are returned as they are stored,
+        so callers must copy them before changing them.
+    """
+    def __init__(self, memory, shared=None):
+        self.memory = memory
+        self.shared = shared
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+def _frame_size(frame):
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+_network_cache = None
+_network_cache_configured = False
+
+def configure_network_cache(backend=None, max_size=None, directory=None):
+    """
+        Set up the network snapshot cache. Any argument not specified
+        is read from the [cache] section of the config.
+        args:
+            backend (string): 'memory', 'file' or 'none'
+            max_size (int): The maximum size of the cache in MB
+            directory (string): The directory used by the 'file' backend
+    """
+    global _network_cache, _network_cache_configured
+
+    if backend is None:
+        backend = config.get('cache', 'network_cache', 'none')
+    if max_size is None:
+        max_size = config.getint('cache', 'network_cache_size', 500)
+    if directory is None:
+        directory = config.get('cache', 'network_cache_dir',
+                               os.path.join(tempfile.gettempdir(), 'hydra_network_cache'))
+
+    max_size = int(max_size) * 1024 * 1024
+
+    backend = backend.lower()
+    if backend == 'none':
+        _network_cache = None
+    elif backend == 'memory':
+        _network_cache = SnapshotCache(MemoryCache(max_size))
+    elif backend == 'file':
+        _network_cache = SnapshotCache(MemoryCache(max_size), FileCache(directory, max_size))
+    else:
+        raise HydraError("Unrecognised network cache backend: %s"%backend)
+
+    if _network_cache is not None and not event.contains(Session, 'after_flush', _invalidate_flushed_networks):
+        event.listen(Session, 'after_flush', _invalidate_flushed_networks)
+
+    _network_cache_configured = True
+
+    return _network_cache
+
+def get_network_cache():
+    """
+        Get the network snapshot cache, or None if caching is disabled.
+    """
+    if _network_cache_configured is False:
+        configure_network_cache()
+
+    return _network_cache
+
+def _network_version_name(network_id):
+    return 'network_%s'%(network_id)
+
+_txn_local = threading.local()
+
+def _get_written_networks():
+    """
+        Get the networks which have been written to in the current transaction.
+    """
+    txn = transaction.get()
+    if getattr(_txn_local, 'transaction', None) is not txn:
+        _txn_local.transaction = txn
+        _txn_local.networks = set()
+    return _txn_local.networks
+
+def _bump_after_commit(status, cache, names):
+    for name in names:
+        cache.bump_version(name)
+
+def _invalidate(names):
+    cache = get_network_cache()
+    if cache is None:
+        return
+
+    for name in names:
+        cache.bump_version(name)
+
+    #Bump the versions again once the transaction has been committed, in case
+    #another process cached a snapshot of the network after this write, but
+    #before it was committed.
+    written = _get_written_networks()
+    new_names = [n for n in names if n not in written]
+    if len(new_names) > 0:
+        written.update(new_names)
+        transaction.get().addAfterCommitHook(_bump_after_commit, args=(cache, new_names))
+
+def invalidate_network(network_id):
+    """
+        Mark all cached snapshots of a network as stale. This must be called
+        by any function which changes a network other than through the ORM
+        (bulk inserts, for example). ORM changes are detected automatically.
+    """
+    if network_id is None:
+        return
+    _invalidate([_network_version_name(network_id)])
+
+def invalidate_all_networks():
+    """
+        Mark all cached snapshots as stale, for changes which can
+        affect any network, such as a change to a dataset.
+    """
+    _invalidate([GLOBAL_VERSION])
+
+def get_network_snapshot_key(network_id, **options):
+    """
+        Build the cache key for a snapshot of a network loaded with the
+        specified options, or None if caching is disabled, or if the network
+        has been written to in the current transaction, in which case its
+        snapshot may contain uncommitted changes.
+    """
+    cache = get_network_cache()
+    if cache is None:
+        return None
+
+    version_name = _network_version_name(network_id)
+    if version_name in _get_written_networks() or GLOBAL_VERSION in _get_written_networks():
+        return None
+
+    option_str = ",".join("%s=%s"%(k, options[k]) for k in sorted(options))
+
+    return "network:%s:%s:%s:%s"%(network_id,
+                                  cache.get_version(version_name),
+                                  cache.get_version(GLOBAL_VERSION),
+                                  option_str)
+
+def get_network_snapshot(key):
+    """
+        Get a snapshot of a network from the cache, or None if it's not there
+    """
+    if key is None:
+        return None
+    return get_network_cache().get(key)
+
+def set_network_snapshot(key, network):
+    """
+        Add a snapshot of a network to the cache.
+    """
+    if key is None:
+        return
+    get_network_cache().set(key, network)
+
+#Tables which belong to a network directly, or via one of its resources or scenarios.
+_NETWORK_TABLES = {
+    'tNetwork':           'id',
+    'tNode':              'network_id',
+    'tLink':              'network_id',
+    'tResourceGroup':     'network_id',
+    'tScenario':          'network_id',
+    'tNetworkOwner':      'network_id',
+}
+_RESOURCE_TABLES = ('tResourceAttr', 'tResourceType')
+_SCENARIO_TABLES = ('tResourceScenario', 'tResourceGroupItem')
+#Tables which are shared between networks. Changes to these can affect any network,
+#except for new datasets, or new rows which only belong to a new dataset.
+_GLOBAL_TABLES = ('tDataset', 'tMetadata', 'tDatasetOwner', 'tAttr',
+                  'tTemplate', 'tTemplateType', 'tTypeAttr')
+_DATASET_TABLES = ('tDataset', 'tMetadata', 'tDatasetOwner')
+
+def _invalidate_flushed_networks(session, flush_context):
+    """
+        Session listener which identifies the networks affected by
+        every ORM change flushed to the database, and invalidates them.
+    """
+    if get_network_cache() is None:
+        return
+
+    from ..db.model import Node, Link, ResourceGroup, Scenario
+
+    new_dataset_ids = set(inspect(obj).dict.get('id') for obj in session.new
+                          if getattr(obj, '__tablename__', None) == 'tDataset')
+
+    changed = list(session.new)
+    changed.extend(obj for obj in session.dirty if session.is_modified(obj))
+    changed.extend(session.deleted)
+
+    network_ids = set()
+    node_ids, link_ids, group_ids, scenario_ids = set(), set(), set(), set()
+    invalidate_global = False
+
+    for obj in changed:
+        tablename = getattr(obj, '__tablename__', None)
+        #Only look at the state which is already loaded, to avoid triggering
+        #any queries on objects which have just been deleted.
+        state = inspect(obj).dict
+
+        if tablename in _NETWORK_TABLES:
+            network_ids.add(state.get(_NETWORK_TABLES[tablename]))
+        elif tablename in _RESOURCE_TABLES:
+            network_ids.add(state.get('network_id'))
+            node_ids.add(state.get('node_id'))
+            link_ids.add(state.get('link_id'))
+            group_ids.add(state.get('group_id'))
+        elif tablename in _SCENARIO_TABLES:
+            scenario_ids.add(state.get('scenario_id'))
+        elif tablename in _GLOBAL_TABLES:
+            if obj in session.new and tablename in _DATASET_TABLES:
+                dataset_id = state.get('id') if tablename == 'tDataset' else state.get('dataset_id')
+                if dataset_id in new_dataset_ids:
+                    continue
+            elif obj in session.new and tablename != 'tTypeAttr':
+                continue
+            invalidate_global = True
+
+    for resource_class, ids in ((Node, node_ids),
+                                (Link, link_ids),
+                                (ResourceGroup, group_ids),
+                                (Scenario, scenario_ids)):
+        ids.discard(None)
+        if len(ids) == 0:
+            continue
+        ids = list(ids)
+        for i in range(0, len(ids), 999):
+            qry = select([resource_class.network_id]).where(resource_class.id.in_(ids[i:i+999]))
+            network_ids.update(r.network_id for r in session.execute(qry))
+
+    network_ids.discard(None)
+
+    names = [_network_version_name(network_id) for network_id in network_ids]
+    if invalidate_global is True:
+        names.append(GLOBAL_VERSION)
+
+    if len(names) > 0:
+        _invalidate(names)
+
+_value_cache = None
+_value_cache_configured = False
+
+def configure_value_cache(backend=None, max_size=None, directory=None):
+    """
+        Set up the cache of decoded dataset values. Any argument not specified
+        is read from the [cache] section of the config.
+        args:
+            backend (string): 'memory', 'file' or 'none'
+            max_size (int): The maximum size of the cache in MB
+            directory (string): The directory used by the 'file' backend
+    """
+    global _value_cache, _value_cache_configured
+
+    if backend is None:
+        backend = config.get('cache', 'value_cache', 'memory')
+    if max_size is None:
+        max_size = config.getint('cache', 'value_cache_size', 100)
+    if directory is None:
+        directory = config.get('cache', 'value_cache_dir',
+                               os.path.join(tempfile.gettempdir(), 'hydra_value_cache'))
+
+    max_size = int(max_size) * 1024 * 1024
+
+    backend = backend.lower()
+    if backend == 'none':
+        _value_cache = None
+    elif backend == 'memory':
+        _value_cache = ValueCache(MemoryCache(max_size, sizeof=_frame_size))
+    elif backend == 'file':
+        _value_cache = ValueCache(MemoryCache(max_size, sizeof=_frame_size),
+                                  FrameFileCache(directory, max_size))
+    else:
+        raise HydraError("Unrecognised value cache backend: %s"%backend)
+
+    _value_cache_configured = True
+
+    return _value_cache
+
+def get_value_cache():
+    """
+        Get the decoded value cache, or None if caching is disabled.
+    """
+    if _value_cache_configured is False:
+        configure_value_cache()
+
+    return _value_cache
+
+def get_value_key(value, *options):
+    """
+        Build the cache key of a stored value, from a digest of its stored
+        payload (or its text), and any options which affect how it is decoded.
+    """
+    payload = getattr(value, 'payload', None)
+    if payload is None:
+        payload = value.encode('utf-8')
+    elif isinstance(payload, str):
+        payload = payload.encode('utf-8')
+
+    digest = hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    return "value:%s:%s"%(digest, ":".join(str(o) for o in options))
+
+def get_decoded_frame(value, decode, *options):
+    """
+        Get a value decoded into a dataframe by decode(value), from the cache
+        if it is there. The caller gets its own copy, which it is free to modify.
+    """
+    cache = get_value_cache()
+    if cache is None:
+        return decode(value)
+
+    key = get_value_key(value, *options)
+    frame = cache.get(key)
+    if frame is None:
+        frame = decode(value)
+        cache.set(key, frame)
+
+    return frame.copy()
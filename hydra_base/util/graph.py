@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# (c) Copyright 2013 to 2017 University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    An in-memory index of the topology of a network.
+
+    Nodes are numbered 0..n-1 in order of their ID. The links are held as
+    two CSR (compressed sparse row) adjacency structures, one from each
+    node to the nodes downstream of it (node_1 -> node_2) and one to the
+    nodes upstream of it, so the neighbours of any set of nodes can be
+    found with array operations rather than by walking ORM relationships.
+"""
+
+import numpy as np
+
+from ..exceptions import HydraError
+
+import logging
+log = logging.getLogger(__name__)
+
+def _build_csr(num_nodes, from_idx, to_idx, link_ids):
+    """
+        Build a CSR adjacency structure. The neighbours of node i are
+        indices[indptr[i]:indptr[i+1]], reached by the links with the IDs in
+        the same slice of links.
+    """
+    order = np.argsort(from_idx, kind='stable')
+    counts = np.bincount(from_idx, minlength=num_nodes)
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return indptr, to_idx[order], link_ids[order]
+
+def _gather(indptr, indices, frontier):
+    """
+        Get the positions, in a CSR structure, of the neighbours of all the
+        nodes in the frontier, with the node each was reached from.
+    """
+    starts = indptr[frontier]
+    lengths = indptr[frontier + 1] - starts
+    total = lengths.sum()
+    if total == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    #The position of each neighbour is the start of its node's slice,
+    #plus its offset within that slice.
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.repeat(starts - offsets, lengths) + np.arange(total)
+    sources = np.repeat(frontier, lengths)
+    return positions, sources
+
+class NetworkGraph(object):
+    """
+        The nodes and links of a network as CSR arrays.
+
+        args:
+            node_ids (list): The IDs of the nodes in the network
+            link_ids (list): The IDs of the links
+            node_1_ids (list): The ID of the start node of each link
+            node_2_ids (list): The ID of the end node of each link
+
+        Nodes referred to by a link but not in node_ids are added to the graph.
+    """
+    def __init__(self, node_ids, link_ids, node_1_ids, node_2_ids):
+        link_ids = np.asarray(link_ids, dtype=np.int64)
+        node_1_ids = np.asarray(node_1_ids, dtype=np.int64)
+        node_2_ids = np.asarray(node_2_ids, dtype=np.int64)
+
+        self.node_ids = np.unique(np.concatenate([np.asarray(node_ids, dtype=np.int64),
+                                                  node_1_ids, node_2_ids]))
+        self.link_ids = link_ids
+
+        num_nodes = len(self.node_ids)
+        self.node_1 = np.searchsorted(self.node_ids, node_1_ids)
+        self.node_2 = np.searchsorted(self.node_ids, node_2_ids)
+
+        self.out_indptr, self.out_nodes, self.out_links = \
+                _build_csr(num_nodes, self.node_1, self.node_2, link_ids)
+        self.in_indptr, self.in_nodes, self.in_links = \
+                _build_csr(num_nodes, self.node_2, self.node_1, link_ids)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def _index(self, node_id):
+        idx = np.searchsorted(self.node_ids, node_id)
+        if idx >= len(self.node_ids) or self.node_ids[idx] != node_id:
+            raise HydraError("Node %s is not in the network"%(node_id,))
+        return idx
+
+    def _adjacency(self, direction):
+        if direction == 'downstream':
+            return [(self.out_indptr, self.out_nodes, self.out_links)]
+        elif direction == 'upstream':
+            return [(self.in_indptr, self.in_nodes, self.in_links)]
+        elif direction == 'both':
+            return [(self.out_indptr, self.out_nodes, self.out_links),
+                    (self.in_indptr, self.in_nodes, self.in_links)]
+        else:
+            raise HydraError("Unrecognised direction %s. Must be one of "
+                             "'downstream', 'upstream' or 'both'"%(direction,))
+
+    def degree(self):
+        """
+            The number of links connected to each node, in the order of node_ids
+        """
+        return np.diff(self.out_indptr) + np.diff(self.in_indptr)
+
+    def isolated_nodes(self):
+        """
+            The IDs of the nodes which are not connected to any link
+        """
+        return self.node_ids[self.degree() == 0]
+
+    def component_labels(self):
+        """
+            Label each node with the smallest index of the nodes in its
+            (weakly) connected component, in the order of node_ids.
+
+            Components are merged by hooking the root of each link's larger
+            end onto the root of its smaller end, then shortcutting every node
+            straight to its root, until no link joins two components.
+        """
+        parent = np.arange(len(self.node_ids))
+        while True:
+            root_1 = parent[self.node_1]
+            root_2 = parent[self.node_2]
+            low = np.minimum(root_1, root_2)
+            high = np.maximum(root_1, root_2)
+            joining = low != high
+            if not joining.any():
+                break
+            np.minimum.at(parent, high[joining], low[joining])
+
+            while True:
+                grandparent = parent[parent]
+                if np.array_equal(grandparent, parent):
+                    break
+                parent = grandparent
+
+        return parent
+
+    def connected_components(self):
+        """
+            The node IDs of each connected component, largest first
+        """
+        labels = self.component_labels()
+        order = np.argsort(labels, kind='stable')
+        boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+        components = np.split(self.node_ids[order], boundaries)
+        components.sort(key=len, reverse=True)
+        return components
+
+    def traverse(self, node_id, direction='downstream', max_depth=None):
+        """
+            Find all the nodes reachable from a node.
+
+            args:
+                node_id (int): The ID of the node to start from
+                direction (string): 'downstream' follows links from node_1 to node_2,
+                                    'upstream' from node_2 to node_1,
+                                    'both' ignores their direction.
+                max_depth (int): The maximum number of links to follow. Unlimited if None.
+            returns:
+                A dict of the reachable node IDs, not including the start node,
+                to the number of links needed to reach them.
+        """
+        _, depths, _, _ = self._search(node_id, direction, max_depth=max_depth)
+
+        reached = np.flatnonzero(depths > 0)
+        return dict(zip(self.node_ids[reached].tolist(), depths[reached].tolist()))
+
+    def shortest_path(self, from_node_id, to_node_id, direction='downstream'):
+        """
+            Find the path with the fewest links between two nodes.
+
+            returns:
+                A tuple of the node IDs and link IDs along the path,
+                or None if the end node can not be reached.
+        """
+        target = self._index(to_node_id)
+        start, depths, previous_node, previous_link = \
+                self._search(from_node_id, direction, target=target)
+
+        if depths[target] < 0:
+            return None
+
+        nodes = [target]
+        links = []
+        while nodes[-1] != start:
+            links.append(previous_link[nodes[-1]])
+            nodes.append(previous_node[nodes[-1]])
+
+        return self.node_ids[nodes[::-1]].tolist(), [int(l) for l in links[::-1]]
+
+    def _search(self, node_id, direction, max_depth=None, target=None):
+        """
+            Breadth first search from a node, a whole frontier at a time.
+            Returns the index of the start node, the depth at which each node
+            was reached (-1 if it wasn't), and the node and link it was reached by.
+        """
+        adjacency = self._adjacency(direction)
+
+        start = self._index(node_id)
+        num_nodes = len(self.node_ids)
+        depths = np.full(num_nodes, -1, dtype=np.int64)
+        previous_node = np.full(num_nodes, -1, dtype=np.int64)
+        previous_link = np.full(num_nodes, -1, dtype=np.int64)
+
+        depths[start] = 0
+        frontier = np.array([start])
+        depth = 0
+        while len(frontier) > 0 and (max_depth is None or depth < max_depth):
+            depth += 1
+
+            reached, sources, links = [], [], []
+            for indptr, indices, link_ids in adjacency:
+                positions, frontier_sources = _gather(indptr, indices, frontier)
+                reached.append(indices[positions])
+                sources.append(frontier_sources)
+                links.append(link_ids[positions])
+            reached = np.concatenate(reached)
+            sources = np.concatenate(sources)
+            links = np.concatenate(links)
+
+            new = depths[reached] < 0
+            #Keep the first link found to each new node
+            frontier, first = np.unique(reached[new], return_index=True)
+            depths[frontier] = depth
+            previous_node[frontier] = sources[new][first]
+            previous_link[frontier] = links[new][first]
+
+            if target is not None and depths[target] >= 0:
+                break
+
+        return start, depths, previous_node, previous_link
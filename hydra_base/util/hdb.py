@@ -19,7 +19,7 @@
 
 import os
 import json
-from ..db.model import Network, Scenario, Project, User, Role, Perm, RolePerm, RoleUser, ResourceAttr, ResourceType, Dimension, Unit
+from ..db.model import Network, Scenario, Project, User, Role, Perm, RolePerm, RoleUser, ResourceAttr, ResourceType, Dimension, Unit, Dataset, Metadata
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 from .. import db
 import datetime
@@ -27,8 +27,11 @@ import random
 import bcrypt
 from ..exceptions import HydraError
 import transaction
+from zope.sqlalchemy import mark_changed
 from sqlalchemy.orm import load_only
 from ..lib.objects import JSONObject
+from . import generate_data_hash
+from .cache import invalidate_all_networks
 
 import logging
 log = logging.getLogger(__name__)
@@ -467,3 +470,84 @@ def get_dimension_from_db_by_name(dimension_name):
         return JSONObject(dimension)
     except NoResultFound:
         raise ResourceNotFoundError("Dimension %s not found"%(dimension_name))
+
+def rehash_datasets(chunk_size=1000):
+    """
+        Recalculate the hash of every dataset in the DB using the current
+        generate_data_hash. This is needed to migrate hashes created with
+        the (per-process salted) builtin hash(), which can not be matched
+        when deduplicating incoming data.
+
+        Datasets are processed in chunks, ordered by ID, and each chunk is
+        committed, so this can be safely re-run if interrupted.
+
+        Datasets which turn out to be identical (which the old hash
+        failed to detect) keep their own rows. They are given a hash salted
+        with their ID, in the same way as datasets which are duplicated
+        because a user does not have access to the original.
+
+        returns:
+            The number of datasets whose hash was changed
+    """
+    seen_hashes = set()
+    num_updated = 0
+    last_id = None
+
+    while True:
+        dataset_qry = db.DBSession.query(Dataset.id,
+                                         Dataset.name,
+                                         Dataset.unit_id,
+                                         Dataset.type,
+                                         Dataset.value,
+                                         Dataset.hash).order_by(Dataset.id)
+        if last_id is not None:
+            dataset_qry = dataset_qry.filter(Dataset.id > last_id)
+        datasets = dataset_qry.limit(chunk_size).all()
+
+        if len(datasets) == 0:
+            break
+
+        last_id = datasets[-1].id
+
+        metadata = {}
+        metadata_qry = db.DBSession.query(Metadata.dataset_id,
+                                          Metadata.key,
+                                          Metadata.value).filter(
+                                              Metadata.dataset_id.in_([d.id for d in datasets]))
+        for m in metadata_qry:
+            metadata.setdefault(m.dataset_id, {})[str(m.key)] = str(m.value)
+
+        updates = []
+        for d in datasets:
+            dataset_dict = dict(name     = d.name,
+                                unit_id  = d.unit_id,
+                                type     = d.type,
+                                value    = d.value,
+                                metadata = metadata.get(d.id, {}))
+            new_hash = generate_data_hash(dataset_dict)
+
+            if new_hash in seen_hashes:
+                log.warning("Dataset %s is a duplicate of an existing dataset."
+                            " Salting its hash with its ID.", d.id)
+                dataset_dict['metadata'] = dict(dataset_dict['metadata'], dataset_id=d.id)
+                new_hash = generate_data_hash(dataset_dict)
+
+            seen_hashes.add(new_hash)
+
+            if new_hash != d.hash:
+                updates.append({'id': d.id, 'hash': new_hash})
+
+        if len(updates) > 0:
+            db.DBSession.bulk_update_mappings(Dataset, updates)
+            #Bulk updates bypass the ORM, so the transaction manager
+            #must be told that there is something to commit.
+            mark_changed(db.DBSession())
+            num_updated += len(updates)
+
+        transaction.commit()
+
+        log.info("Rehashed datasets up to ID %s. %s updated.", last_id, num_updated)
+
+    invalidate_all_networks()
+
+    return num_updated
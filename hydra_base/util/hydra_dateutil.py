@@ -290,11 +290,19 @@ def guess_timefmt(datestr):
 
     return None
 
+def _is_regular_timeseries(ts_string):
+    """
+        Check whether a value is the packed form of a REGULAR_TIMESERIES,
+        which always starts with its start date.
+    """
+    return ts_string.lstrip().startswith('{"start"')
+
 def reindex_timeseries(ts_string, new_timestamps):
     """
         get data for timesamp
 
-        :param a JSON string, in pandas-friendly format
+        :param a JSON string, in pandas-friendly format, or the packed value
+               of a REGULAR_TIMESERIES
         :param a timestamp or list of timestamps (datetimes)
         :returns a pandas data frame, reindexed with the supplied timestamos or None if no data is found
     """
@@ -314,9 +322,17 @@ def reindex_timeseries(ts_string, new_timestamps):
     seasonal_year = config.get('DEFAULT','seasonal_year', '1678')
     seasonal_key = config.get('DEFAULT', 'seasonal_key', '9999')
 
-    ts = ts_string.replace(seasonal_key, seasonal_year)
+    if _is_regular_timeseries(ts_string):
+        #The packed value is not pandas-friendly JSON, so unpack it, labelling
+        #the columns as read_json would.
+        from ..lib.HydraTypes.Types import RegularTimeseries
+        timeseries = RegularTimeseries.fromDataset(ts_string).get_frame()
+        if all(c.isdigit() for c in timeseries.columns):
+            timeseries.columns = [int(c) for c in timeseries.columns]
+    else:
+        ts = ts_string.replace(seasonal_key, seasonal_year)
 
-    timeseries = pd.read_json(ts)
+        timeseries = pd.read_json(ts)
 
     idx = timeseries.index
 
@@ -337,7 +353,7 @@ def reindex_timeseries(ts_string, new_timestamps):
 
     i = reindexed_ts.index
 
-    reindexed_ts.index = pd.Index(new_timestamps, names=i.names)
+    reindexed_ts.index = pd.Index(new_timestamps, name=i.name)
 
     #If there are no values at all, just return None
     if len(reindexed_ts.dropna()) == 0:
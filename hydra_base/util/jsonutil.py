@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# (c) Copyright 2013 to 2017 University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    JSON encoding and decoding, using the fastest JSON library installed.
+
+    The backend is set by [DEFAULT] json_backend, which is one of 'orjson',
+    'ujson', 'simdjson' or 'json' (the standard library), or 'auto' (the
+    default) to use the first of these which can be imported.
+
+    The backends only differ in speed:
+        * Objects are decoded as dicts, which keep the order of their keys.
+          Where an OrderedDict is needed, pass object_pairs_hook to loads.
+        * Text which a backend rejects but the standard library accepts
+          (such as NaN, or integers of more than 64 bits) is decoded by the
+          standard library, so the same text is accepted, and the same errors
+          raised, whichever backend is used. Likewise for values which a
+          backend can't encode.
+        * dumps always produces compact, non-ASCII-escaped text.
+
+    The text produced by dumps may differ between backends in how numbers
+    are written, so it must not be used where the exact text matters, such
+    as the values of datasets, which are hashed.
+"""
+
+import json
+
+from .. import config
+
+import logging
+log = logging.getLogger(__name__)
+
+BACKENDS = ('orjson', 'ujson', 'simdjson', 'json')
+
+class _StdlibBackend(object):
+    name = 'json'
+
+    @staticmethod
+    def loads(text):
+        return json.loads(text)
+
+    @staticmethod
+    def dumps(value, sort_keys=False, default=None):
+        return json.dumps(value, sort_keys=sort_keys, default=default,
+                          ensure_ascii=False, separators=(',', ':'))
+
+class _OrjsonBackend(object):
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+        #Dates are left to 'default', as the standard library does
+        self.options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def loads(self, text):
+        return self.orjson.loads(text)
+
+    def dumps(self, value, sort_keys=False, default=None):
+        options = self.options
+        if sort_keys is True:
+            options |= self.orjson.OPT_SORT_KEYS
+        return self.orjson.dumps(value, default=default, option=options).decode('utf-8')
+
+class _UjsonBackend(object):
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self.ujson = ujson
+
+    def loads(self, text):
+        return self.ujson.loads(text)
+
+    def dumps(self, value, sort_keys=False, default=None):
+        return self.ujson.dumps(value, sort_keys=sort_keys, default=default,
+                                ensure_ascii=False, escape_forward_slashes=False)
+
+class _SimdjsonBackend(_StdlibBackend):
+    """
+        simdjson only decodes, so values are encoded by the standard library.
+    """
+    name = 'simdjson'
+
+    def __init__(self):
+        import simdjson
+        self.simdjson = simdjson
+
+    def loads(self, text):
+        return self.simdjson.loads(text)
+
+_backend_classes = {
+    'orjson'   : _OrjsonBackend,
+    'ujson'    : _UjsonBackend,
+    'simdjson' : _SimdjsonBackend,
+    'json'     : _StdlibBackend,
+}
+
+_backend = None
+
+def configure_backend(name=None):
+    """
+        Choose the JSON library to use. If no name is given, it is read
+        from [DEFAULT] json_backend. With 'auto', the first of the BACKENDS
+        which is installed is used.
+        returns:
+            The name of the backend which will be used
+    """
+    global _backend
+
+    if name is None:
+        name = config.get('DEFAULT', 'json_backend', 'auto')
+    name = name.lower()
+
+    if name == 'auto':
+        candidates = BACKENDS
+    elif name in _backend_classes:
+        candidates = (name, 'json')
+    else:
+        raise ValueError("Unknown JSON backend %s. Must be one of %s or 'auto'"%
+                         (name, ', '.join(BACKENDS)))
+
+    for candidate in candidates:
+        try:
+            _backend = _backend_classes[candidate]()
+            break
+        except ImportError:
+            if name != 'auto':
+                log.warning("JSON backend %s is not installed. Using json.", name)
+
+    log.info("Using JSON backend %s", _backend.name)
+
+    return _backend.name
+
+def get_backend():
+    if _backend is None:
+        configure_backend()
+    return _backend
+
+def loads(text, object_pairs_hook=None):
+    """
+        Decode JSON text, as json.loads. If an object_pairs_hook is given,
+        the standard library is used.
+    """
+    backend = get_backend()
+    if object_pairs_hook is None and backend.name != 'json':
+        try:
+            return backend.loads(text)
+        except (ValueError, TypeError, OverflowError):
+            pass
+
+    return json.loads(text, object_pairs_hook=object_pairs_hook)
+
+def dumps(value, sort_keys=False, default=None):
+    """
+        Encode a value as compact JSON text.
+    """
+    backend = get_backend()
+    if backend.name != 'json':
+        try:
+            return backend.dumps(value, sort_keys=sort_keys, default=default)
+        except (ValueError, TypeError, OverflowError):
+            pass
+
+    return _StdlibBackend.dumps(value, sort_keys=sort_keys, default=default)
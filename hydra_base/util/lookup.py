@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# (c) Copyright 2013 to 2017 University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Filtering queries on large sets of keys.
+
+    A small set of keys is used in a plain 'IN' list. A larger set is loaded
+    into a temporary table on the session's connection, and the query
+    filters on a sub-select from it, so the lookup is a single query,
+    however many keys there are.
+
+    usage:
+        with in_keys(Dataset.id, dataset_ids) as dataset_filter:
+            datasets = db.DBSession.query(Dataset).filter(dataset_filter).all()
+
+    The query must be run inside the 'with' block, as the temporary table
+    is dropped at the end of it.
+
+    The table is created and dropped in the current transaction on every
+    supported backend. On MySQL this needs 'DROP TEMPORARY TABLE', as a
+    plain 'DROP TABLE' commits the transaction implicitly. On PostgreSQL a
+    failed statement aborts the transaction, so the table is not dropped
+    after an error; the rollback removes it.
+"""
+
+import itertools
+from contextlib import contextmanager
+
+from sqlalchemy import Table, Column, MetaData, select, text
+
+from .. import db
+from .. import config
+
+import logging
+log = logging.getLogger(__name__)
+
+#SQLite can only bind 999 parameters in a statement
+SQLITE_MAX_VARIABLES = 999
+
+_table_ids = itertools.count()
+
+def get_in_threshold():
+    """
+        The largest number of keys which are put directly into an 'IN' list,
+        set by [db] bulk_lookup_threshold.
+    """
+    threshold = config.getint('db', 'bulk_lookup_threshold', 999)
+
+    if db.DBSession.bind.dialect.name == 'sqlite':
+        threshold = min(threshold, SQLITE_MAX_VARIABLES)
+
+    return threshold
+
+@contextmanager
+def in_keys(column, keys):
+    """
+        Build a filter which selects the rows where 'column' has one of 'keys'.
+        args:
+            column (Column): The column to filter on, such as Dataset.id
+            keys (iterable): The values to look for
+        yields:
+            A SQLAlchemy expression to use in filter() or where()
+    """
+    keys = set(keys)
+
+    if len(keys) <= get_in_threshold():
+        yield column.in_(keys)
+        return
+
+    #There is no autoincrement, so an integer key is not made a SERIAL
+    #on PostgreSQL or AUTO_INCREMENT on MySQL.
+    key_table = Table('tmp_keys_%s' % next(_table_ids),
+                      MetaData(),
+                      Column('key', column.type, primary_key=True, autoincrement=False),
+                      prefixes=['TEMPORARY'])
+
+    connection = db.DBSession.connection()
+
+    log.debug("Loading %s keys into %s", len(keys), key_table.name)
+    key_table.create(bind=connection)
+    try:
+        connection.execute(key_table.insert(), [{'key': k} for k in keys])
+
+        yield column.in_(select([key_table.c.key]))
+    except Exception:
+        if connection.dialect.name != 'postgresql':
+            _drop_key_table(connection, key_table)
+        raise
+
+    _drop_key_table(connection, key_table)
+
+def _drop_key_table(connection, key_table):
+    """
+        Drop a temporary key table without ending the current transaction.
+    """
+    if connection.dialect.name == 'mysql':
+        connection.execute(text('DROP TEMPORARY TABLE %s' %
+                                connection.dialect.identifier_preparer.quote(key_table.name)))
+    else:
+        key_table.drop(bind=connection)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# (c) Copyright 2013 to 2017 University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    In-memory spatial indices of the nodes and links of a network, used to
+    find the resources within a bounding box (a map viewport, for example)
+    without loading the whole network.
+"""
+
+import numpy as np
+
+import logging
+log = logging.getLogger(__name__)
+
+def _to_float_array(values):
+    """
+        Convert a column of coordinates, which may be decimals or
+        None, to a float array, with missing coordinates as NaN.
+    """
+    return np.array([np.nan if v is None else float(v) for v in values], dtype=float)
+
+class PointIndex(object):
+    """
+        A uniform grid over a set of points. The points are sorted by cell,
+        row by row, so the cells covering any row of a bounding box are
+        one contiguous slice of the points.
+
+        args:
+            ids (list): The ID of each point
+            x (list): The x coordinate of each point
+            y (list): The y coordinate of each point
+            points_per_cell (int): The average number of points in each cell.
+
+        Points without both coordinates are not indexed.
+    """
+    def __init__(self, ids, x, y, points_per_cell=16):
+        ids = np.asarray(ids, dtype=np.int64)
+        x = _to_float_array(x)
+        y = _to_float_array(y)
+
+        located = ~(np.isnan(x) | np.isnan(y))
+        ids, x, y = ids[located], x[located], y[located]
+
+        self.size = len(ids)
+        if self.size == 0:
+            self.ids, self.x, self.y = ids, x, y
+            return
+
+        self.min_x, self.max_x = x.min(), x.max()
+        self.min_y, self.max_y = y.min(), y.max()
+
+        num_cells = max(1, int(np.ceil(np.sqrt(self.size / float(points_per_cell)))))
+        self.num_cols = self.num_rows = num_cells
+        self.cell_width = (self.max_x - self.min_x) / num_cells or 1.0
+        self.cell_height = (self.max_y - self.min_y) / num_cells or 1.0
+
+        cells = self._row(y) * self.num_cols + self._col(x)
+        order = np.argsort(cells, kind='stable')
+        self.ids, self.x, self.y = ids[order], x[order], y[order]
+
+        self.indptr = np.zeros(self.num_cols * self.num_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=self.num_cols * self.num_rows),
+                  out=self.indptr[1:])
+
+    def _col(self, x):
+        return np.clip(((x - self.min_x) / self.cell_width).astype(np.int64), 0, self.num_cols - 1)
+
+    def _row(self, y):
+        return np.clip(((y - self.min_y) / self.cell_height).astype(np.int64), 0, self.num_rows - 1)
+
+    def query(self, min_x, min_y, max_x, max_y):
+        """
+            Get the IDs of the points within a bounding box, including its edges
+        """
+        if self.size == 0 or min_x > self.max_x or max_x < self.min_x or \
+                min_y > self.max_y or max_y < self.min_y:
+            return np.empty(0, dtype=np.int64)
+
+        first_col, last_col = self._col(np.array([min_x, max_x]))
+        first_row, last_row = self._row(np.array([min_y, max_y]))
+
+        slices = []
+        for row in range(first_row, last_row + 1):
+            start = self.indptr[row * self.num_cols + first_col]
+            end = self.indptr[row * self.num_cols + last_col + 1]
+            if end > start:
+                slices.append(np.arange(start, end))
+
+        if len(slices) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        candidates = np.concatenate(slices)
+        x, y = self.x[candidates], self.y[candidates]
+        inside = (x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)
+
+        return self.ids[candidates[inside]]
+
+class SegmentIndex(object):
+    """
+        An index of line segments (links) by their bounding boxes. The boxes are
+        sorted by their minimum x, so only those starting before the right
+        edge of a query box need to be compared with it.
+
+        args:
+            ids (list): The ID of each segment
+            x1, y1, x2, y2 (list): The coordinates of the ends of each segment
+
+        Segments without coordinates for both ends are not indexed.
+    """
+    def __init__(self, ids, x1, y1, x2, y2):
+        ids = np.asarray(ids, dtype=np.int64)
+        x1, y1, x2, y2 = [_to_float_array(c) for c in (x1, y1, x2, y2)]
+
+        located = ~(np.isnan(x1) | np.isnan(y1) | np.isnan(x2) | np.isnan(y2))
+        ids, x1, y1, x2, y2 = ids[located], x1[located], y1[located], x2[located], y2[located]
+
+        min_x = np.minimum(x1, x2)
+        order = np.argsort(min_x, kind='stable')
+
+        self.ids = ids[order]
+        self.min_x = min_x[order]
+        self.max_x = np.maximum(x1, x2)[order]
+        self.min_y = np.minimum(y1, y2)[order]
+        self.max_y = np.maximum(y1, y2)[order]
+
+    def query(self, min_x, min_y, max_x, max_y):
+        """
+            Get the IDs of the segments whose bounding boxes overlap a bounding box
+        """
+        end = np.searchsorted(self.min_x, max_x, side='right')
+        overlaps = (self.max_x[:end] >= min_x) & \
+                   (self.min_y[:end] <= max_y) & \
+                   (self.max_y[:end] >= min_y)
+        return self.ids[:end][overlaps]
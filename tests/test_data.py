@@ -16,14 +16,20 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import pytest
+import os
+import sys
+import subprocess
 import datetime
+from decimal import Decimal
 import logging
 import json
+import pandas as pd
 import hydra_base as hb
-from hydra_base.lib.objects import JSONObject
+from hydra_base.lib.HydraTypes.Codecs import codecmap, decode_value
+from hydra_base.lib.objects import JSONObject, Dataset as JSONDataset, make_json_objects
 from hydra_base.exceptions import ResourceNotFoundError
 
-from hydra_base.util import flatten_dict, count_levels
+from hydra_base.util import flatten_dict, count_levels, generate_data_hash
 
 log = logging.getLogger(__name__)
 
@@ -290,6 +296,113 @@ class TestTimeSeries:
         for val in data:
             assert original_val == val
 
+    def test_multiple_vals_at_time_batched(self, client):
+        """
+            Look up many timeseries at once, including timeseries with
+            different dates and with more than one column.
+        """
+        def make_timeseries(start, columns):
+            dates = pd.date_range(start, periods=10, freq='D').strftime('%Y-%m-%dT%H:%M:%S.000Z')
+            return pd.DataFrame(columns, index=dates).to_json()
+
+        values = [
+            make_timeseries('2020-01-01', {'0': [float(i) for i in range(10)]}),
+            make_timeseries('2020-01-01', {'0': [i + 0.5 for i in range(10)]}),
+            make_timeseries('2020-01-05', {'0': [i * 10.0 for i in range(10)]}),
+            make_timeseries('2020-01-01', {'a': [float(i) for i in range(10)],
+                                           'b': [i * 2.5 for i in range(10)]}),
+        ]
+        datasets = hb.lib.data._bulk_insert_data(
+            [JSONDataset({'name': 'Batched %s'%i, 'type': 'timeseries', 'value': v,
+                          'unit_id': None, 'metadata': {}}) for i, v in enumerate(values)] +
+            [JSONDataset({'name': 'Batched scalar', 'type': 'scalar', 'value': '1.5',
+                          'unit_id': None, 'metadata': {}})],
+            user_id=pytest.root_user_id)
+        dataset_ids = [d.id for d in datasets]
+        hb.commit_transaction()
+
+        qry_times = ['2019-12-31T00:00:00.000Z',
+                     '2020-01-03T00:00:00.000Z',
+                     '2020-01-07T12:00:00.000Z',
+                     '2021-01-01T00:00:00.000Z']
+
+        result = client.get_multiple_vals_at_time(dataset_ids, qry_times)
+
+        assert list(result['dataset_%s'%dataset_ids[0]].values()) == [None, 2, 6, 9]
+        assert list(result['dataset_%s'%dataset_ids[1]].values()) == [None, 2.5, 6.5, 9.5]
+        assert list(result['dataset_%s'%dataset_ids[2]].values()) == [None, None, 20, 90]
+        assert list(result['dataset_%s'%dataset_ids[3]].values()) == [[None, None], [2, 5], [6, 15], [9, 22.5]]
+        assert result['dataset_%s'%dataset_ids[4]] == {}
+
+        #Each timeseries gives the same values as looking it up on its own
+        for dataset_id in dataset_ids[:3]:
+            dataset_i = hb.db.DBSession.query(hb.db.model.Dataset).filter(
+                hb.db.model.Dataset.id == dataset_id).one()
+            single_vals = dataset_i.get_val(timestamp=[hb.util.hydra_dateutil.get_datetime(t)
+                                                       for t in qry_times[1:]])
+            #Missing values are None, rather than NaN
+            single_vals = [None if pd.isnull(v) else v for v in single_vals]
+            assert list(result['dataset_%s'%dataset_id].values())[1:] == single_vals
+
+        table = hb.get_multiple_vals_at_time(dataset_ids, qry_times, result_format='dataframe')
+        assert list(table.columns) == ['dataset_id'] + qry_times
+        assert list(table['dataset_id']) == dataset_ids
+        assert list(table[qry_times[2]]) == [6, 6.5, 20, [6, 15], None]
+
+    def test_regular_timeseries(self, client):
+        """
+            Convert a timeseries to a regular timeseries, which stores only
+            its start and frequency, and check it gives the same values.
+        """
+        dates = pd.date_range('2020-01-01', periods=48, freq='H').strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        value = pd.DataFrame({'0': [i + 0.5 for i in range(48)],
+                              'b': [i * 2.5 for i in range(48)]}, index=dates).to_json()
+        irregular_value = json.dumps({'0': {'2020-01-01T00:00:00': 1.5,
+                                            '2020-01-02T00:00:00': 2.5,
+                                            '2020-01-04T00:00:00': 3.5}})
+
+        datasets = hb.lib.data._bulk_insert_data(
+            [JSONDataset({'name': 'Hourly', 'type': 'timeseries', 'value': v,
+                          'unit_id': None, 'metadata': {}}) for v in (value, irregular_value)],
+            user_id=pytest.root_user_id)
+        timeseries_id, irregular_id = [d.id for d in datasets]
+        hb.commit_transaction()
+
+        timeseries = client.get_dataset(timeseries_id)
+
+        regular = client.convert_timeseries(timeseries.id, 'regular_timeseries')
+        assert regular.type == 'regular_timeseries'
+        assert json.loads(regular.value)['frequency'] == 'H'
+        assert len(regular.value) < len(value)
+
+        pd.testing.assert_frame_equal(hb.util.get_val(regular), hb.util.get_val(timeseries),
+                                      check_freq=False)
+
+        qry_times = ['2019-12-31T00:00:00.000Z', '2020-01-01T10:30:00.000Z', '2021-01-01T00:00:00.000Z']
+        result = client.get_multiple_vals_at_time([timeseries.id, regular.id], qry_times)
+        assert list(result['dataset_%s'%regular.id].values()) == [[None, None], [10.5, 25.0], [47.5, 117.5]]
+        assert result['dataset_%s'%regular.id] == result['dataset_%s'%timeseries.id]
+
+        reindex_times = [hb.util.hydra_dateutil.get_datetime(t) for t in qry_times[1:]]
+        reindexed = hb.util.hydra_dateutil.reindex_timeseries(regular.value, reindex_times)
+        assert list(reindexed.columns) == ['0', 'b']
+        pd.testing.assert_frame_equal(
+            reindexed,
+            hb.util.hydra_dateutil.reindex_timeseries(timeseries.value, reindex_times),
+            check_index_type=False)
+
+        #Converting back gives the original timeseries
+        converted = client.convert_timeseries(regular.id, 'timeseries')
+        assert converted.type == 'timeseries'
+        pd.testing.assert_frame_equal(hb.util.get_val(converted), hb.util.get_val(timeseries))
+
+        #A regular timeseries can also be added in the form of a timeseries
+        assert hb.lib.objects.Dataset({'type': 'regular_timeseries', 'value': value}).parse_value() == \
+                regular.value
+
+        with pytest.raises(hb.exceptions.HydraError):
+            client.convert_timeseries(irregular_id, 'regular_timeseries')
+
     def test_get_data_between_times(self, client, network_with_data):
 
         # Convenience renaming
@@ -323,6 +436,45 @@ class TestTimeSeries:
             x = val_a
             assert x == val_a
 
+    @pytest.mark.parametrize("backend", ["memory", "file"])
+    def test_value_cache(self, client, backend, tmpdir, monkeypatch):
+        """
+            Test that decoded timeseries are cached on their content, and
+            that each caller gets its own copy.
+        """
+        timeseries = JSONObject({
+            'type': 'timeseries',
+            'value': json.dumps({"0": {"2020-01-01T00:00:00": 1.5,
+                                       "2020-01-02T00:00:00": 2.5,
+                                       "2020-01-03T00:00:00": 3.5}}),
+        })
+
+        hb.util.cache.configure_value_cache('none')
+        expected = hb.util.get_val(timeseries)
+
+        cache = hb.util.cache.configure_value_cache(backend, directory=str(tmpdir))
+        try:
+            frame_1 = hb.util.get_val(timeseries)
+            assert cache.memory.size > 0
+            pd.testing.assert_frame_equal(frame_1, expected)
+
+            frame_1.iloc[0, 0] = 100
+            frame_2 = hb.util.get_val(timeseries)
+            pd.testing.assert_frame_equal(frame_2, expected)
+
+            #A cached value is not decoded again
+            def fail_to_decode(*args):
+                raise AssertionError("Value decoded again")
+            monkeypatch.setattr(hb.util, '_decode_timeseries', fail_to_decode)
+            assert hb.util.get_val(timeseries, timestamp=[expected.index[1]]) == 2.5
+
+            if backend == 'file':
+                #Another process, with an empty in-process cache, reads it from the directory
+                cache = hb.util.cache.configure_value_cache(backend, directory=str(tmpdir))
+                pd.testing.assert_frame_equal(hb.util.get_val(timeseries), expected)
+        finally:
+            hb.util.cache.configure_value_cache()
+
     def test_descriptor_get_data_between_times(self, client, network_with_data):
         net = network_with_data
         scenario = net.scenarios[0]
@@ -402,6 +554,310 @@ def network_with_dataset_collection(client, network_with_data, collection_json_o
     return newly_added_collection
 
 
+class TestTensor:
+    """
+        Test tensors, and their conversion from and to arrays
+    """
+    def test_convert_array(self, client):
+        rule_curve = [[[float(m * 24 + h) + 0.25 for h in range(24)] for m in range(12)],
+                      [[float(m * 24 + h) - 0.25 for h in range(24)] for m in range(12)]]
+
+        datasets = hb.lib.data._bulk_insert_data(
+            [JSONDataset({'name': 'Rule curve', 'type': 'array', 'value': json.dumps(v),
+                          'unit_id': None, 'metadata': {}}) for v in (rule_curve, [[1, 2], [3]])],
+            user_id=pytest.root_user_id)
+        array_id, ragged_id = [d.id for d in datasets]
+        hb.commit_transaction()
+
+        tensor = client.convert_array(array_id, 'tensor')
+        assert tensor.type == 'tensor'
+        assert json.loads(tensor.value)['shape'] == [2, 12, 24]
+        assert json.loads(tensor.value)['dtype'] == 'float64'
+
+        values = hb.util.get_val(tensor)
+        assert values.shape == (2, 12, 24)
+        assert values.tolist() == rule_curve
+
+        single = client.convert_array(array_id, 'tensor', dtype='float32')
+        assert hb.util.get_val(single).dtype.name == 'float32'
+
+        #Converting back gives the original array, so its dataset is re-used
+        converted = client.convert_array(tensor.id, 'array')
+        assert converted.type == 'array'
+        assert converted.id == array_id
+        assert json.loads(converted.value) == rule_curve
+
+        with pytest.raises(hb.exceptions.HydraError):
+            client.convert_array(ragged_id, 'tensor')
+
+        with pytest.raises(hb.exceptions.HydraError):
+            client.convert_array(array_id, 'timeseries')
+
+class TestBulkInsert:
+    """
+        Test the bulk insertion of datasets
+    """
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_bulk_insert_data(self, client, monkeypatch, workers):
+        """
+            Insert datasets in batches, serially and in parallel, including
+            duplicates and datasets already in the DB.
+        """
+        bulk_settings = {'bulk_insert_workers': workers,
+                         'bulk_insert_parallel_threshold': 1,
+                         'bulk_insert_batch_size': 2}
+        getint = hb.config.getint
+        monkeypatch.setattr(hb.config, 'getint',
+                            lambda section, option, default=None:
+                            bulk_settings.get(option, getint(section, option, default)))
+
+        timeseries = json.dumps({"0": {"2020-01-01T00:00:00": 1.0,
+                                       "2020-01-02T00:00:00": 2.0}})
+        def make_datasets():
+            datasets = []
+            for i in range(5):
+                datasets.append(JSONDataset({'name': 'Bulk scalar %s'%(workers),
+                                             'type': 'scalar',
+                                             'value': str(i),
+                                             'unit_id': None,
+                                             'metadata': {'test': 'bulk'}}))
+            #A duplicate of the first dataset
+            datasets.append(JSONDataset(datasets[0]))
+            datasets.append(JSONDataset({'name': 'Bulk timeseries %s'%(workers),
+                                         'type': 'timeseries',
+                                         'value': timeseries,
+                                         'unit_id': None,
+                                         'metadata': {}}))
+            return datasets
+
+        datasets = hb.lib.data._bulk_insert_data(make_datasets(), user_id=pytest.root_user_id)
+
+        dataset_ids = [d.id for d in datasets]
+        assert None not in dataset_ids
+        assert len(set(dataset_ids)) == 6
+        assert dataset_ids[5] == dataset_ids[0]
+
+        for d in datasets:
+            assert d.get_metadata_as_dict()['user_id'] == str(pytest.root_user_id)
+
+        hb.commit_transaction()
+
+        #Inserting the same data again returns the existing datasets
+        datasets = hb.lib.data._bulk_insert_data(make_datasets(), user_id=pytest.root_user_id)
+        assert [d.id for d in datasets] == dataset_ids
+
+        dataset = client.get_dataset(dataset_ids[6])
+        assert dataset.type == 'timeseries'
+        assert dataset.metadata['user_id'] == str(pytest.root_user_id)
+
+class TestBulkLookup:
+    """
+        Test looking up large sets of keys through a temporary table
+    """
+    def _use_temporary_tables(self, monkeypatch):
+        getint = hb.config.getint
+        monkeypatch.setattr(hb.config, 'getint',
+                            lambda section, option, default=None:
+                            1 if option == 'bulk_lookup_threshold' else getint(section, option, default))
+
+    def _count_temporary_tables(self, db_backend):
+        if db_backend == 'postgres':
+            qry = "select count(*) from pg_tables where schemaname like 'pg_temp%'"
+        elif db_backend == 'mysql':
+            qry = "select count(*) from information_schema.INNODB_TEMP_TABLE_INFO"
+        else:
+            qry = "select count(*) from sqlite_temp_master"
+        return hb.db.DBSession.execute(qry).scalar()
+
+    def test_bulk_lookup(self, client, network_with_data, monkeypatch, db_backend):
+        """
+            Look up the datasets, metadata and data of a network using a
+            temporary table for every set of keys, and check the results are
+            the same as with 'IN' lists.
+        """
+        net = client.get_network(network_with_data.id, include_data='Y')
+        scenario = net.scenarios[0]
+        dataset_ids = list(set(rs.dataset.id for rs in scenario.resourcescenarios))
+        node_ids = [n.id for n in net.nodes]
+
+        def lookup():
+            datasets = hb.lib.data._get_datasets(dataset_ids)
+            return dict(
+                values=hb.get_dataset_values(dataset_ids, user_id=pytest.root_user_id),
+                datasets=sorted(datasets.keys()),
+                hashes=sorted(hb.lib.data._get_existing_data(
+                    [d.hash for d in datasets.values()]).keys()),
+                metadata=sorted((m.dataset_id, m.key) for m in hb.lib.data._get_metadata(dataset_ids)),
+                nodes=[n.id for n in hb.lib.network._get_resources_by_id(hb.db.model.Node, node_ids)],
+                node_data=sorted(rs.resource_attr_id for rs in hb.lib.network.get_attributes_for_resource(
+                    net.id, scenario.id, 'NODE', node_ids[:3], include_metadata='Y',
+                    user_id=pytest.root_user_id)))
+
+        in_list_results = lookup()
+        assert len(in_list_results['values']) == len(dataset_ids) > 1
+        assert len(in_list_results['hashes']) == len(dataset_ids)
+        assert len(in_list_results['node_data']) > 0
+        assert in_list_results['nodes'] == sorted(node_ids)
+
+        self._use_temporary_tables(monkeypatch)
+
+        assert lookup() == in_list_results
+
+        #The temporary tables are dropped after use
+        assert self._count_temporary_tables(db_backend) == 0
+
+    def test_bulk_lookup_transaction(self, client, network_with_data, monkeypatch, db_backend):
+        """
+            Check a temporary table lookup stays inside the current transaction,
+            so it neither commits earlier changes (as a plain DROP TABLE does on
+            MySQL) nor hides the error of a failed statement.
+        """
+        net = client.get_network(network_with_data.id, include_data='Y')
+        dataset_ids = list(set(rs.dataset.id for rs in net.scenarios[0].resourcescenarios))
+        hb.commit_transaction()
+
+        self._use_temporary_tables(monkeypatch)
+
+        dataset_table = hb.db.model.Dataset.__table__
+        hb.db.DBSession.execute(dataset_table.update().where(
+            dataset_table.c.id == dataset_ids[0]).values(name='Not committed'))
+
+        with hb.util.lookup.in_keys(hb.db.model.Dataset.id, dataset_ids) as dataset_filter:
+            datasets = hb.db.DBSession.query(hb.db.model.Dataset.id).filter(dataset_filter).all()
+        assert len(datasets) == len(dataset_ids)
+
+        hb.rollback_transaction()
+
+        assert client.get_dataset(dataset_ids[0]).name != 'Not committed'
+
+        with pytest.raises(Exception) as e:
+            with hb.util.lookup.in_keys(hb.db.model.Dataset.id, dataset_ids) as dataset_filter:
+                hb.db.DBSession.execute("select id from tNoSuchTable")
+        assert 'nosuchtable' in str(e.value).lower()
+
+        hb.rollback_transaction()
+
+        assert self._count_temporary_tables(db_backend) == 0
+
+class TestValueCodecs:
+    """
+        Test the storage of dataset values using the value codecs
+    """
+    def _make_timeseries(self, num_values):
+        index = pd.date_range('2020-01-01', periods=num_values, freq='H')
+        ts = pd.DataFrame({'0': [float(i % 24) + 0.5 for i in range(num_values)]},
+                          index=index.strftime('%Y-%m-%dT%H:%M:%S.000Z'))
+        return ts.to_json()
+
+    def test_codec_round_trip(self, client):
+        """
+            Codecs must reproduce the exact JSON text they encoded, or refuse to
+            encode it.
+        """
+        timeseries = self._make_timeseries(100)
+        dataframe = json.dumps({"a": {"x": 1, "y": 2}, "b": {"x": 3, "y": 4}}, separators=(',', ':'))
+        ragged = json.dumps({"a": {"x": 1.5, "y": 2}, "b": {"x": 3}})
+
+        for value in (timeseries, dataframe):
+            payload = codecmap['FRAME'].encode(value)
+            assert payload is not None
+            assert codecmap['FRAME'].decode(payload) == value
+
+        assert codecmap['FRAME'].encode(ragged) is None
+
+        for value in (timeseries, dataframe, ragged):
+            assert codecmap['ZLIB'].decode(codecmap['ZLIB'].encode(value)) == value
+
+        #Values which were never encoded are returned as they are
+        assert decode_value(ragged) is ragged
+
+    def test_compressed_values(self, client, monkeypatch):
+        """
+            Large values are stored compressed when compression is enabled,
+            and are returned as the original JSON.
+        """
+        get = hb.config.get
+        getint = hb.config.getint
+        monkeypatch.setattr(hb.config, 'get',
+                            lambda section, option, default=None:
+                            'Y' if option == 'compress_values' else get(section, option, default))
+        monkeypatch.setattr(hb.config, 'getint',
+                            lambda section, option, default=None:
+                            100 if option == 'compression_threshold' else getint(section, option, default))
+
+        timeseries = self._make_timeseries(500)
+        #Values which are not numbers can only be stored as text
+        text_timeseries = json.loads(self._make_timeseries(400))
+        text_timeseries = json.dumps({'0': dict((k, str(v)) for k, v in text_timeseries['0'].items())},
+                                     separators=(',', ':'))
+
+        datasets = hb.lib.data._bulk_insert_data([
+            JSONDataset({'name': 'Codec timeseries', 'type': 'timeseries',
+                         'value': timeseries, 'unit_id': None, 'metadata': {}}),
+            JSONDataset({'name': 'Codec text timeseries', 'type': 'timeseries',
+                         'value': text_timeseries, 'unit_id': None, 'metadata': {}}),
+            JSONDataset({'name': 'Codec scalar', 'type': 'scalar',
+                         'value': '1.5', 'unit_id': None, 'metadata': {}}),
+        ], user_id=pytest.root_user_id)
+        orm_dataset = hb.add_dataset('timeseries', self._make_timeseries(300),
+                                     name='Codec ORM timeseries',
+                                     user_id=pytest.root_user_id, flush=True)
+        assert orm_dataset.value == self._make_timeseries(300)
+        dataset_ids = [d.id for d in datasets] + [orm_dataset.id]
+        hb.commit_transaction()
+
+        stored_values = dict(hb.db.DBSession.execute(
+            "select id, value from tDataset where id in (%s)"%(",".join(str(i) for i in dataset_ids))).fetchall())
+
+        assert stored_values[dataset_ids[0]].startswith('HYDRA:FRAME:')
+        assert stored_values[dataset_ids[1]].startswith('HYDRA:ZLIB:')
+        assert stored_values[dataset_ids[2]] == '1.5'
+        assert stored_values[dataset_ids[3]].startswith('HYDRA:FRAME:')
+        assert len(stored_values[dataset_ids[0]]) < len(timeseries) / 3
+
+        hb.db.close_session()
+        assert client.get_dataset(dataset_ids[0]).value == timeseries
+        assert hb.get_dataset_values(dataset_ids[:2], user_id=pytest.root_user_id) == \
+                {str(dataset_ids[0]): timeseries, str(dataset_ids[1]): text_timeseries}
+
+        #Loading the timeseries from its buffers gives the same result as parsing it
+        dataset_i = hb.db.DBSession.query(hb.db.model.Dataset).filter(
+            hb.db.model.Dataset.id == dataset_ids[0]).one()
+        assert dataset_i.value == timeseries
+        assert dataset_i.value.frame is not None
+        pd.testing.assert_frame_equal(dataset_i.get_val(),
+                                      hb.util.get_val(JSONDataset({'type': 'timeseries', 'value': timeseries})))
+
+    def test_prefixed_plain_values(self, client):
+        """
+            Plain values which start with the prefix of encoded values are
+            stored escaped, and returned as they were, with compression disabled.
+        """
+        note = 'HYDRA:note for ops'
+        lookalike = 'HYDRA:ZLIB:' + 'A' * 8
+
+        datasets = hb.lib.data._bulk_insert_data([
+            JSONDataset({'name': 'Prefixed descriptor', 'type': 'descriptor',
+                         'value': note, 'unit_id': None, 'metadata': {}}),
+        ], user_id=pytest.root_user_id)
+        orm_dataset = hb.add_dataset('descriptor', lookalike, name='Prefixed ORM descriptor',
+                                     user_id=pytest.root_user_id, flush=True)
+        assert orm_dataset.value == lookalike
+        dataset_ids = [datasets[0].id, orm_dataset.id]
+        hb.commit_transaction()
+
+        stored_values = dict(hb.db.DBSession.execute(
+            "select id, value from tDataset where id in (%s)"%(",".join(str(i) for i in dataset_ids))).fetchall())
+        assert stored_values[dataset_ids[0]] == 'HYDRA:RAW:' + note
+        assert stored_values[dataset_ids[1]] == 'HYDRA:RAW:' + lookalike
+
+        hb.db.close_session()
+        assert client.get_dataset(dataset_ids[0]).value == note
+        assert client.get_dataset(dataset_ids[1]).value == lookalike
+
+        #Such values stored before they were escaped are returned as they are
+        assert decode_value(note) == note
+
 class TestDataCollection:
 
     def test_get_collections_like_name(self, client, network_with_dataset_collection):
@@ -849,3 +1305,72 @@ class TestiUtilities:
     ])
     def test_flatten_dict(self, client, test_input, expected):
         assert flatten_dict(test_input) == expected
+
+    def test_generate_data_hash_is_stable(self, client):
+        """
+            The hash must not depend on the process's hash seed, or
+            identical data inserted by different processes is not deduplicated.
+        """
+        dataset = dict(name='test', unit_id=None, type='scalar', value='1.5',
+                       metadata={'source': 'test', 'user_id': '1'})
+
+        script = ("from hydra_base.util import generate_data_hash;"
+                  "print(generate_data_hash(%r))"%(dataset,))
+        hashes = set()
+        for seed in ('1', '2'):
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            output = subprocess.check_output([sys.executable, '-c', script], env=env)
+            hashes.add(int(output.decode().strip().split('\n')[-1]))
+
+        assert hashes == set([generate_data_hash(dataset)])
+
+        #Metadata key order does not affect the hash
+        reordered = dict(dataset, metadata={'user_id': '1', 'source': 'test'})
+        assert generate_data_hash(reordered) == generate_data_hash(dataset)
+
+        assert generate_data_hash(dict(dataset, value='1.6')) != generate_data_hash(dataset)
+
+    def test_rehash_datasets(self, client, network_with_data):
+        """
+            Test that datasets with out of date hashes are rehashed
+        """
+        rs = network_with_data.scenarios[0].resourcescenarios[0]
+        dataset_id = rs.dataset.id
+
+        dataset_i = hb.db.DBSession.query(hb.db.model.Dataset).filter(
+            hb.db.model.Dataset.id == dataset_id).one()
+        correct_hash = dataset_i.set_hash()
+        dataset_i.hash = 123456789
+        hb.commit_transaction()
+
+        num_updated = hb.util.hdb.rehash_datasets(chunk_size=10)
+        assert num_updated >= 1
+
+        hb.db.close_session()
+        dataset_i = hb.db.DBSession.query(hb.db.model.Dataset).filter(
+            hb.db.model.Dataset.id == dataset_id).one()
+        assert dataset_i.hash == correct_hash
+
+        #Running again changes nothing
+        assert hb.util.hdb.rehash_datasets() == 0
+
+    def test_make_json_objects(self, client):
+        """
+            Building objects from rows in bulk must give the same
+            result as building a JSONObject from each row.
+        """
+        keys = ['id', 'name', 'x', 'cr_date', 'layout', 'description', 'value', 'flag']
+        rows = [
+            (1, 'Node 1', Decimal('1.5'), datetime.datetime(2020, 1, 1), '{"a": 1}', None, 1.5, True),
+            (2, '2', Decimal('2'), datetime.datetime(2020, 1, 2), None, '1.5', 'nan', 'N'),
+            (3, 'Node 3', None, None, '"{\\"b\\": 2}"', '', '1e3', None),
+        ]
+        extras = {'types': [], 'attributes': []}
+
+        objects = make_json_objects(rows, keys, extras=extras)
+
+        for row, obj in zip(rows, objects):
+            expected = JSONObject(dict(zip(keys, row)), extras=extras)
+            assert json.dumps(obj, sort_keys=True) == json.dumps(expected, sort_keys=True)
+            assert isinstance(obj, JSONObject)
+            assert obj.name == expected.name
@@ -4,6 +4,7 @@ import datetime
 import collections
 
 import hydra_base as hb
+import numpy as np
 import pandas as pd
 
 from hydra_base.exceptions import HydraError
@@ -29,8 +30,19 @@ scalar_invalid_values     = [ "one", pd, {} ]
 array_valid_values        = [ [-2, -1, 0, 1, 2], list(range(32)), [ 0.5e-3, 0.5, 0.5e3 ] ]
 array_invalid_values      = [ generator(32), 77, {}, "justastring" ]
 
-timeseries_valid_values   = [ {"0": {"1979 Feb 2 0100":7, "01:00 2 Feb 1979":9}}, {"0":{"2012":12, "2013":13, "2014":14}}, {"0":{"18:00 31 August 1977":100}} ]
-timeseries_invalid_values = [ "otheriterable", list(range(12)), {"JAN":1, "FEB":2, "MAR":3, "APR":4}, set(), ["01:00 30 Feb 1979"] ]
+timeseries_valid_values   = [ {"0": {"1979 Feb 2 0100":7, "01:00 2 Feb 1979":9}}, {"0":{"2012":12, "2013":13, "2014":14}}, {"0":{"18:00 31 August 1977":100}},
+                              {"0":{"9999-01-01":1, "9999-02-01":2}}, {"0":{"2000-01-01T00:00:00.000000000Z":1, "2000-01-01T01:00:00.000000000Z":2}} ]
+timeseries_invalid_values = [ "otheriterable", list(range(12)), {"JAN":1, "FEB":2, "MAR":3, "APR":4}, set(), ["01:00 30 Feb 1979"],
+                              {"0":{"2012":12, "not a date":13}}, {"0":{"NaT":1}} ]
+
+regular_timeseries_valid_values   = [ {"0": {"2000-01-01": 1.5, "2000-01-02": 2.5, "2000-01-03": 3.5}}, {"a": {"2000-01-01T00:00": 1, "2000-01-01T01:00": 2}},
+                                      {"0": {"9999-01-01": 1, "9999-02-01": 2, "9999-03-01": 3}} ]
+regular_timeseries_invalid_values = [ {"0": {"2000-01-01": 1, "2000-01-02": 2, "2000-01-04": 3}}, {"0": {"2000-01-01": "a", "2000-01-02": "b"}},
+                                      {"0": {"2000-01-01": 1}}, {"start": "2000-01-01", "frequency": "D", "length": 3, "columns": {}} ]
+
+tensor_valid_values       = [ [-2, -1, 0, 1, 2], [[0.5, 1.5], [2.5, 3.5]], [[[True, False]], [[False, True]]], [[[1] * 24] * 12] * 3 ]
+tensor_invalid_values     = [ [], [[1, 2], [3]], ["one", "two"], 77, {"dtype": "float64", "shape": [3], "data": ""},
+                              {"dtype": "object", "shape": [1], "data": "AA=="} ]
 
 dataframe_valid_values    = [ {"data" : {"fr": "ame"}}, {"one": ["first"], "two": ["second"]}, {"n":{"e":{"s":{"t":{"e":"d"}}}}} ]
 dataframe_invalid_values  = [ 77, set(), {"one": "first", "two": "second"} ]
@@ -114,6 +126,52 @@ def test_fail_create_timeseries(value):
         timeseries_dataset = hb.lib.objects.Dataset({'type':'timeseries', 'value': json.dumps(value)})
         value = timeseries_dataset.parse_value()
 
+""" Regular timeseries type tests """
+
+@pytest.mark.parametrize("value", regular_timeseries_valid_values)
+def test_create_regular_timeseries(value):
+    regular_dataset = hb.lib.objects.Dataset({'type':'regular_timeseries', 'value': json.dumps(value)})
+    packed = regular_dataset.parse_value()
+
+    #The packed value gives the same frame as the timeseries it was made from
+    timeseries = HydraObjectFactory.fromDataset('timeseries', json.dumps(value))
+    regular = HydraObjectFactory.fromDataset('regular_timeseries', packed)
+    assert json.loads(packed)['length'] == len(timeseries._value)
+    assert regular.value == packed
+    converted = json.loads(regular.toTimeseries())
+    assert {k: list(v.values()) for k, v in converted.items()} == \
+            {k: list(v.values()) for k, v in value.items()}
+    assert [pd.Timestamp(d.replace('9999', '1678')) for d in list(converted.values())[0]] == \
+            [pd.Timestamp(d.replace('9999', '1678')) for d in list(value.values())[0]]
+
+
+@pytest.mark.parametrize("value", regular_timeseries_invalid_values)
+def test_fail_create_regular_timeseries(value):
+    with pytest.raises( (HydraError, TypeError, ValueError) ):
+        regular_dataset = hb.lib.objects.Dataset({'type':'regular_timeseries', 'value': json.dumps(value)})
+        value = regular_dataset.parse_value()
+
+""" Tensor type tests """
+
+@pytest.mark.parametrize("value", tensor_valid_values)
+def test_create_tensor(value):
+    tensor_dataset = hb.lib.objects.Dataset({'type':'tensor', 'value': json.dumps(value)})
+    packed = tensor_dataset.parse_value()
+
+    tensor = HydraObjectFactory.fromDataset('tensor', packed)
+    assert tensor.value == packed
+    assert tensor.shape == np.array(value).shape
+    assert tensor.get_array().tolist() == value
+    assert not tensor.get_array().flags.writeable
+    assert json.loads(tensor.toArray()) == value
+
+
+@pytest.mark.parametrize("value", tensor_invalid_values)
+def test_fail_create_tensor(value):
+    with pytest.raises( (HydraError, TypeError, ValueError) ):
+        tensor_dataset = hb.lib.objects.Dataset({'type':'tensor', 'value': json.dumps(value)})
+        value = tensor_dataset.parse_value()
+
 """ DataFrame type tests """
 
 @pytest.mark.parametrize("value", dataframe_valid_values)
@@ -127,3 +185,31 @@ def test_fail_create_dataframe(value):
     with pytest.raises( (HydraError, TypeError, ValueError) ):
         dataframe_dataset = hb.lib.objects.Dataset({'type':'dataframe', 'value': json.dumps(value)})
         value = dataframe_dataset.parse_value()
+
+""" JSON backend tests """
+
+@pytest.fixture(params=["json", "auto"])
+def json_backend(request):
+    from hydra_base.util import jsonutil
+    jsonutil.configure_backend(request.param)
+    yield jsonutil
+    jsonutil.configure_backend()
+
+def test_json_backend(json_backend):
+    value = {"b": [1, 2.5, None, True], "a": {"z": "ü", "y": {}}}
+    text = json_backend.dumps(value)
+    assert text == json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    assert list(json_backend.loads(text)) == ["b", "a"]
+    assert json_backend.loads(text) == value
+    assert json_backend.dumps(value, sort_keys=True).startswith('{"a"')
+
+    #Text and values the standard library accepts are handled by it
+    assert json_backend.loads('[NaN, 123456789012345678901234567890]')[1] == 123456789012345678901234567890
+    assert json_backend.dumps({1: datetime.date(2000, 1, 1)}, default=str) == '{"1":"2000-01-01"}'
+    assert isinstance(json_backend.loads('{"a": 1}', object_pairs_hook=collections.OrderedDict),
+                      collections.OrderedDict)
+
+    with pytest.raises(ValueError):
+        json_backend.loads('{"a": ')
+    with pytest.raises(TypeError):
+        json_backend.dumps({"a": datetime.date(2000, 1, 1)})
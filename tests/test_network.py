@@ -184,6 +184,198 @@ class TestNetwork:
         assert net_exists == 'Y'
         assert full_network.projection == 'EPSG:21781'
 
+    def test_iter_network(self, client, network_with_data):
+        """
+            Test that streaming a network in small chunks returns the same
+            resources and data as loading it in one go with get_network.
+        """
+        net = network_with_data
+
+        full_network = client.get_network(net.id, include_data='Y')
+
+        chunks = client.iter_network(net.id, include_data='Y', chunk_size=3)
+
+        sections = {}
+        for chunk in chunks:
+            sections.setdefault(chunk.section, []).extend(chunk['items'])
+
+        assert len(sections['network']) == 1
+        assert sections['network'][0].id == net.id
+        assert len(sections['network'][0].attributes) == len(full_network.attributes)
+
+        for section in ('nodes', 'links', 'resourcegroups'):
+            streamed = sorted(sections[section], key=lambda r: r.id)
+            loaded = sorted(full_network[section], key=lambda r: r.id)
+            assert [r.id for r in streamed] == [r.id for r in loaded]
+            for s, l in zip(streamed, loaded):
+                assert len(s.attributes) == len(l.attributes)
+                assert len(s.types) == len(l.types)
+
+        assert len(sections['scenario']) == len(full_network.scenarios)
+
+        full_rs = full_network.scenarios[0].resourcescenarios
+        assert len(sections['resourcescenarios']) == len(full_rs)
+
+        streamed_values = dict((rs.resource_attr_id, rs.dataset.value)
+                               for rs in sections['resourcescenarios'])
+        for rs in full_rs:
+            assert streamed_values[rs.resource_attr_id] == rs.dataset.value
+
+    def test_get_network_columnar(self, client, network_with_data):
+        """
+            Test that a network retrieved in columnar format contains the same
+            resources and data as one retrieved as objects.
+        """
+        net = network_with_data
+
+        full_network = client.get_network(net.id, include_data='Y')
+        columnar_network = client.get_network(net.id, include_data='Y', result_format='columnar')
+
+        for section in ('nodes', 'links', 'resourcegroups'):
+            assert sorted(columnar_network[section]['id'].tolist()) == \
+                    sorted([r.id for r in full_network[section]])
+
+        node_x = dict(zip(columnar_network.nodes['id'].tolist(), columnar_network.nodes['x'].tolist()))
+        for n in full_network.nodes:
+            assert node_x[n.id] == n.x
+
+        num_attributes = len(full_network.attributes)
+        for section in ('nodes', 'links', 'resourcegroups'):
+            for r in full_network[section]:
+                num_attributes += len(r.attributes)
+        assert len(columnar_network.attributes['id']) == num_attributes
+
+        full_rs = full_network.scenarios[0].resourcescenarios
+        columnar_rs = columnar_network.scenarios[0].resourcescenarios
+        assert len(columnar_rs['resource_attr_id']) == len(full_rs)
+
+        values = dict(zip(columnar_rs['resource_attr_id'].tolist(), columnar_rs['value'].tolist()))
+        for rs in full_rs:
+            assert values[rs.resource_attr_id] == rs.dataset.value
+
+        resource_data = client.get_all_resource_data(net.scenarios[0].id)
+        columnar_data = client.get_all_resource_data(net.scenarios[0].id,
+                                                     include_metadata='Y',
+                                                     result_format='columnar')
+        assert sorted(columnar_data['resource_attr_id'].tolist()) == \
+                sorted([rd.resource_attr_id for rd in resource_data])
+        assert len(columnar_data['metadata']) == len(resource_data)
+
+    def test_get_network_lazy_data(self, client, network_with_data):
+        """
+            Test getting a network's data without values, then getting
+            the values separately.
+        """
+        net = network_with_data
+
+        full_net = client.get_network(net.id, include_data='Y')
+        lazy_net = client.get_network(net.id, include_data='L')
+
+        full_rs = full_net.scenarios[0].resourcescenarios
+        lazy_rs = lazy_net.scenarios[0].resourcescenarios
+
+        assert len(lazy_rs) == len(full_rs) > 0
+        for rs in lazy_rs:
+            assert rs.dataset.value is None
+            assert rs.dataset.type is not None
+            assert rs.dataset.hash is not None
+
+        dataset_ids = [rs.dataset.id for rs in lazy_rs]
+        assert len(client.get_dataset_values(dataset_ids)) == len(set(dataset_ids))
+
+        #Call directly, as the client converts the values.
+        values = hb.get_dataset_values(dataset_ids, user_id=pytest.root_user_id)
+        for rs in full_rs:
+            assert values[str(rs.dataset.id)] == rs.dataset.value
+
+        #Streamed networks also support lazy data
+        chunks = client.iter_network(net.id, include_data='L')
+        streamed_rs = [rs for c in chunks if c.section == 'resourcescenarios' for rs in c['items']]
+        assert len(streamed_rs) == sum(len(s.resourcescenarios) for s in full_net.scenarios)
+        assert all(rs.dataset.value is None for rs in streamed_rs)
+
+    def test_get_network_concurrently(self, client, network_with_data, monkeypatch):
+        """
+            Test that loading a network over several connections gives the
+            same result as loading it over one.
+        """
+        net = network_with_data
+
+        serial_net = client.get_network(net.id, include_data='Y')
+        serial_columns = hb.get_network(net.id, include_data='Y', result_format='columnar',
+                                        user_id=pytest.root_user_id)
+
+        getint = hb.config.getint
+        monkeypatch.setattr(hb.config, 'getint',
+                            lambda section, option, default=None:
+                            4 if option == 'network_load_workers' else getint(section, option, default))
+
+        assert hb.lib.network._get_network_load_workers() == 4
+
+        concurrent_net = client.get_network(net.id, include_data='Y')
+        assert concurrent_net == serial_net
+
+        concurrent_columns = hb.get_network(net.id, include_data='Y', result_format='columnar',
+                                            user_id=pytest.root_user_id)
+        assert len(concurrent_columns.scenarios) == len(serial_columns.scenarios)
+        for s1, s2 in zip(concurrent_columns.scenarios, serial_columns.scenarios):
+            assert sorted(s1.resourcescenarios['dataset_id'].tolist()) == \
+                    sorted(s2.resourcescenarios['dataset_id'].tolist())
+
+    @pytest.mark.parametrize("backend", ["memory", "file"])
+    def test_network_cache(self, client, network_with_data, backend, tmpdir):
+        """
+            Test that cached network snapshots are invalidated by writes
+            to the network.
+        """
+        net = network_with_data
+
+        cache = hb.util.cache.configure_network_cache(backend, directory=str(tmpdir))
+        try:
+            net_1 = client.get_network(net.id, include_data='Y')
+            assert cache.memory.size > 0
+
+            net_2 = client.get_network(net.id, include_data='Y')
+            assert net_2 == net_1
+
+            #Through the ORM
+            node_to_update = net_2.nodes[0]
+            node_to_update.name = "Updated Node Name"
+            client.update_node(node_to_update)
+
+            net_3 = client.get_network(net.id, include_data='Y')
+            assert "Updated Node Name" in [n.name for n in net_3.nodes]
+
+            #Through the bulk insert
+            client.add_nodes(net.id, [hb.JSONObject({'id': -1,
+                                                     'name': 'New Cached Node',
+                                                     'x': 0,
+                                                     'y': 0,
+                                                     'attributes': []})])
+
+            net_4 = client.get_network(net.id, include_data='Y')
+            assert len(net_4.nodes) == len(net_3.nodes) + 1
+
+            #Updating data
+            scenario = net_4.scenarios[0]
+            rs_to_update = scenario.resourcescenarios[0]
+            rs_to_update.dataset.value = 123.456
+            rs_to_update.dataset.type = 'scalar'
+            client.update_resourcedata(scenario.id, [rs_to_update])
+
+            net_5 = client.get_network(net.id, include_data='Y')
+            updated_rs = [rs for rs in net_5.scenarios[0].resourcescenarios
+                          if rs.resource_attr_id == rs_to_update.resource_attr_id][0]
+            assert float(updated_rs.dataset.value) == 123.456
+
+            #Through the bulk scenario inserts of an ensemble
+            client.create_scenario_ensemble(scenario.id, [{'name': 'Cached ensemble member'}])
+
+            net_6 = client.get_network(net.id, include_data='Y')
+            assert len(net_6.scenarios) == len(net_5.scenarios) + 1
+        finally:
+            hb.util.cache.configure_network_cache('none')
+
     def test_get_extents(self, client, network_with_data):
         """
         Extents test: Test that the min X, max X, min Y and max Y of a
@@ -198,6 +390,52 @@ class TestNetwork:
         assert extents.min_y == 9
         assert extents.max_y == 99
 
+    @pytest.mark.parametrize("backend", ["none", "memory"])
+    def test_get_resources_in_extent(self, client, network_with_data, backend, monkeypatch):
+        """
+            Test that the nodes and links within a bounding box are
+            the same as those found by checking every node and link.
+            Without a network cache, they are queried rather than indexed.
+        """
+        net = client.get_network(network_with_data.id)
+        nodes = dict((n.id, n) for n in net.nodes)
+
+        def in_box(x, y, box):
+            return box[0] <= float(x) <= box[2] and box[1] <= float(y) <= box[3]
+
+        def link_in_box(link, box):
+            n1, n2 = nodes[link.node_1_id], nodes[link.node_2_id]
+            xs = sorted([float(n1.x), float(n2.x)])
+            ys = sorted([float(n1.y), float(n2.y)])
+            return xs[0] <= box[2] and xs[1] >= box[0] and ys[0] <= box[3] and ys[1] >= box[1]
+
+        indexed = []
+        for index_func in ('_get_node_index', '_get_link_index'):
+            def spy(network_id, index_func=getattr(hb.lib.network, index_func)):
+                indexed.append(network_id)
+                return index_func(network_id)
+            monkeypatch.setattr(hb.lib.network, index_func, spy)
+
+        hb.util.cache.configure_network_cache(backend)
+        try:
+            for box in [(10, 9, 100, 99), (20, 20, 60, 50), (0, 0, 15, 15), (200, 200, 300, 300)]:
+                node_ids = [n.id for n in client.get_nodes_in_extent(net.id, *box)]
+                assert sorted(node_ids) == sorted(n.id for n in net.nodes if in_box(n.x, n.y, box))
+
+                link_ids = [l.id for l in client.get_links_in_extent(net.id, *box)]
+                assert sorted(link_ids) == sorted(l.id for l in net.links if link_in_box(l, box))
+
+            #Moving a node moves it in the index
+            node = net.nodes[0]
+            node.x = 500
+            node.y = 500
+            client.update_node(node)
+            assert [n.id for n in client.get_nodes_in_extent(net.id, 499, 499, 501, 501)] == [node.id]
+
+            assert (len(indexed) > 0) == (backend != 'none')
+        finally:
+            hb.util.cache.configure_network_cache('none')
+
     def test_update_network(self, client, network_with_data):
 
         net = hb.JSONObject(client.get_network(network_with_data.id))
@@ -776,6 +1014,73 @@ class TestNetwork:
         result = client.validate_network_topology(network.id)
         assert len(result) == 1#This means orphan nodes are present
 
+    def test_validate_topology_uses_graph(self, client, network_with_data, monkeypatch):
+        """
+            Test that the topology is validated using the graph of the network,
+            rather than by loading its nodes and links.
+        """
+        get_network_graph = hb.lib.network._get_network_graph
+        graph_network_ids = []
+        def spy(network_id):
+            graph_network_ids.append(network_id)
+            return get_network_graph(network_id)
+        monkeypatch.setattr(hb.lib.network, '_get_network_graph', spy)
+
+        assert len(client.validate_network_topology(network_with_data.id)) == 0
+        assert graph_network_ids == [network_with_data.id]
+
+    def test_topology_queries(self, client, projectmaker):
+        """
+            Test the connected components, tracing and shortest paths of a network:
+            A -> B -> C -> D, B -> E -> D, F -> G and an isolated node H
+        """
+        project = projectmaker.create('test')
+        network = hb.JSONObject({'project_id': project.id,
+                                 'name': 'Topology @ %s'%(datetime.datetime.now()),
+                                 'description': 'A network for topology tests'})
+
+        names = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
+        network.nodes = [hb.JSONObject({'id': -(i+1), 'name': n, 'x': i, 'y': 0})
+                         for i, n in enumerate(names)]
+        node_ids = dict((n, -(i+1)) for i, n in enumerate(names))
+        link_ends = [('A', 'B'), ('B', 'C'), ('C', 'D'), ('B', 'E'), ('E', 'D'), ('F', 'G')]
+        network.links = [hb.JSONObject({'id': -(i+1), 'name': '%s-%s'%(n1, n2),
+                                        'node_1_id': node_ids[n1], 'node_2_id': node_ids[n2]})
+                         for i, (n1, n2) in enumerate(link_ends)]
+
+        network = client.add_network(network)
+        new_net = client.get_network(network.id)
+        ids = dict((n.name, n.id) for n in new_net.nodes)
+        names_by_id = dict((v, k) for k, v in ids.items())
+        link_ids = dict((l.name, l.id) for l in new_net.links)
+
+        assert set(client.validate_network_topology(network.id)) == set([ids['H']])
+
+        components = client.get_network_components(network.id)
+        assert [sorted(names_by_id[n] for n in c) for c in components] == \
+                [['A', 'B', 'C', 'D', 'E'], ['F', 'G'], ['H']]
+
+        downstream = client.get_downstream_nodes(network.id, ids['B'])
+        assert dict((names_by_id[int(k)], v) for k, v in downstream.items()) == \
+                {'C': 1, 'E': 1, 'D': 2}
+        downstream = client.get_downstream_nodes(network.id, ids['A'], max_depth=1)
+        assert [names_by_id[int(k)] for k in downstream] == ['B']
+
+        upstream = client.get_upstream_nodes(network.id, ids['D'])
+        assert set(names_by_id[int(k)] for k in upstream) == set(['A', 'B', 'C', 'E'])
+
+        path = client.get_shortest_path(network.id, ids['A'], ids['D'])
+        assert [names_by_id[n] for n in path['nodes']] in (['A', 'B', 'C', 'D'], ['A', 'B', 'E', 'D'])
+        assert path['links'][0] == link_ids['A-B']
+
+        assert client.get_shortest_path(network.id, ids['D'], ids['A']) is None
+        path = client.get_shortest_path(network.id, ids['D'], ids['A'], directed='N')
+        assert len(path['nodes']) == 4
+
+        #Deleting a link changes the topology
+        client.delete_link(link_ids['F-G'], purge_data=True)
+        assert set(client.validate_network_topology(network.id)) == set([ids['F'], ids['G'], ids['H']])
+
     def test_consistency_of_update(self, client, network_with_data):
         """
             Test to ensure that updating a network which has not changed
@@ -900,6 +1205,46 @@ class TestNetwork:
         truncated_resource_data = client.get_all_resource_data(s.id, include_values='Y', include_metadata='Y', page_start=0, page_end=1)
         assert len(truncated_resource_data) == 1
 
+    def test_get_resource_data_pages(self, client, network_with_data):
+        """
+            Test that reading the data of a scenario a page at a time, by
+            position, by key or as a stream, returns the same data as reading it all.
+        """
+        s = network_with_data.scenarios[0]
+
+        all_resource_data = client.get_all_resource_data(s.id, include_metadata='Y')
+        all_ra_ids = [rd.resource_attr_id for rd in all_resource_data]
+        assert all_ra_ids == sorted(all_ra_ids)
+        assert len(all_ra_ids) > 5
+
+        page = client.get_all_resource_data(s.id, page_start=2, page_end=5)
+        assert [rd.resource_attr_id for rd in page] == all_ra_ids[2:5]
+
+        keyset_ids = []
+        last_id = None
+        while True:
+            page = client.get_all_resource_data(s.id, start_after=last_id, page_size=4)
+            if len(page) == 0:
+                break
+            keyset_ids.extend(rd.resource_attr_id for rd in page)
+            last_id = page[-1].resource_attr_id
+        assert keyset_ids == all_ra_ids
+
+        chunks = list(hb.lib.network.iter_all_resource_data(s.id,
+                                                            include_metadata='Y',
+                                                            chunk_size=3,
+                                                            user_id=pytest.root_user_id))
+        assert all(len(c) <= 3 for c in chunks)
+        streamed = [rd for c in chunks for rd in c]
+        assert [rd.resource_attr_id for rd in streamed] == all_ra_ids
+
+        #Call directly, as the client doesn't convert the metadata.
+        all_resource_data = hb.get_all_resource_data(s.id, include_metadata='Y',
+                                                     user_id=pytest.root_user_id)
+        assert [sorted(m.key for m in rd.metadata) for rd in streamed] == \
+                [sorted(m.key for m in rd.metadata) for rd in all_resource_data]
+        assert sum(len(rd.metadata) for rd in streamed) > 0
+
 
 
 
@@ -1035,6 +1380,52 @@ class TestNetwork:
         cloned_network = client.get_network(cloned_network_id, include_data=True)
         assert cloned_network.name == 'My New Name'
 
+    def test_clone_network_contents(self, client, network_with_data):
+        """
+            Test that a cloned network has the same topology, types, group items
+            and input data as the original, mapped onto the new resources.
+        """
+        net = client.get_network(network_with_data.id, include_data='Y')
+
+        cloned_network_id = client.clone_network(net.id,
+                                                 new_network_name='Contents Clone',
+                                                 new_project=False,
+                                                 include_outputs=True)
+
+        cloned_net = client.get_network(cloned_network_id, include_data='Y')
+
+        def describe(network):
+            node_names = dict((n.id, n.name) for n in network.nodes)
+            link_names = dict((l.id, l.name) for l in network.links)
+            group_names = dict((g.id, g.name) for g in network.resourcegroups)
+            resource_names = {}
+            for ref_key, resources in (('NETWORK', [network]),
+                                       ('NODE', network.nodes),
+                                       ('LINK', network.links),
+                                       ('GROUP', network.resourcegroups)):
+                for r in resources:
+                    for ra in r.attributes:
+                        resource_names[ra.id] = (ref_key, r.name, ra.attr_id)
+
+            return dict(
+                links=sorted((l.name, node_names[l.node_1_id], node_names[l.node_2_id])
+                             for l in network.links),
+                types=sorted((r.name, t.type_id) for r in network.nodes + network.links
+                             for t in r.types),
+                scenarios=dict((s.name, dict(
+                    data=sorted((resource_names[rs.resource_attr_id], rs.dataset.id)
+                                for rs in s.resourcescenarios),
+                    items=sorted((group_names[i.group_id], i.ref_key,
+                                  node_names.get(i.node_id), link_names.get(i.link_id))
+                                 for i in s.resourcegroupitems)))
+                               for s in network.scenarios))
+
+        original = describe(net)
+        assert all(len(s['data']) > 0 and len(s['items']) > 0 for s in original['scenarios'].values())
+
+        assert set(n.id for n in cloned_net.nodes).isdisjoint(set(n.id for n in net.nodes))
+        assert describe(cloned_net) == original
+
     def test_clone_network_into_new_project(self, client, network_with_data):
         net = network_with_data
 
@@ -291,6 +291,85 @@ class TestScenario:
                     assert str(u_rs.dataset.value) == str(rs.dataset.value)
                     break
 
+    def test_update_resourcedata_many(self, client, network_with_data):
+        """
+            Test updating many resource scenarios at once, including unchanged
+            values, identical new values and resource scenarios which don't exist yet.
+        """
+        network = network_with_data
+
+        scenario = client.get_scenario(network.scenarios[0].id)
+
+        scalar_rs = [rs for rs in scenario.resourcescenarios if rs.dataset.type == 'scalar']
+        assert len(scalar_rs) > 3
+
+        unchanged_rs = scalar_rs[0]
+        same_value_rs = scalar_rs[1:3]
+        new_rs = scalar_rs[3]
+
+        #Remove one resource scenario so it is re-created
+        new_rs_value = new_rs.dataset
+        new_rs.dataset = None
+        client.update_resourcedata(scenario.id, [new_rs])
+
+        for rs in same_value_rs:
+            rs.dataset.name = 'Same value'
+            rs.dataset.value = '987.654'
+            rs.dataset.unit_id = None
+            rs.dataset.metadata = {}
+
+        new_rs.dataset = new_rs_value
+        new_rs.dataset.value = '123.456'
+
+        updated = client.update_resourcedata(scenario.id,
+                                             [unchanged_rs] + same_value_rs + [new_rs])
+
+        assert [rs.resource_attr_id for rs in updated] == \
+                [rs.resource_attr_id for rs in [unchanged_rs] + same_value_rs + [new_rs]]
+
+        updated_scenario = client.get_scenario(scenario.id)
+        updated_rs = dict((rs.resource_attr_id, rs) for rs in updated_scenario.resourcescenarios)
+
+        assert len(updated_scenario.resourcescenarios) == len(scenario.resourcescenarios)
+
+        assert updated_rs[unchanged_rs.resource_attr_id].dataset.id == unchanged_rs.dataset.id
+
+        same_value_ids = set()
+        for rs in same_value_rs:
+            assert float(updated_rs[rs.resource_attr_id].dataset.value) == 987.654
+            same_value_ids.add(updated_rs[rs.resource_attr_id].dataset.id)
+        assert len(same_value_ids) == 1
+
+        assert float(updated_rs[new_rs.resource_attr_id].dataset.value) == 123.456
+
+    def test_update_resourcedata_metadata(self, client, network_with_data):
+        """
+            Test that updating a dataset used by only one resource scenario
+            updates it in place, replacing its metadata as Dataset.set_metadata
+            does: keys which are not in the new metadata are removed.
+        """
+        network = network_with_data
+
+        scenario = client.get_scenario(network.scenarios[0].id)
+
+        rs = [rs for rs in scenario.resourcescenarios if rs.dataset.type == 'scalar'][0]
+        rs.dataset.value = '1357.9'
+        rs.dataset.metadata = {'keep': 'yes', 'drop': 'yes'}
+        client.update_resourcedata(scenario.id, [rs])
+
+        dataset = client.get_resource_scenario(rs.resource_attr_id, scenario.id).dataset
+        assert dataset.metadata['drop'] == 'yes'
+
+        rs.dataset.value = '2468.0'
+        rs.dataset.metadata = {'keep': 'updated'}
+        client.update_resourcedata(scenario.id, [rs])
+
+        updated = client.get_resource_scenario(rs.resource_attr_id, scenario.id).dataset
+        assert updated.id == dataset.id
+        assert float(updated.value) == 2468.0
+        assert updated.metadata['keep'] == 'updated'
+        assert 'drop' not in updated.metadata
+
     def test_update_resourcedata_single_dataset_update_and_delete(self, client, network_with_data):
         """
             Test to ensure update_resourcedata does not update other
@@ -614,6 +693,210 @@ class TestScenario:
 
         return updated_network
 
+    def test_copy_on_write_clone(self, client, network_with_data):
+        """
+            Test that a copy-on-write clone shares the data of its source,
+            stores only what is written to it, and is flattened before
+            its source is changed.
+        """
+        ResourceScenario = hydra_base.db.model.ResourceScenario
+
+        def num_stored(scenario_id):
+            return hydra_base.db.DBSession.query(ResourceScenario).filter(
+                ResourceScenario.scenario_id == scenario_id).count()
+
+        def dataset_ids(scenario_id):
+            scenario = client.get_scenario(scenario_id)
+            return dict((rs.resource_attr_id, rs.dataset.id) for rs in scenario.resourcescenarios)
+
+        network = client.get_network(network_with_data.id, include_data='Y')
+        scenario = network.scenarios[0]
+        original_data = dataset_ids(scenario.id)
+
+        clone = client.clone_scenario(scenario.id, retain_results=True, copy_on_write=True)
+        assert clone.copy_on_write == 'Y'
+        assert num_stored(clone.id) == 0
+        assert dataset_ids(clone.id) == original_data
+        assert len(client.compare_scenarios(scenario.id, clone.id).resourcescenarios) == 0
+
+        cloned_network = client.get_network(network.id, include_data='Y')
+        cloned_scenario = [s for s in cloned_network.scenarios if s.id == clone.id][0]
+        assert len(cloned_scenario.resourcescenarios) == len(original_data)
+        assert len(cloned_scenario.resourcegroupitems) == len(scenario.resourcegroupitems)
+
+        group_diff = client.compare_scenarios(scenario.id, clone.id).groups
+        assert len(group_diff.scenario_1_items) == 0
+        assert len(group_diff.scenario_2_items) == 0
+
+        #The shared data and group items are loaded without the source
+        clone_network = client.get_network(network.id, include_data='Y', scenario_ids=[clone.id])
+        assert [s.id for s in clone_network.scenarios] == [clone.id]
+        assert len(clone_network.scenarios[0].resourcescenarios) == len(original_data)
+        assert len(clone_network.scenarios[0].resourcegroupitems) == len(scenario.resourcegroupitems)
+
+        for scenario_ids in (None, [clone.id]):
+            columnar_network = client.get_network(network.id, include_data='Y',
+                                                  scenario_ids=scenario_ids,
+                                                  result_format='columnar')
+            columnar_scenario = [s for s in columnar_network.scenarios if s.id == clone.id][0]
+            assert sorted(columnar_scenario.resourcescenarios['resource_attr_id'].tolist()) == \
+                    sorted(original_data)
+            assert len(columnar_scenario.resourcegroupitems['id']) == len(scenario.resourcegroupitems)
+
+        sections = {}
+        for chunk in client.iter_network(network.id, include_data='Y', scenario_ids=[clone.id]):
+            sections.setdefault(chunk.section, []).extend(chunk['items'])
+        assert dict((rs.resource_attr_id, rs.dataset_id)
+                    for rs in sections['resourcescenarios']) == original_data
+        assert len(sections['resourcegroupitems']) == len(scenario.resourcegroupitems)
+
+        #A full clone of a copy-on-write clone copies what it shares
+        full_clone = client.clone_scenario(clone.id, retain_results=True)
+        assert num_stored(full_clone.id) == len(original_data)
+        assert dataset_ids(full_clone.id) == original_data
+        assert len(client.get_scenario(full_clone.id).resourcegroupitems) == \
+                len(scenario.resourcegroupitems)
+
+        #Writing to the clone stores only what is written
+        scalar_rs = [rs for rs in scenario.resourcescenarios if rs.dataset.type == 'scalar'][0]
+        new_scalar = Dataset(dict(scalar_rs.dataset))
+        new_scalar.value = float(scalar_rs.dataset.value) + 1
+        client.add_data_to_attribute(clone.id, scalar_rs.resource_attr_id, new_scalar)
+
+        assert num_stored(clone.id) == 1
+        assert dataset_ids(scenario.id) == original_data
+        scenario_diff = client.compare_scenarios(scenario.id, clone.id)
+        assert [d.resource_attr_id for d in scenario_diff.resourcescenarios] == [scalar_rs.resource_attr_id]
+
+        #Writing to the source first copies its data into the clone
+        descriptor_rs = [rs for rs in scenario.resourcescenarios if rs.dataset.type == 'descriptor'][0]
+        new_descriptor = Dataset(dict(descriptor_rs.dataset))
+        new_descriptor.value = 'A new value'
+        client.add_data_to_attribute(scenario.id, descriptor_rs.resource_attr_id, new_descriptor)
+
+        clone_data = dataset_ids(clone.id)
+        assert num_stored(clone.id) == len(original_data)
+        assert clone_data[descriptor_rs.resource_attr_id] == descriptor_rs.dataset.id
+        assert clone_data[scalar_rs.resource_attr_id] != scalar_rs.dataset.id
+        assert client.get_scenario(clone.id).copy_on_write == 'N'
+
+        #A clone can be flattened explicitly
+        clone_2 = client.clone_scenario(scenario.id, retain_results=True, copy_on_write=True)
+        client.flatten_scenario(clone_2.id)
+        assert num_stored(clone_2.id) == len(original_data)
+        assert dataset_ids(clone_2.id) == dataset_ids(scenario.id)
+        assert len(client.get_scenario(clone_2.id).resourcegroupitems) == len(scenario.resourcegroupitems)
+
+    def test_copy_on_write_clone_deletes(self, client, network_with_data):
+        """
+            Test that data and group items a copy-on-write clone shares with its
+            source can be removed from the clone, without changing the source.
+        """
+        def dataset_ids(scenario_id):
+            scenario = client.get_scenario(scenario_id)
+            return dict((rs.resource_attr_id, rs.dataset.id) for rs in scenario.resourcescenarios)
+
+        def group_items(scenario_id, group_id):
+            return sorted((i.ref_key, i.node_id, i.link_id, i.subgroup_id)
+                          for i in client.get_scenario(scenario_id).resourcegroupitems
+                          if i.group_id == group_id)
+
+        network = client.get_network(network_with_data.id, include_data='Y')
+        scenario = network.scenarios[0]
+        original_data = dataset_ids(scenario.id)
+        ra_ids = list(original_data)
+
+        #Deleting data from a clone
+        clone = client.clone_scenario(scenario.id, retain_results=True, copy_on_write=True)
+        client.delete_resource_scenario(clone.id, ra_ids[0])
+        client.delete_resourcedata(clone.id, JSONObject({'resource_attr_id': ra_ids[1]}))
+        client.update_resourcedata(clone.id, [JSONObject({'resource_attr_id': ra_ids[2],
+                                                          'dataset': None})])
+
+        clone_data = dataset_ids(clone.id)
+        assert set(clone_data) == set(ra_ids[3:])
+        assert dataset_ids(scenario.id) == original_data
+
+        #Adding a group item to a clone keeps the items it shares
+        group_id = scenario.resourcegroupitems[0].group_id
+        original_items = group_items(scenario.id, group_id)
+        clone = client.clone_scenario(scenario.id, retain_results=True, copy_on_write=True)
+        grouped_nodes = set(i[1] for i in original_items)
+        new_node = [n for n in network.nodes if n.id not in grouped_nodes][0]
+        client.add_resourcegroupitem(JSONObject({'ref_key': 'NODE',
+                                                 'ref_id': new_node.id,
+                                                 'group_id': group_id}), clone.id)
+
+        assert len(group_items(clone.id, group_id)) == len(original_items) + 1
+        assert group_items(scenario.id, group_id) == original_items
+
+        #Deleting a group item a clone shows removes it from the clone only
+        clone = client.clone_scenario(scenario.id, retain_results=True, copy_on_write=True)
+        shown_item = [i for i in client.get_scenario(clone.id).resourcegroupitems
+                      if i.group_id == group_id][0]
+        assert shown_item.scenario_id == scenario.id
+        client.delete_resourcegroupitem(shown_item.id, scenario_id=clone.id)
+
+        assert len(group_items(clone.id, group_id)) == len(original_items) - 1
+        assert group_items(scenario.id, group_id) == original_items
+
+    def test_create_scenario_ensemble(self, client, network_with_data):
+        """
+            Test that an ensemble of perturbed copy-on-write clones is created,
+            with identical datasets shared between its scenarios.
+        """
+        network = client.get_network(network_with_data.id, include_data='Y')
+        scenario = network.scenarios[0]
+
+        scalar_rs = [rs for rs in scenario.resourcescenarios if rs.dataset.type == 'scalar'][0]
+        timeseries_rs = [rs for rs in scenario.resourcescenarios if rs.dataset.type == 'timeseries'][0]
+        descriptor_rs = [rs for rs in scenario.resourcescenarios if rs.dataset.type == 'descriptor'][0]
+
+        timeseries = {"0": {"2020-01-01T00:00:00": 1.0, "2020-01-02T00:00:00": 2.0}}
+        new_timeseries = Dataset(dict(timeseries_rs.dataset))
+        new_timeseries.value = json.dumps(timeseries)
+        client.add_data_to_attribute(scenario.id, timeseries_rs.resource_attr_id, new_timeseries)
+
+        double_scalar = {'resource_attr_ids': [scalar_rs.resource_attr_id], 'scale': 2}
+        members = [
+            {'perturbations': [double_scalar]},
+            {'name': 'Shifted', 'perturbations': [double_scalar,
+                {'resource_attr_ids': [timeseries_rs.resource_attr_id], 'offset': 0.5},
+                {'resource_attr_ids': [timeseries_rs.resource_attr_id], 'scale': 2}]},
+            {'perturbations': [{'resource_attr_ids': [scalar_rs.resource_attr_id]}]},
+        ]
+
+        ensemble = client.create_scenario_ensemble(scenario.id, members)
+
+        assert [s.name for s in ensemble] == ["%s (ensemble 1)"%scenario.name,
+                                              "Shifted",
+                                              "%s (ensemble 3)"%scenario.name]
+        assert [len(s.resourcescenarios) for s in ensemble] == [1, 2, 1]
+        assert all(s.copy_on_write == 'Y' and s.parent_id == scenario.id for s in ensemble)
+
+        def member_data(member):
+            member_scenario = client.get_scenario(member.id)
+            assert len(member_scenario.resourcescenarios) == len(scenario.resourcescenarios)
+            return dict((rs.resource_attr_id, rs.dataset) for rs in member_scenario.resourcescenarios)
+
+        data_1, data_2, data_3 = [member_data(m) for m in ensemble]
+
+        assert float(data_1[scalar_rs.resource_attr_id].value) == float(scalar_rs.dataset.value) * 2
+        #The same value is the same dataset
+        assert data_1[scalar_rs.resource_attr_id].id == data_2[scalar_rs.resource_attr_id].id
+        assert data_3[scalar_rs.resource_attr_id].id == scalar_rs.dataset.id
+
+        shifted = json.loads(data_2[timeseries_rs.resource_attr_id].value)
+        assert list(shifted["0"].values()) == [3.0, 5.0]
+        assert len(client.compare_scenarios(scenario.id, ensemble[1].id).resourcescenarios) == 2
+
+        with pytest.raises(HydraError):
+            client.create_scenario_ensemble(scenario.id, [{'name': 'Shifted'}])
+
+        with pytest.raises(HydraError):
+            client.create_scenario_ensemble(scenario.id, [{'perturbations': [
+                {'resource_attr_ids': [descriptor_rs.resource_attr_id], 'scale': 2}]}])
+
     def test_get_inherited_data(self, client, network_with_child_scenario):
 
         network = network_with_child_scenario
@@ -672,6 +955,50 @@ class TestScenario:
 
 
 
+    @pytest.mark.parametrize("recursive", [True, False])
+    def test_closest_inherited_data(self, client, network_with_grandchild_scenario, monkeypatch, recursive):
+        """
+            Test that where a scenario and its ancestors all have data for a
+            resource attribute, the data of the closest scenario is used.
+        """
+        monkeypatch.setattr(hydra_base.db.model, '_supports_recursive_queries', lambda bind: recursive)
+
+        network = network_with_grandchild_scenario
+        parent, child, grandchild = sorted(network.scenarios, key=lambda x : x.id)
+
+        parent_rs = sorted(parent.resourcescenarios, key=lambda rs: rs.resource_attr_id)
+        ra_a, ra_b = parent_rs[0].resource_attr_id, parent_rs[1].resource_attr_id
+        dataset_1, dataset_2 = parent_rs[2].dataset.id, parent_rs[3].dataset.id
+
+        #A is overridden by the child. B by the child and the grandchild.
+        for scenario_id, ra_id, dataset_id in ((child.id, ra_a, dataset_1),
+                                               (child.id, ra_b, dataset_1),
+                                               (grandchild.id, ra_b, dataset_2)):
+            hydra_base.db.DBSession.add(hydra_base.db.model.ResourceScenario(scenario_id=scenario_id,
+                                                             resource_attr_id=ra_id,
+                                                             dataset_id=dataset_id))
+        hydra_base.commit_transaction()
+
+        grandchild_i = hydra_base.db.DBSession.query(hydra_base.db.model.Scenario).filter_by(id=grandchild.id).one()
+        assert grandchild_i.get_ancestor_ids() == [grandchild.id, child.id, parent.id]
+
+        data = grandchild_i.get_data(get_parent_data=True)
+        assert len(data) == len(parent_rs)
+        assert len(set(rs.resource_attr_id for rs in data)) == len(data)
+
+        by_ra = dict((rs.resource_attr_id, rs) for rs in data)
+        assert (by_ra[ra_a].scenario_id, by_ra[ra_a].dataset_id) == (child.id, dataset_1)
+        assert (by_ra[ra_b].scenario_id, by_ra[ra_b].dataset_id) == (grandchild.id, dataset_2)
+        assert all(rs.scenario_id == parent.id for rs in data if rs.resource_attr_id not in (ra_a, ra_b))
+        #The closest scenario's data comes first
+        assert data[0].scenario_id == grandchild.id
+
+        data = grandchild_i.get_data(get_parent_data=True, ra_ids=[ra_a, ra_b])
+        assert sorted((rs.resource_attr_id, rs.scenario_id) for rs in data) == \
+                sorted([(ra_a, child.id), (ra_b, grandchild.id)])
+
+        assert len(grandchild_i.get_data()) == 1
+
     def test_inherited_get_resource_scenario(self, client, network_with_child_scenario):
 
         network = network_with_child_scenario
@@ -1206,6 +1533,61 @@ class TestScenario:
                 matching_rs = rs_dict[rs.resource_attr_id]
                 assert str(rs.dataset.hash) == str(matching_rs.dataset.hash)
 
+    def test_compare_scenarios_with_deltas(self, client, network_with_data):
+        """
+            Test that comparing two scenarios finds the data which differs, and
+            the numeric differences between their values.
+        """
+        network = client.get_network(network_with_data.id, include_data='Y')
+        scenario = network.scenarios[0]
+
+        scalar_rs = [rs for rs in scenario.resourcescenarios if rs.dataset.type == 'scalar'][0]
+        timeseries_rs = [rs for rs in scenario.resourcescenarios if rs.dataset.type == 'timeseries'][0]
+
+        times = ["2020-01-0%sT00:00:00"%(i+1) for i in range(4)]
+        timeseries = {"0": dict((t, float(i)) for i, t in enumerate(times)),
+                      "1": dict((t, float(i * 10)) for i, t in enumerate(times))}
+        new_timeseries = Dataset(dict(timeseries_rs.dataset))
+        new_timeseries.value = json.dumps(timeseries)
+        client.add_data_to_attribute(scenario.id, timeseries_rs.resource_attr_id, new_timeseries)
+
+        clone = client.clone_scenario(scenario.id, retain_results=True)
+
+        new_scalar = Dataset(dict(scalar_rs.dataset))
+        new_scalar.value = float(scalar_rs.dataset.value) + 2.5
+        client.add_data_to_attribute(clone.id, scalar_rs.resource_attr_id, new_scalar)
+
+        #Every value is 1 greater, and the first of the first column 4 greater.
+        for column in timeseries.values():
+            for t in column:
+                column[t] += 1
+        timeseries["0"][times[0]] += 3
+        new_timeseries.value = json.dumps(timeseries)
+        client.add_data_to_attribute(clone.id, timeseries_rs.resource_attr_id, new_timeseries)
+
+        scenario_diff = JSONObject(client.compare_scenarios(scenario.id, clone.id, include_deltas='Y'))
+        diffs = dict((d.resource_attr_id, d) for d in scenario_diff.resourcescenarios)
+        assert sorted(diffs.keys()) == sorted([scalar_rs.resource_attr_id,
+                                               timeseries_rs.resource_attr_id])
+
+        scalar_diff = diffs[scalar_rs.resource_attr_id]
+        assert scalar_diff.scenario_1_dataset.id == scalar_rs.dataset.id
+        assert scalar_diff.delta.count == 1
+        assert scalar_diff.delta.max_abs_diff == pytest.approx(2.5)
+
+        timeseries_delta = diffs[timeseries_rs.resource_attr_id].delta
+        assert timeseries_delta.count == 8
+        assert timeseries_delta.max_abs_diff == pytest.approx(4)
+        assert timeseries_delta.rmse == pytest.approx(((7 + 16) / 8.) ** 0.5)
+
+        #Streamed in chunks of one, in both directions
+        chunks = list(hydra_base.lib.scenario.iter_scenario_diff(clone.id, scenario.id,
+                                                                 chunk_size=1,
+                                                                 user_id=pytest.root_user_id))
+        assert [len(c) for c in chunks] == [1, 1]
+        assert sorted(c[0]['resource_attr_id'] for c in chunks) == sorted(diffs.keys())
+        assert all('delta' not in c[0] for c in chunks)
+
     def test_copy_data_from_scenario(self, client, network_with_data):
 
         """